@@ -0,0 +1,40 @@
+import logging
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """
+    Допуск входящих сообщений при перегрузке (load shedding).
+
+    Очередь входящих ограничена: для каждого тарифа свой порог заполненности,
+    после которого новые сообщения этого тарифа не принимаются. Пороги для
+    бесплатного тарифа ниже, поэтому при насыщении платные пользователи
+    продолжают обслуживаться, а бесплатные получают короткий ответ о высокой нагрузке.
+    """
+
+    def __init__(self, limits: dict = None, queue_limit: int = None):
+        self.queue_limit = queue_limit or Config.INBOUND_QUEUE_LIMIT
+        self.limits = limits or {
+            'free': Config.INBOUND_HIGH_WATERMARK_FREE,
+            'lite': Config.INBOUND_HIGH_WATERMARK_LITE,
+        }
+
+    @property
+    def lowest_limit(self) -> int:
+        """Ниже этой заполненности очереди принимается всё, тариф можно не проверять"""
+        return min([self.queue_limit, *self.limits.values()])
+
+    def limit_for(self, plan: str) -> int:
+        # premium и admin_unlimited принимаются до полного заполнения очереди
+        return min(self.limits.get(plan, self.queue_limit), self.queue_limit)
+
+    def admit(self, plan: str, pending: int) -> bool:
+        """Принимает ли очередь с pending задачами еще одно сообщение пользователя с тарифом plan"""
+        if pending < self.limit_for(plan):
+            return True
+        metrics.increment(f'inbound.shed.{plan}')
+        logger.warning(f"Высокая нагрузка: в очереди {pending} сообщений, сообщение тарифа {plan} отклонено")
+        return False
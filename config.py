@@ -4,19 +4,89 @@ from dotenv import load_dotenv
 # Загружаем переменные окружения
 load_dotenv('config.env')
 
+
+def _collect_deepseek_keys() -> list:
+    """
+    Ключи DeepSeek из DEEPSEEK_API_KEYS (через запятую) и из
+    DEEPSEEK_API_KEY, DEEPSEEK_API_KEY_2, DEEPSEEK_API_KEY_3, ... (до первого пропуска)
+    """
+    keys = [key.strip() for key in os.getenv('DEEPSEEK_API_KEYS', '').split(',')]
+    keys.append(os.getenv('DEEPSEEK_API_KEY'))
+    number = 2
+    while os.getenv(f'DEEPSEEK_API_KEY_{number}'):
+        keys.append(os.getenv(f'DEEPSEEK_API_KEY_{number}'))
+        number += 1
+    # Убираем пустые и повторяющиеся ключи, сохраняя порядок
+    return list(dict.fromkeys(key.strip() for key in keys if key and key.strip()))
+
+
 class Config:
     # VK API настройки
     VK_TOKEN = os.getenv('VK_TOKEN')
     VK_GROUP_ID = int(os.getenv('VK_GROUP_ID', 0))
+    # Источник событий: 'longpoll' (Bots Long Poll API) или 'callback' (Callback API)
+    VK_INGRESS = os.getenv('VK_INGRESS', 'longpoll').strip().lower()
+    VK_CALLBACK_HOST = os.getenv('VK_CALLBACK_HOST', '0.0.0.0')
+    VK_CALLBACK_PORT = int(os.getenv('VK_CALLBACK_PORT', 8080))
+    VK_CALLBACK_PATH = os.getenv('VK_CALLBACK_PATH', '/vk/callback')
+    VK_CONFIRMATION_CODE = os.getenv('VK_CONFIRMATION_CODE')  # Строка, которую должен вернуть сервер (Настройки → Callback API)
+    VK_CALLBACK_SECRET = os.getenv('VK_CALLBACK_SECRET')  # Секретный ключ из настроек Callback API
+    VK_API_URL = os.getenv('VK_API_URL', 'https://api.vk.com/method')
+    VK_API_VERSION = os.getenv('VK_API_VERSION', '5.131')
+    VK_MAX_CONNECTIONS = int(os.getenv('VK_MAX_CONNECTIONS', 100))  # Размер пула соединений к VK API
+    VK_REQUEST_TIMEOUT = int(os.getenv('VK_REQUEST_TIMEOUT', 15))
+    VK_RATE_LIMIT = float(os.getenv('VK_RATE_LIMIT', 20))  # Лимит запросов к VK API в секунду (для сообщества ~20)
+    VK_EXECUTE_BATCH_SIZE = int(os.getenv('VK_EXECUTE_BATCH_SIZE', 25))  # Сколько вызовов объединять в один execute (максимум 25)
     
     # DeepSeek API настройки (поддержка нескольких ключей для балансировки нагрузки)
     DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
     DEEPSEEK_API_KEY_2 = os.getenv('DEEPSEEK_API_KEY_2')
     DEEPSEEK_API_KEY_3 = os.getenv('DEEPSEEK_API_KEY_3')
+    DEEPSEEK_API_KEYS = _collect_deepseek_keys()  # Все ключи: DEEPSEEK_API_KEYS и DEEPSEEK_API_KEY, _2, _3, ...
+    # Балансировка ключей и circuit breaker
+    DEEPSEEK_KEY_WINDOW = int(os.getenv('DEEPSEEK_KEY_WINDOW', 20))  # По скольким последним запросам считать долю ошибок ключа
+    DEEPSEEK_DEFAULT_LATENCY = float(os.getenv('DEEPSEEK_DEFAULT_LATENCY', 5))  # Ожидаемое время ответа ключа без статистики, с
+    DEEPSEEK_LATENCY_EWMA_ALPHA = float(os.getenv('DEEPSEEK_LATENCY_EWMA_ALPHA', 0.2))  # Вес нового замера в скользящей задержке
+    DEEPSEEK_CIRCUIT_FAILURES = int(os.getenv('DEEPSEEK_CIRCUIT_FAILURES', 3))  # Ошибок подряд, после которых ключ выводится из ротации
+    DEEPSEEK_CIRCUIT_ERROR_RATE = float(os.getenv('DEEPSEEK_CIRCUIT_ERROR_RATE', 0.5))  # Или доля ошибок в окне
+    DEEPSEEK_CIRCUIT_COOLDOWN = float(os.getenv('DEEPSEEK_CIRCUIT_COOLDOWN', 30))  # Пауза перед пробным запросом, с
+    DEEPSEEK_CIRCUIT_MAX_COOLDOWN = float(os.getenv('DEEPSEEK_CIRCUIT_MAX_COOLDOWN', 600))  # Максимальная пауза после неудачных проб, с
+    DEEPSEEK_KEY_FATAL_COOLDOWN = float(os.getenv('DEEPSEEK_KEY_FATAL_COOLDOWN', 900))  # Пауза для ключа с 401/402 (нет баланса, ключ отозван), с
+    DEEPSEEK_KEY_AFFINITY_SLACK = float(os.getenv('DEEPSEEK_KEY_AFFINITY_SLACK', 1.5))  # Продолжать диалог на том же ключе (кеш контекста), если он не медленнее лучшего в N раз
+    # Коэффициент списания токенов промпта, взятых из кеша контекста DeepSeek (1.0 — как обычные)
+    DEEPSEEK_CACHED_TOKEN_BILLING_RATIO = float(os.getenv('DEEPSEEK_CACHED_TOKEN_BILLING_RATIO', 1.0))
+    # Дублирование медленных запросов на другой ключ (hedging)
+    DEEPSEEK_HEDGING = os.getenv('DEEPSEEK_HEDGING', 'false').lower() == 'true'
+    DEEPSEEK_HEDGE_PERCENTILE = float(os.getenv('DEEPSEEK_HEDGE_PERCENTILE', 95))  # Дублировать, если нет ответа дольше этого перцентиля недавних задержек
+    DEEPSEEK_HEDGE_BUDGET = float(os.getenv('DEEPSEEK_HEDGE_BUDGET', 0.05))  # Максимальная доля запросов, которые можно дублировать
+    DEEPSEEK_HEDGE_MIN_SAMPLES = int(os.getenv('DEEPSEEK_HEDGE_MIN_SAMPLES', 20))  # Сколько замеров нужно, чтобы доверять перцентилю
+    DEEPSEEK_HEDGE_DEFAULT_DELAY = float(os.getenv('DEEPSEEK_HEDGE_DEFAULT_DELAY', 10))  # Задержка перед дублем, пока замеров мало, с
+    DEEPSEEK_HEDGE_MIN_DELAY = float(os.getenv('DEEPSEEK_HEDGE_MIN_DELAY', 1))  # Не дублировать раньше, с
     DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
+    DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+    DEEPSEEK_MAX_CONNECTIONS = int(os.getenv('DEEPSEEK_MAX_CONNECTIONS', 50))  # Макс. соединений к api.deepseek.com
+    DEEPSEEK_KEEPALIVE_TIMEOUT = int(os.getenv('DEEPSEEK_KEEPALIVE_TIMEOUT', 60))  # Сколько секунд держать простаивающее соединение
+    DEEPSEEK_MAX_CONCURRENT_PER_KEY = int(os.getenv('DEEPSEEK_MAX_CONCURRENT_PER_KEY', 10))  # Одновременных запросов на один ключ, остальные ждут в очереди по тарифам
 
     # Yandex Vision API настройки (поддержка нескольких аккаунтов для балансировки)
     YANDEX_FOLDER_ID = os.getenv('YANDEX_FOLDER_ID')
+    YANDEX_IAM_URL = os.getenv('YANDEX_IAM_URL', 'https://iam.api.cloud.yandex.net/iam/v1/tokens')
+    YANDEX_OCR_URL = os.getenv('YANDEX_OCR_URL', 'https://ocr.api.cloud.yandex.net/ocr/v1/recognizeText')
+    YANDEX_MAX_CONCURRENT_PER_ACCOUNT = int(os.getenv('YANDEX_MAX_CONCURRENT_PER_ACCOUNT', 4))  # Одновременных распознаваний на один аккаунт
+    YANDEX_MAX_CONNECTIONS = int(os.getenv('YANDEX_MAX_CONNECTIONS', 20))  # Макс. соединений к одному хосту (OCR, IAM, сервер с фото)
+    OCR_MAX_PARALLEL_PER_MESSAGE = int(os.getenv('OCR_MAX_PARALLEL_PER_MESSAGE', 4))  # Сколько фото из одного сообщения распознавать одновременно
+    YANDEX_IAM_REFRESH_INTERVAL = float(os.getenv('YANDEX_IAM_REFRESH_INTERVAL', 3600))  # Как часто заранее обновлять IAM-токен (живет до 12 часов), с
+    YANDEX_IAM_REFRESH_JITTER = float(os.getenv('YANDEX_IAM_REFRESH_JITTER', 0.1))  # Случайный разброс момента обновления (доля интервала)
+    # Кеш распознанного текста (одни и те же фото заданий присылают много раз)
+    OCR_CACHE_ENABLED = os.getenv('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+    OCR_CACHE_TTL = float(os.getenv('OCR_CACHE_TTL', 7 * 86400))  # Сколько секунд хранить текст
+    OCR_CACHE_MAX_BYTES = int(os.getenv('OCR_CACHE_MAX_BYTES', 16 * 1024 * 1024))  # Предел кеша в памяти процесса (на каждый из двух индексов)
+    OCR_CACHE_POSTGRES = os.getenv('OCR_CACHE_POSTGRES', 'true').lower() == 'true'  # Хранить кеш и в PostgreSQL (если он доступен)
+    # Подготовка фото к OCR: выбор размера VK и пережатие (пережатие — только если установлен Pillow)
+    OCR_TARGET_MIN_SIDE = int(os.getenv('OCR_TARGET_MIN_SIDE', 800))  # Короткая сторона, достаточная для распознавания текста, px
+    OCR_RECOMPRESS = os.getenv('OCR_RECOMPRESS', 'true').lower() == 'true'  # Пережимать крупные фото перед отправкой в OCR
+    OCR_MAX_IMAGE_BYTES = int(os.getenv('OCR_MAX_IMAGE_BYTES', 1024 * 1024))  # Фото больше этого размера уменьшаются и пережимаются в JPEG
+    OCR_JPEG_QUALITY = int(os.getenv('OCR_JPEG_QUALITY', 85))  # Начальное качество JPEG при пережатии
     YANDEX_SERVICE_ACCOUNT_ID = os.getenv('YANDEX_SERVICE_ACCOUNT_ID')
     YANDEX_API_KEY_ID = os.getenv('YANDEX_API_KEY_ID')
     YANDEX_API_SECRET_KEY = os.getenv('YANDEX_API_SECRET_KEY')
@@ -32,6 +102,7 @@ class Config:
     # YooKassa API настройки
     YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
     YOOKASSA_API_KEY = os.getenv('YOOKASSA_API_KEY')
+    YOOKASSA_BASE_URL = os.getenv('YOOKASSA_BASE_URL', 'https://api.yookassa.ru/v3')
 
     # Database (PostgreSQL)
     DB_HOST = os.getenv('DB_HOST', 'localhost')
@@ -44,16 +115,65 @@ class Config:
     BOT_PREFIX = os.getenv('BOT_PREFIX', '!')
     MAX_MESSAGE_LENGTH = int(os.getenv('MAX_MESSAGE_LENGTH', 4096))
     USERS_FILE = "users.json"  # Файл для хранения данных пользователей
-    MAX_HISTORY_MESSAGES = 10  # Сколько последних сообщений хранить в истории (5 пар)
+    DEEPSEEK_STREAMING = os.getenv('DEEPSEEK_STREAMING', 'true').lower() == 'true'  # Показывать ответ по мере генерации
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))  # Не чаще одного редактирования сообщения за N секунд
+    MAX_HISTORY_MESSAGES = int(os.getenv('MAX_HISTORY_MESSAGES', 10))  # Сколько последних сообщений хранить в истории (5 пар)
+    # Бюджет истории в токенах (оценка) для каждого тарифа: старые сообщения обрезаются и отбрасываются
+    HISTORY_TOKEN_BUDGET_FREE = int(os.getenv('HISTORY_TOKEN_BUDGET_FREE', 1500))
+    HISTORY_TOKEN_BUDGET_LITE = int(os.getenv('HISTORY_TOKEN_BUDGET_LITE', 3000))
+    HISTORY_TOKEN_BUDGET_PREMIUM = int(os.getenv('HISTORY_TOKEN_BUDGET_PREMIUM', 6000))
+    HISTORY_MESSAGE_MAX_TOKENS = int(os.getenv('HISTORY_MESSAGE_MAX_TOKENS', 800))  # До скольки токенов обрезать старые длинные сообщения (OCR-промпты, длинные ответы)
+    # Сжатие истории: старые сообщения заменяются кратким содержанием (в фоне, не задерживая ответ)
+    HISTORY_SUMMARY_ENABLED = os.getenv('HISTORY_SUMMARY_ENABLED', 'true').lower() == 'true'
+    HISTORY_SUMMARY_TRIGGER_RATIO = float(os.getenv('HISTORY_SUMMARY_TRIGGER_RATIO', 0.75))  # Сжимать, когда история заняла такую долю бюджета
+    HISTORY_SUMMARY_KEEP_MESSAGES = int(os.getenv('HISTORY_SUMMARY_KEEP_MESSAGES', 4))  # Сколько последних сообщений не сжимать
+    HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv('HISTORY_SUMMARY_MAX_TOKENS', 300))  # Предел длины краткого содержания
+    MAX_CONCURRENT_MESSAGES = int(os.getenv('MAX_CONCURRENT_MESSAGES', 50))  # Сколько сообщений обрабатывается одновременно
+    BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))  # Количество процессов-обработчиков (1 — однопроцессный режим)
+    WORKER_QUEUE_SIZE = int(os.getenv('WORKER_QUEUE_SIZE', 10000))  # Размер очереди сообщений каждого воркера
+    WORKER_HEALTHCHECK_INTERVAL = float(os.getenv('WORKER_HEALTHCHECK_INTERVAL', 2))  # Как часто проверять, живы ли воркеры
+    WORKER_SHUTDOWN_TIMEOUT = float(os.getenv('WORKER_SHUTDOWN_TIMEOUT', 30))  # Сколько ждать завершения обработки при остановке
+    # Защита от перегрузки: общий предел очереди входящих и пороги для тарифов,
+    # после которых сообщения тарифа отклоняются (premium — только при полной очереди)
+    INBOUND_QUEUE_LIMIT = int(os.getenv('INBOUND_QUEUE_LIMIT', 1000))
+    INBOUND_HIGH_WATERMARK_FREE = int(os.getenv('INBOUND_HIGH_WATERMARK_FREE', 300))
+    INBOUND_HIGH_WATERMARK_LITE = int(os.getenv('INBOUND_HIGH_WATERMARK_LITE', 600))
+    OVERLOAD_NOTICE_INTERVAL = float(os.getenv('OVERLOAD_NOTICE_INTERVAL', 30))  # Не чаще раза в N секунд отвечать "высокая нагрузка"
+    METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', 300))  # Как часто писать сводку метрик в лог (0 — не писать)
+    USER_QUEUE_IDLE_TIMEOUT = float(os.getenv('USER_QUEUE_IDLE_TIMEOUT', 60))  # Через сколько секунд простоя удалять очередь пользователя
+    # Кеш ответов DeepSeek на одинаковые запросы (тот же промпт, история и сообщение)
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 86400))  # Сколько секунд хранить ответ
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # Предел кеша в памяти процесса
+    RESPONSE_CACHE_POSTGRES = os.getenv('RESPONSE_CACHE_POSTGRES', 'true').lower() == 'true'  # Хранить кеш и в PostgreSQL (если он доступен)
+    RESPONSE_CACHE_PLANS = [plan.strip() for plan in os.getenv('RESPONSE_CACHE_PLANS', 'free,lite,premium,admin_unlimited').split(',') if plan.strip()]  # Тарифы, которым отвечаем из кеша
+    RESPONSE_CACHE_CHARGE_PLANS = [plan.strip() for plan in os.getenv('RESPONSE_CACHE_CHARGE_PLANS', 'free,lite,premium').split(',') if plan.strip()]  # Тарифы, которым ответ из кеша списывается как обычный
+    # Повторы запросов к внешним API и общий дедлайн обработки сообщения
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 3))  # Сколько всего попыток на один запрос
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.5))  # Базовая пауза перед повтором, удваивается с каждой попыткой
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 5))  # Предел паузы перед повтором
+    MESSAGE_DEADLINE = float(os.getenv('MESSAGE_DEADLINE', 180))  # За сколько секунд с момента получения сообщение должно быть обработано
+    # Веса тарифов в очереди к DeepSeek и Yandex Vision: при нехватке слотов тариф получает долю, пропорциональную весу.
+    # Ожидание в этой очереди занимает слот MAX_CONCURRENT_MESSAGES, поэтому его стоит держать выше числа слотов к API
+    SCHEDULER_WEIGHT_FREE = float(os.getenv('SCHEDULER_WEIGHT_FREE', 1))
+    SCHEDULER_WEIGHT_LITE = float(os.getenv('SCHEDULER_WEIGHT_LITE', 2))
+    SCHEDULER_WEIGHT_PREMIUM = float(os.getenv('SCHEDULER_WEIGHT_PREMIUM', 4))
+    SCHEDULER_WEIGHT_ADMIN = float(os.getenv('SCHEDULER_WEIGHT_ADMIN', 8))
+    SCHEDULER_WEIGHT_BACKGROUND = float(os.getenv('SCHEDULER_WEIGHT_BACKGROUND', 0.5))  # Фоновая работа (сжатие истории), ниже всех тарифов
     
     # Проверяем обязательные переменные
     @classmethod
     def validate(cls):
         required_vars = ['VK_TOKEN', 'DEEPSEEK_API_KEY', 'YOOKASSA_SHOP_ID', 'YOOKASSA_API_KEY']
+        if cls.VK_INGRESS == 'callback':
+            required_vars.append('VK_CONFIRMATION_CODE')
         missing_vars = []
         
         for var in required_vars:
             value = getattr(cls, var)
+            if var == 'DEEPSEEK_API_KEY':
+                # Достаточно любого ключа: DEEPSEEK_API_KEY или DEEPSEEK_API_KEYS
+                value = cls.DEEPSEEK_API_KEYS
             if not value or (isinstance(value, str) and value.strip() in ['', '000000', 'your_yookassa_shop_id_here', 'your_yookassa_api_key_here']):
                 missing_vars.append(var)
         
@@ -15,8 +15,8 @@ class DatabaseManager:
         self.connection_pool = None
         
         try:
-            # Создаем пул соединений PostgreSQL
-            self.connection_pool = psycopg2.pool.SimpleConnectionPool(
+            # Создаем пул соединений PostgreSQL (потокобезопасный: часть запросов идет из asyncio.to_thread)
+            self.connection_pool = psycopg2.pool.ThreadedConnectionPool(
                 1,  # минимум соединений
                 10, # максимум соединений
                 host=Config.DB_HOST,
@@ -100,6 +100,19 @@ class DatabaseManager:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscription_type ON users(subscription_type)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_last_activity ON users(last_activity)")
+
+            # Общий кеш ответов (переживает перезапуск и общий для всех процессов)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    namespace VARCHAR(50) NOT NULL,
+                    cache_key CHAR(64) NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at TIMESTAMP NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (namespace, cache_key)
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at)")
             
             # Вставляем/Обновляем тарифные планы
             cursor.execute("""
@@ -414,6 +427,80 @@ class DatabaseManager:
         finally:
             self.put_connection(conn)
     
+    def get_cache_entry(self, namespace: str, cache_key: str):
+        """
+        Возвращает (value, оставшийся TTL в секундах) из response_cache или None,
+        если записи нет или она устарела. Время считается по часам PostgreSQL
+        """
+        conn = self.get_connection()
+        if not conn:
+            return None
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT value, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) FROM response_cache
+                WHERE namespace = %s AND cache_key = %s AND expires_at > CURRENT_TIMESTAMP
+            """, (namespace, cache_key))
+            row = cursor.fetchone()
+            cursor.close()
+            return (row[0], float(row[1])) if row else None
+
+        except (Exception, psycopg2.DatabaseError) as err:
+            conn.rollback()
+            logger.error(f"❌ Ошибка чтения кеша {namespace}: {err}")
+            return None
+        finally:
+            self.put_connection(conn)
+
+    def set_cache_entry(self, namespace: str, cache_key: str, value: str, ttl: float) -> bool:
+        """Сохраняет запись в response_cache на ttl секунд (перезаписывает существующую)"""
+        conn = self.get_connection()
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO response_cache (namespace, cache_key, value, expires_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                ON CONFLICT (namespace, cache_key) DO UPDATE SET
+                    value = EXCLUDED.value,
+                    expires_at = EXCLUDED.expires_at,
+                    created_at = CURRENT_TIMESTAMP
+            """, (namespace, cache_key, value, ttl))
+            conn.commit()
+            cursor.close()
+            return True
+
+        except (Exception, psycopg2.DatabaseError) as err:
+            conn.rollback()
+            logger.error(f"❌ Ошибка записи в кеш {namespace}: {err}")
+            return False
+        finally:
+            self.put_connection(conn)
+
+    def delete_expired_cache_entries(self) -> int:
+        """Удаляет устаревшие записи response_cache, возвращает их количество"""
+        conn = self.get_connection()
+        if not conn:
+            return 0
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM response_cache WHERE expires_at <= CURRENT_TIMESTAMP")
+            deleted = cursor.rowcount
+            conn.commit()
+            cursor.close()
+            return deleted
+
+        except (Exception, psycopg2.DatabaseError) as err:
+            conn.rollback()
+            logger.error(f"❌ Ошибка очистки кеша: {err}")
+            return 0
+        finally:
+            self.put_connection(conn)
+
     def close(self):
         """Закрывает все соединения в пуле"""
         if self.connection_pool:
@@ -1,93 +1,412 @@
 import requests
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Awaitable
 from config import Config
 import aiohttp
 import asyncio
 import logging
+import time
+from response_cache import ResponseCache
+from metrics import metrics
+from hedging import HedgeBudget, HedgedCall, hedge_delay
+from retry_policy import Deadline, DeadlineExceeded, RetryPolicy, is_retryable_status, retry_async
+from upstream_scheduler import UpstreamScheduler, current_plan
+from deepseek_key_pool import (
+    DeepSeekKeyPool, OUTCOME_OK, OUTCOME_FAILURE, OUTCOME_FATAL, OUTCOME_NEUTRAL
+)
 
 logger = logging.getLogger(__name__)
 
+# Системный промпт, который отправляется первым сообщением в каждом запросе
+SYSTEM_PROMPT = "Ты — полезный ИИ-ассистент в боте для ВКонтакте. Твои ответы должны быть только в формате простого текста. Не используй Markdown, LaTeX или любые другие виды форматирования. Для математических формул и символов используй символы Unicode (например, Δ, Ω, ≈, →, α) вместо команд LaTeX (например, \\Delta, \\Omega, \\approx, \\rightarrow, \\alpha). Ответы давай на русском языке. Всегда уделяй первостепенное внимание последнему сообщению от пользователя. Если оно представляет собой новый вопрос или тему, отвечай на него, даже если это противоречит предыдущему контексту."
+
+# Префикс системного сообщения с кратким содержанием ранней части диалога
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога: "
+
 class DeepSeekClient:
     def __init__(self):
         # Поддержка нескольких API ключей для распределения нагрузки
-        self.api_keys = [
-            Config.DEEPSEEK_API_KEY,
-            Config.DEEPSEEK_API_KEY_2,
-            Config.DEEPSEEK_API_KEY_3
-        ]
-        # Фильтруем пустые ключи
-        self.api_keys = [key for key in self.api_keys if key]
+        self.api_keys = list(Config.DEEPSEEK_API_KEYS)
         
         if not self.api_keys:
             logger.warning("⚠️ Нет доступных API ключей DeepSeek!")
         
-        self.base_url = Config.DEEPSEEK_BASE_URL
-        self.current_key_index = 0
+        # Выбор ключа под каждый запрос: наименее загруженный из здоровых
+        self.key_pool = DeepSeekKeyPool(self.api_keys)
+        # Ограничение доли дублирующих запросов (hedging)
+        self.hedge_budget = HedgeBudget(Config.DEEPSEEK_HEDGE_BUDGET)
+        # Планировщик запросов (UpstreamScheduler) бота: дубль занимает в нем отдельный слот
+        self.scheduler: Optional[UpstreamScheduler] = None
+        self.retry_policy = RetryPolicy()
+        self.base_url = Config.DEEPSEEK_BASE_URL.rstrip('/')
+        # Общая сессия с пулом keep-alive соединений, создается при первом запросе
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Возвращает общую HTTP-сессию, чтобы не платить за DNS + TCP + TLS на каждый запрос
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=Config.DEEPSEEK_MAX_CONNECTIONS,
+                ttl_dns_cache=300,
+                keepalive_timeout=Config.DEEPSEEK_KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Закрывает HTTP-сессию (при остановке бота)"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("🔒 Сессия DeepSeek закрыта")
     
-    def _get_next_api_key(self) -> tuple:
-        """Возвращает следующий API ключ по кругу (round-robin)
-        Returns: (api_key, key_index)"""
+    def _acquire_key(self, payload: dict):
+        """Берет ключ из пула. Возвращает (key, сообщение об ошибке для пользователя)"""
         if not self.api_keys:
-            return None, -1
-        
-        current_index = self.current_key_index
-        api_key = self.api_keys[current_index]
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        return api_key, current_index
+            return None, "Нет ключа DeepSeek API"
+        # Продолжение диалога — на тот же ключ, где его начало уже в кеше контекста
+        key = self.key_pool.acquire(affinity=self._affinity_key(payload['messages'][:-1]))
+        if key is None:
+            logger.error("Все ключи DeepSeek временно выведены из ротации.")
+            return None, "Сервис AI временно недоступен. Попробуйте через минуту."
+        return key, None
+
+    @staticmethod
+    def _outcome_for_status(status: int) -> str:
+        """Как ответ API влияет на здоровье ключа"""
+        if status in (401, 402):
+            return OUTCOME_FATAL
+        if status in (408, 429) or status >= 500:
+            return OUTCOME_FAILURE
+        return OUTCOME_NEUTRAL
     
-    async def generate_response(self, messages: list) -> (str, int):
+    @staticmethod
+    def _affinity_key(messages: list) -> str:
+        """Отпечаток префикса диалога для привязки к ключу"""
+        return ResponseCache.make_key([[message.get('role'), message.get('content')] for message in messages])
+
+    def _account_usage(self, key, usage: dict, payload: dict, content: str) -> int:
         """
-        Генерирует ответ от DeepSeek на основе истории сообщений.
-        Возвращает ответ и количество использованных токенов.
-        Использует round-robin для распределения запросов между API ключами.
+        Учитывает usage ответа: попадания в кеш контекста (метрики и статистика ключа).
+        Возвращает токены к списанию с пользователя: токены из кеша считаются
+        с коэффициентом DEEPSEEK_CACHED_TOKEN_BILLING_RATIO
         """
-        api_key, key_index = self._get_next_api_key()
-        if not api_key:
-            return "Нет ключа DeepSeek API", 0
+        total = usage.get('total_tokens') or 0
+        hit = usage.get('prompt_cache_hit_tokens') or 0
+        miss = usage.get('prompt_cache_miss_tokens') or 0
+        metrics.increment('deepseek.prompt_cache.hit_tokens', hit)
+        metrics.increment('deepseek.prompt_cache.miss_tokens', miss)
+        # Следующий запрос этого диалога начнется с payload + ответ
+        affinity = self._affinity_key(payload['messages'] + [{"role": "assistant", "content": content}])
+        self.key_pool.record_usage(key, hit, miss, affinity)
+        if not (hit or miss):
+            return total
 
-        headers = {
+        completion = usage.get('completion_tokens') or max(0, total - hit - miss)
+        logger.info(f"Токены DeepSeek: промпт из кеша {hit}, промпт без кеша {miss}, ответ {completion}")
+        return max(1, round(hit * Config.DEEPSEEK_CACHED_TOKEN_BILLING_RATIO) + miss + completion)
+
+    def _build_headers(self, api_key: str) -> dict:
+        return {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}"
         }
-        
-        logger.info(f"Используется API ключ #{key_index + 1} из {len(self.api_keys)}")
 
-        # Формируем промпт с контекстом
-        system_prompt = "Ты — полезный ИИ-ассистент в боте для ВКонтакте. Твои ответы должны быть только в формате простого текста. Не используй Markdown, LaTeX или любые другие виды форматирования. Для математических формул и символов используй символы Unicode (например, Δ, Ω, ≈, →, α) вместо команд LaTeX (например, \\Delta, \\Omega, \\approx, \\rightarrow, \\alpha). Ответы давай на русском языке. Всегда уделяй первостепенное внимание последнему сообщению от пользователя. Если оно представляет собой новый вопрос или тему, отвечай на него, даже если это противоречит предыдущему контексту."
-        
+    def _build_payload(self, messages: list, stream: bool, summary: str = None,
+                       system_prompt: str = SYSTEM_PROMPT, max_tokens: int = None) -> dict:
+        """
+        Формирует тело запроса: системный промпт, краткое содержание
+        ранней части диалога (если есть) и история сообщений.
+        Порядок не менять: DeepSeek кеширует общий префикс запросов, поэтому
+        неизменный системный промпт всегда первый, затем то, что меняется редко
+        (краткое содержание), и в конце реплики диалога
+        """
+        system_messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            system_messages.append({"role": "system", "content": f"{SUMMARY_PREFIX}{summary}"})
         payload = {
-            "model": "deepseek-chat",
+            "model": Config.DEEPSEEK_MODEL,
             "messages": [
-                {"role": "system", "content": system_prompt},
+                *system_messages,
                 *messages
             ],
-            "stream": False
+            "stream": stream
         }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        if stream:
+            # Просим прислать usage последним чанком, чтобы списать токены
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def cache_key(self, messages: list, summary: str = None) -> str:
+        """
+        Ключ кеша ответа: системный промпт, модель, краткое содержание
+        и сообщения с нормализованными пробелами (роль + текст)
+        """
+        normalized = [
+            [message.get('role'), ' '.join(str(message.get('content') or '').split())]
+            for message in messages
+        ]
+        return ResponseCache.make_key(SYSTEM_PROMPT, Config.DEEPSEEK_MODEL, summary or '', normalized)
+
+    async def _error_message(self, response) -> str:
+        """Текст ошибки для пользователя по неуспешному ответу API"""
+        if response.status == 402:
+            return "Ошибка: Недостаточно средств на балансе DeepSeek."
+        error_text = await response.text()
+        logger.error(f"Ошибка API DeepSeek: {response.status} - {error_text}")
+        return f"Ошибка API DeepSeek: {response.status}"
+
+    async def generate_response(self, messages: list, summary: str = None,
+                                deadline: Optional[Deadline] = None) -> (str, int):
+        """
+        Генерирует ответ от DeepSeek на основе истории сообщений.
+        Возвращает ответ и количество использованных токенов.
+        Ключ выбирается пулом: наименее загруженный из здоровых.
+        """
+        return await self._complete(self._build_payload(messages, stream=False, summary=summary), deadline)
+
+    async def complete(self, messages: list, system_prompt: str, max_tokens: int = None) -> (str, int):
+        """
+        Запрос со своим системным промптом (служебные задачи, например сжатие истории)
+        """
+        payload = self._build_payload(messages, stream=False, system_prompt=system_prompt, max_tokens=max_tokens)
+        return await self._complete(payload)
+
+    async def _complete(self, payload: dict, deadline: Optional[Deadline] = None) -> (str, int):
+        """Отправляет запрос без потоковой передачи, возвращает ответ и количество токенов"""
+        return await self._request(
+            payload, 'deepseek.latency', 45, deadline,
+            lambda key, index, call, timeout: self._send(payload, key, index, call, timeout)
+        )
+
+    async def _request(self, payload: dict, latency_metric: str, timeout: float,
+                       deadline: Optional[Deadline], attempt: Callable[..., Awaitable]) -> (str, int):
+        """
+        Запрос с повторами при временных ошибках (обрыв соединения, тайм-аут, 429, 5xx).
+        Каждая попытка укладывается в остаток дедлайна сообщения
+        """
+        try:
+            content, tokens_used, _ = await retry_async(
+                lambda attempt_timeout: self._hedged(payload, latency_metric, attempt, attempt_timeout),
+                'deepseek', timeout, deadline, self.retry_policy,
+                should_retry=lambda result: result[2]
+            )
+        except DeadlineExceeded:
+            logger.error("Не осталось времени на запрос к DeepSeek API.")
+            return "Сервер DeepSeek слишком долго отвечает. Попробуйте позже.", 0
+        return content, tokens_used
+
+    def _hedging_enabled(self) -> bool:
+        return Config.DEEPSEEK_HEDGING and len(self.key_pool) > 1
 
+    async def _hedged(self, payload: dict, latency_metric: str,
+                      attempt: Callable[..., Awaitable], timeout: float) -> (str, int, bool):
+        """
+        Выполняет запрос, а если первый результат (ответ или первый токен) не пришел
+        за перцентиль недавних задержек — дублирует его на другом ключе.
+        Побеждает попытка, первой получившая результат, вторая отменяется.
+        Доля дублей ограничена DEEPSEEK_HEDGE_BUDGET.
+        Возвращает ответ, токены и признак, что ошибку можно повторить.
+        """
+        key, error = self._acquire_key(payload)
+        if not key:
+            return error, 0, False
+
+        call = HedgedCall('deepseek')
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post("https://api.deepseek.com/chat/completions", headers=headers, json=payload, timeout=45) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        content = data['choices'][0]['message']['content']
-                        tokens_used = data['usage']['total_tokens']
-                        return content.strip(), tokens_used
-                    elif response.status == 402:
-                         return "Ошибка: Недостаточно средств на балансе DeepSeek.", 0
+            self._start_attempt(call, attempt, key, 0, timeout)
+            if self._hedging_enabled():
+                self.hedge_budget.on_request()
+                delay = hedge_delay(latency_metric)
+                if not await call.wait_first(delay) and self.hedge_budget.try_spend():
+                    hedge_key = self._acquire_hedge_key(key)
+                    if hedge_key:
+                        metrics.increment('deepseek.hedge.fired')
+                        logger.info(f"Нет ответа с ключа {key.label} за {delay:.1f} с, дублируем запрос на ключ {hedge_key.label}")
+                        task = self._start_attempt(call, attempt, hedge_key, 1, timeout)
+                        if self.scheduler is not None:
+                            task.add_done_callback(lambda _: self.scheduler.release())
                     else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка API DeepSeek: {response.status} - {error_text}")
-                        return f"Ошибка API DeepSeek: {response.status}", 0
+                        self.hedge_budget.refund()
+            content, tokens_used = await call.result()
+            # Повторять можно, только если пользователь еще ничего не увидел
+            return content, tokens_used, tokens_used == 0 and call.retryable and call.winner is None
+        finally:
+            call.cancel()
+
+    def _acquire_hedge_key(self, key):
+        """
+        Ключ для дубля (не key) и слот планировщика под него. Если свободного слота нет,
+        дубль не отправляется: иначе дубли превышали бы лимит одновременных запросов на ключ
+        """
+        if self.scheduler is not None and not self.scheduler.try_acquire(current_plan()):
+            metrics.increment('deepseek.hedge.no_slot')
+            return None
+        hedge_key = self.key_pool.acquire(exclude=key)
+        if hedge_key is None and self.scheduler is not None:
+            self.scheduler.release()
+        return hedge_key
+
+    def _start_attempt(self, call: HedgedCall, attempt: Callable[..., Awaitable], key, index: int,
+                       timeout: float) -> asyncio.Task:
+        """
+        Запускает попытку на уже занятом ключе key. Ключ возвращает сама попытка
+        (в finally), но задачу могут отменить до первого шага — тогда тело попытки
+        не выполняется и ключ возвращается здесь
+        """
+        started = False
+
+        async def run():
+            nonlocal started
+            started = True
+            return await attempt(key, index, call, timeout)
+
+        def on_done(task: asyncio.Task):
+            if task.cancelled() and not started:
+                self.key_pool.cancel(key)
+
+        task = call.start(run())
+        task.add_done_callback(on_done)
+        return task
+
+    async def _send(self, payload: dict, key, index: int, call: HedgedCall, timeout: float) -> (str, int):
+        """Одна попытка запроса без потоковой передачи на ключе key"""
+        headers = self._build_headers(key.api_key)
+        
+        logger.info(f"Используется API ключ {key.label} из {len(self.api_keys)}{' (дубль)' if index else ''}")
+
+        outcome = OUTCOME_FAILURE
+        started = time.monotonic()
+        try:
+            session = self._get_session()
+            async with session.post(f"{self.base_url}/chat/completions", headers=headers, json=payload, timeout=timeout) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    content = data['choices'][0]['message']['content'].strip()
+                    tokens_used = self._account_usage(key, data['usage'], payload, content)
+                    outcome = OUTCOME_OK
+                    metrics.observe('deepseek.latency', time.monotonic() - started)
+                    call.claim(index)
+                    return content, tokens_used
+                else:
+                    outcome = self._outcome_for_status(response.status)
+                    call.retryable = call.retryable or is_retryable_status(response.status)
+                    return await self._error_message(response), 0
+        except asyncio.CancelledError:
+            # Отмена запроса (остановка бота или проигравший дубль) не говорит о здоровье ключа
+            outcome = OUTCOME_NEUTRAL
+            raise
         except aiohttp.ClientConnectorError:
             logger.error("Ошибка соединения с DeepSeek API.")
+            call.retryable = True
             return "Ошибка соединения. Серверы DeepSeek могут быть недоступны.", 0
         except asyncio.TimeoutError:
             logger.error("Тайм-аут при запросе к DeepSeek API.")
+            call.retryable = True
             return "Сервер DeepSeek слишком долго отвечает. Попробуйте позже.", 0
+        except aiohttp.ClientError as e:
+            logger.error(f"Обрыв соединения с DeepSeek API: {e}")
+            call.retryable = True
+            return "Ошибка соединения. Серверы DeepSeek могут быть недоступны.", 0
         except Exception as e:
             logger.error(f"Неизвестная ошибка при работе с DeepSeek: {e}")
             return "Произошла неизвестная ошибка при обращении к AI.", 0
+        finally:
+            self.key_pool.release(key, outcome, time.monotonic() - started)
+
+    async def generate_response_stream(self, messages: list, on_update: Callable[[str], Awaitable],
+                                       summary: str = None, deadline: Optional[Deadline] = None) -> (str, int):
+        """
+        Генерирует ответ в потоковом режиме (SSE).
+        on_update вызывается с накопленным текстом после каждого фрагмента.
+        Возвращает то же, что generate_response: ответ и количество токенов.
+        При дублировании запроса побеждает поток, первым приславший токен.
+        """
+        payload = self._build_payload(messages, stream=True, summary=summary)
+        return await self._request(
+            payload, 'deepseek.first_token', 180, deadline,
+            lambda key, index, call, timeout: self._stream(payload, key, index, call, on_update, timeout)
+        )
+
+    async def _stream(self, payload: dict, key, index: int, call: HedgedCall,
+                      on_update: Callable[[str], Awaitable], timeout: float) -> (str, int):
+        """Одна попытка потокового запроса на ключе key"""
+        headers = self._build_headers(key.api_key)
+
+        logger.info(f"Используется API ключ {key.label} из {len(self.api_keys)} (потоковый режим{', дубль' if index else ''})")
+
+        # Ограничиваем ожидание каждого фрагмента, а не всю генерацию целиком
+        timeout = aiohttp.ClientTimeout(total=timeout, sock_read=min(45, timeout))
+
+        parts = []
+        usage = None
+        outcome = OUTCOME_FAILURE
+        started = time.monotonic()
+        try:
+            session = self._get_session()
+            async with session.post(f"{self.base_url}/chat/completions", headers=headers, json=payload, timeout=timeout) as response:
+                if response.status != 200:
+                    outcome = self._outcome_for_status(response.status)
+                    call.retryable = call.retryable or is_retryable_status(response.status)
+                    return await self._error_message(response), 0
+
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').strip()
+                    # Пропускаем пустые строки и keep-alive комментарии SSE
+                    if not line.startswith('data:'):
+                        continue
+                    data_str = line[len('data:'):].strip()
+                    if data_str == '[DONE]':
+                        break
+
+                    chunk = json.loads(data_str)
+                    if chunk.get('usage'):
+                        usage = chunk['usage']
+                    for choice in chunk.get('choices') or []:
+                        delta = (choice.get('delta') or {}).get('content')
+                        if delta:
+                            if not parts:
+                                metrics.observe('deepseek.first_token', time.monotonic() - started)
+                            parts.append(delta)
+                            # Показываем текст только выигравшей попытки
+                            if call.claim(index):
+                                await on_update(''.join(parts))
+                outcome = OUTCOME_OK
+        except asyncio.CancelledError:
+            # Отмена запроса (остановка бота или проигравший дубль) не говорит о здоровье ключа
+            outcome = OUTCOME_NEUTRAL
+            raise
+        except aiohttp.ClientConnectorError:
+            logger.error("Ошибка соединения с DeepSeek API.")
+            call.retryable = True
+            return "Ошибка соединения. Серверы DeepSeek могут быть недоступны.", 0
+        except asyncio.TimeoutError:
+            logger.error("Тайм-аут при запросе к DeepSeek API.")
+            call.retryable = True
+            return "Сервер DeepSeek слишком долго отвечает. Попробуйте позже.", 0
+        except aiohttp.ClientError as e:
+            logger.error(f"Обрыв соединения с DeepSeek API: {e}")
+            call.retryable = True
+            return "Ошибка соединения. Серверы DeepSeek могут быть недоступны.", 0
+        except Exception as e:
+            logger.error(f"Неизвестная ошибка при работе с DeepSeek: {e}")
+            return "Произошла неизвестная ошибка при обращении к AI.", 0
+        finally:
+            self.key_pool.release(key, outcome, time.monotonic() - started)
+
+        content = ''.join(parts).strip()
+        if not content:
+            logger.error("DeepSeek вернул пустой потоковый ответ.")
+            return "Произошла неизвестная ошибка при обращении к AI.", 0
+        tokens_used = self._account_usage(key, usage, payload, content) if usage else 0
+        if not tokens_used:
+            # usage не пришел (обрыв перед последним чанком) — оцениваем грубо, чтобы ответ не потерялся
+            logger.warning("DeepSeek не прислал usage в потоковом ответе, токены оценены приблизительно.")
+            tokens_used = max(1, len(content) // 3)
+        return content, tokens_used
     
     def is_api_available(self) -> bool:
         """
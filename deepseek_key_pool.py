@@ -0,0 +1,227 @@
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Результат запроса для статистики ключа
+OUTCOME_OK = 'ok'            # Успешный ответ
+OUTCOME_FAILURE = 'failure'  # 429, 5xx, тайм-аут, ошибка соединения — ключ/аккаунт деградирует
+OUTCOME_FATAL = 'fatal'      # 401/402 — ключ не работает, пока не вмешается человек (баланс, отзыв ключа)
+OUTCOME_NEUTRAL = 'neutral'  # Ошибка запроса (например, 400), ключ не виноват
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+
+class KeyState:
+    """Состояние одного API ключа: нагрузка, задержка, ошибки и circuit breaker"""
+
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.api_key = api_key
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.recent = deque(maxlen=Config.DEEPSEEK_KEY_WINDOW)  # True — успех, False — ошибка
+        self.consecutive_failures = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.open_until = 0.0
+        self.cooldown = Config.DEEPSEEK_CIRCUIT_COOLDOWN
+        self.requests = 0
+        self.failures = 0
+        # Кеш контекста DeepSeek: сколько токенов промпта пришло из кеша и сколько нет
+        self.prompt_cache_hit_tokens = 0
+        self.prompt_cache_miss_tokens = 0
+
+    @property
+    def label(self) -> str:
+        return f"#{self.index + 1}"
+
+    @property
+    def error_rate(self) -> float:
+        if not self.recent:
+            return 0.0
+        return self.recent.count(False) / len(self.recent)
+
+    @property
+    def prompt_cache_hit_ratio(self) -> Optional[float]:
+        total = self.prompt_cache_hit_tokens + self.prompt_cache_miss_tokens
+        if not total:
+            return None
+        return self.prompt_cache_hit_tokens / total
+
+    def score(self, default_latency: float) -> float:
+        """Чем меньше, тем лучше: ожидаемое время ответа с учетом очереди на ключе и доли ошибок"""
+        latency = self.latency_ewma if self.latency_ewma is not None else default_latency
+        return latency * (self.in_flight + 1) * (1 + 2 * self.error_rate)
+
+
+class DeepSeekKeyPool:
+    """
+    Планировщик API ключей DeepSeek.
+
+    Запрос уходит на наименее загруженный здоровый ключ (с учетом числа
+    запросов в работе, скользящей задержки и доли ошибок). После серии ошибок
+    ключ выводится из ротации (circuit open) и через время пробуется
+    одним запросом (half-open): успех возвращает ключ, ошибка удваивает паузу.
+
+    Кеш контекста DeepSeek работает в пределах аккаунта, поэтому продолжение
+    диалога по возможности отправляется на тот же ключ, что и прошлый запрос
+    (если этот ключ не сильно медленнее лучшего).
+    """
+
+    # Сколько последних диалогов помнить для привязки к ключу
+    AFFINITY_LIMIT = 10000
+
+    def __init__(self, api_keys: List[str]):
+        self.keys = [KeyState(index, api_key) for index, api_key in enumerate(api_keys)]
+        self._affinity = OrderedDict()  # ключ диалога -> KeyState
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self, exclude: Optional[KeyState] = None, affinity: Optional[str] = None) -> Optional[KeyState]:
+        """
+        Выбирает ключ для запроса и отмечает его занятым.
+        affinity — ключ диалога, чтобы продолжение ушло на тот же аккаунт (кеш контекста).
+        Возвращает None, если все ключи выведены из ротации.
+        """
+        now = time.monotonic()
+        healthy = []
+        probe = None
+        for key in self.keys:
+            if key is exclude:
+                continue
+            if key.circuit == CIRCUIT_CLOSED:
+                healthy.append(key)
+            elif key.circuit == CIRCUIT_OPEN and now >= key.open_until and probe is None:
+                probe = key
+
+        if probe is not None:
+            # Пробный запрос на ключ после паузы — только один одновременно
+            probe.circuit = CIRCUIT_HALF_OPEN
+            logger.info(f"Ключ DeepSeek {probe.label}: пробный запрос после паузы")
+            chosen = probe
+        elif healthy:
+            # Ключ без замеров считаем средним, чтобы он тоже получал запросы
+            known = [key.latency_ewma for key in healthy if key.latency_ewma is not None]
+            default_latency = sum(known) / len(known) if known else Config.DEEPSEEK_DEFAULT_LATENCY
+            chosen = min(healthy, key=lambda key: key.score(default_latency))
+            preferred = self._affinity.get(affinity) if affinity else None
+            if (preferred is not None and preferred is not chosen and preferred in healthy
+                    and preferred.score(default_latency) <= chosen.score(default_latency) * Config.DEEPSEEK_KEY_AFFINITY_SLACK):
+                chosen = preferred
+        else:
+            return None
+
+        chosen.in_flight += 1
+        chosen.requests += 1
+        return chosen
+
+    def release(self, key: KeyState, outcome: str, latency: float):
+        """Возвращает ключ после запроса и обновляет его статистику"""
+        key.in_flight = max(0, key.in_flight - 1)
+
+        if outcome == OUTCOME_NEUTRAL:
+            # Проба ничего не показала (запрос отменен или ошибочен) — ключ ждет новой пробы
+            self._return_probe(key)
+            return
+
+        if outcome == OUTCOME_OK:
+            alpha = Config.DEEPSEEK_LATENCY_EWMA_ALPHA
+            key.latency_ewma = latency if key.latency_ewma is None else alpha * latency + (1 - alpha) * key.latency_ewma
+            key.recent.append(True)
+            key.consecutive_failures = 0
+            if key.circuit != CIRCUIT_CLOSED:
+                logger.info(f"✅ Ключ DeepSeek {key.label} снова в работе")
+            key.circuit = CIRCUIT_CLOSED
+            key.cooldown = Config.DEEPSEEK_CIRCUIT_COOLDOWN
+            return
+
+        key.recent.append(False)
+        key.failures += 1
+        key.consecutive_failures += 1
+
+        if key.circuit == CIRCUIT_OPEN:
+            # Запрос ушел до того, как ключ вывели из ротации — пауза уже идет
+            return
+        if outcome == OUTCOME_FATAL:
+            self._open(key, Config.DEEPSEEK_KEY_FATAL_COOLDOWN)
+        elif key.circuit == CIRCUIT_HALF_OPEN:
+            # Пробный запрос не прошел — пауза вдвое дольше
+            self._open(key, min(key.cooldown * 2, Config.DEEPSEEK_CIRCUIT_MAX_COOLDOWN))
+        elif key.circuit == CIRCUIT_CLOSED and self._should_open(key):
+            self._open(key, Config.DEEPSEEK_CIRCUIT_COOLDOWN)
+
+    def cancel(self, key: KeyState):
+        """
+        Возвращает ключ, запрос с которым так и не был отправлен (попытку отменили до старта).
+        Статистика не меняется; пробный ключ снова ждет пробного запроса
+        """
+        key.in_flight = max(0, key.in_flight - 1)
+        key.requests = max(0, key.requests - 1)
+        self._return_probe(key)
+
+    def record_usage(self, key: KeyState, prompt_cache_hit_tokens: int, prompt_cache_miss_tokens: int,
+                     affinity: Optional[str] = None):
+        """Учитывает попадания в кеш контекста и запоминает ключ для продолжения диалога"""
+        key.prompt_cache_hit_tokens += prompt_cache_hit_tokens
+        key.prompt_cache_miss_tokens += prompt_cache_miss_tokens
+        if affinity:
+            self._affinity[affinity] = key
+            self._affinity.move_to_end(affinity)
+            if len(self._affinity) > self.AFFINITY_LIMIT:
+                self._affinity.popitem(last=False)
+
+    @staticmethod
+    def _should_open(key: KeyState) -> bool:
+        if key.consecutive_failures >= Config.DEEPSEEK_CIRCUIT_FAILURES:
+            return True
+        return len(key.recent) >= key.recent.maxlen // 2 and key.error_rate >= Config.DEEPSEEK_CIRCUIT_ERROR_RATE
+
+    @staticmethod
+    def _return_probe(key: KeyState):
+        """
+        Возвращает пробный ключ в ожидание пробы без изменения паузы:
+        пауза уже истекла, поэтому следующий запрос снова станет пробным
+        """
+        if key.circuit == CIRCUIT_HALF_OPEN:
+            key.circuit = CIRCUIT_OPEN
+
+    @staticmethod
+    def _open(key: KeyState, cooldown: float):
+        key.circuit = CIRCUIT_OPEN
+        key.cooldown = cooldown
+        key.open_until = time.monotonic() + cooldown
+        logger.warning(
+            f"⚠️ Ключ DeepSeek {key.label} выведен из ротации на {cooldown:g} с "
+            f"(ошибок подряд: {key.consecutive_failures}, доля ошибок: {key.error_rate:.0%})"
+        )
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                'key': key.label,
+                'circuit': key.circuit,
+                'in_flight': key.in_flight,
+                'latency_ewma': key.latency_ewma,
+                'error_rate': key.error_rate,
+                'requests': key.requests,
+                'failures': key.failures,
+                'prompt_cache_hit_ratio': key.prompt_cache_hit_ratio
+            }
+            for key in self.keys
+        ]
+
+    def log_stats(self):
+        for item in self.stats():
+            latency = f"{item['latency_ewma']:.2f} с" if item['latency_ewma'] is not None else "—"
+            cache_hits = f"{item['prompt_cache_hit_ratio']:.0%}" if item['prompt_cache_hit_ratio'] is not None else "—"
+            logger.info(
+                f"🔑 DeepSeek {item['key']}: {item['circuit']}, в работе {item['in_flight']}, "
+                f"задержка {latency}, ошибок {item['error_rate']:.0%}, "
+                f"запросов {item['requests']} (ошибок {item['failures']}), кеш контекста {cache_hits}"
+            )
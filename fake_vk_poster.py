@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный "VK" для проверки режима Callback API.
+Отправляет на сервер бота запрос подтверждения и события message_new
+в том же формате, что и настоящий VK.
+
+Пример:
+    python fake_vk_poster.py --url http://127.0.0.1:8080/vk/callback --users 5 --count 3
+"""
+
+import argparse
+import sys
+import time
+import uuid
+import requests
+from config import Config
+
+
+def build_event(group_id: int, secret: str, user_id: int, message_id: int, text: str) -> dict:
+    """Событие message_new в формате Callback API"""
+    event = {
+        'type': 'message_new',
+        'event_id': uuid.uuid4().hex,
+        'v': Config.VK_API_VERSION,
+        'group_id': group_id,
+        'object': {
+            'message': {
+                'date': int(time.time()),
+                'from_id': user_id,
+                'peer_id': user_id,
+                'id': message_id,
+                'conversation_message_id': message_id,
+                'text': text,
+                'attachments': [],
+                'fwd_messages': [],
+                'important': False,
+                'is_hidden': False,
+                'out': 0
+            },
+            'client_info': {
+                'button_actions': ['text', 'open_link'],
+                'keyboard': True,
+                'inline_keyboard': True,
+                'lang_id': 0
+            }
+        }
+    }
+    if secret:
+        event['secret'] = secret
+    return event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка тестовых событий Callback API на сервер бота")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{Config.VK_CALLBACK_PORT}{Config.VK_CALLBACK_PATH}")
+    parser.add_argument('--group-id', type=int, default=Config.VK_GROUP_ID)
+    parser.add_argument('--secret', default=Config.VK_CALLBACK_SECRET)
+    parser.add_argument('--users', type=int, default=1, help="сколько разных пользователей")
+    parser.add_argument('--count', type=int, default=1, help="сколько сообщений от каждого пользователя")
+    parser.add_argument('--text', default="↩️ Назад", help="текст сообщений")
+    parser.add_argument('--first-user-id', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # Подтверждение адреса сервера
+    response = requests.post(args.url, json={'type': 'confirmation', 'group_id': args.group_id, 'secret': args.secret}, timeout=10)
+    print(f"confirmation -> {response.status_code} {response.text!r}")
+    if response.status_code != 200:
+        sys.exit(1)
+
+    message_id = 1
+    started = time.monotonic()
+    failed = 0
+    for _ in range(args.count):
+        for i in range(args.users):
+            event = build_event(args.group_id, args.secret, args.first_user_id + i, message_id, args.text)
+            message_id += 1
+            response = requests.post(args.url, json=event, timeout=10)
+            if response.status_code != 200 or response.text != 'ok':
+                failed += 1
+                print(f"message_new -> {response.status_code} {response.text!r}")
+
+    total = args.users * args.count
+    elapsed = time.monotonic() - started
+    print(f"Отправлено событий: {total}, с ошибкой: {failed}, за {elapsed:.2f} с")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
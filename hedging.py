@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Awaitable, Optional, Tuple
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeBudget:
+    """
+    Ограничение доли дублирующих запросов.
+    Каждый обычный запрос добавляет ratio "кредита", каждый дубль тратит 1,
+    поэтому в среднем дублируется не больше ratio запросов (и не больше
+    max_credits подряд во время всплеска задержек).
+    """
+
+    def __init__(self, ratio: float, max_credits: float = 10.0):
+        self.ratio = ratio
+        self.max_credits = max_credits
+        self.credits = 0.0
+
+    def on_request(self):
+        self.credits = min(self.max_credits, self.credits + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.credits < 1:
+            return False
+        self.credits -= 1
+        return True
+
+    def refund(self):
+        """Дубль не понадобился (например, нет свободного ключа) — возвращаем кредит"""
+        self.credits = min(self.max_credits, self.credits + 1)
+
+
+def hedge_delay(metric: str) -> float:
+    """
+    Через сколько секунд без ответа отправлять дубль: перцентиль
+    DEEPSEEK_HEDGE_PERCENTILE недавних задержек, пока замеров мало — значение по умолчанию
+    """
+    values = metrics.timings.get(metric)
+    if not values or len(values) < Config.DEEPSEEK_HEDGE_MIN_SAMPLES:
+        return Config.DEEPSEEK_HEDGE_DEFAULT_DELAY
+    return max(Config.DEEPSEEK_HEDGE_MIN_DELAY, metrics.percentile(metric, Config.DEEPSEEK_HEDGE_PERCENTILE))
+
+
+class HedgedCall:
+    """
+    Один логический запрос из одной или двух попыток на разных ключах.
+    Попытка, первой получившая результат (для потокового режима — первый токен),
+    "забирает" запрос через claim(); остальные попытки сразу отменяются.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.winner: Optional[int] = None
+        self.retryable = False  # Хотя бы одна попытка завершилась временной ошибкой
+        self.first_result = asyncio.Event()
+        self.tasks = []
+
+    def claim(self, index: int) -> bool:
+        """Вызывается попыткой index при первом результате. True — эта попытка выиграла"""
+        if self.winner is None:
+            self.winner = index
+            self.first_result.set()
+            for other, task in enumerate(self.tasks):
+                if other != index:
+                    task.cancel()
+            if index > 0:
+                metrics.increment(f'{self.name}.hedge.won')
+        return self.winner == index
+
+    def start(self, attempt: Awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(attempt)
+        self.tasks.append(task)
+        return task
+
+    async def wait_first(self, timeout: float) -> bool:
+        """Ждет первого результата или завершения первой попытки. False — время вышло"""
+        waiter = asyncio.ensure_future(self.first_result.wait())
+        try:
+            done, _ = await asyncio.wait({waiter, self.tasks[0]}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        return bool(done)
+
+    async def result(self) -> Tuple[str, int]:
+        """Результат выигравшей попытки, а если выигравших нет — первой завершившейся с ошибкой"""
+        fallback = None
+        pending = set(self.tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    index = self.tasks.index(task)
+                    if self.winner == index:
+                        return task.result()
+                    if fallback is None:
+                        fallback = task.result()
+            return fallback
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import Optional
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Системный промпт для сжатия истории
+SUMMARY_PROMPT = (
+    "Ты сжимаешь историю диалога пользователя с ИИ-ассистентом. Составь краткое содержание: "
+    "о чем спрашивал пользователь, что уже ответил ассистент, важные факты, числа, условия задач, "
+    "договоренности и предпочтения пользователя. Пиши на русском языке, простым текстом без форматирования, "
+    "от третьего лица, не длиннее нескольких предложений."
+)
+
+ROLE_NAMES = {'user': 'Пользователь', 'assistant': 'Ассистент'}
+
+
+class HistoryCompactor:
+    """
+    Сжатие длинной истории диалога: когда история приближается к бюджету токенов,
+    старые сообщения заменяются кратким содержанием, которое строит DeepSeek.
+    Запрос делается в фоне после ответа пользователю, поэтому на время ответа не влияет.
+
+    needs_compaction() — быстрая проверка после ответа, compact() — само сжатие,
+    его вызывают уже в слоте планировщика DeepSeek.
+    """
+
+    def __init__(self, user_manager, deepseek):
+        self.user_manager = user_manager
+        self.deepseek = deepseek
+
+    def needs_compaction(self, user_id: int) -> bool:
+        return self.user_manager.needs_history_compaction(user_id)
+
+    async def compact(self, user_id: int):
+        """Сжимает историю пользователя, если это еще нужно"""
+        summarized = self.user_manager.take_history_for_compaction(user_id)
+        if not summarized:
+            return
+        try:
+            await self._compact(user_id, summarized)
+        finally:
+            # При ошибке или отмене история остается как есть (после успеха сжатие уже снято)
+            self.user_manager.release_history_compaction(user_id)
+
+    @staticmethod
+    def _build_request(previous_summary: Optional[str], summarized: list) -> list:
+        lines = []
+        if previous_summary:
+            lines.append(f"Краткое содержание более ранней части диалога: {previous_summary}")
+            lines.append("")
+        lines.append("Сообщения для сжатия:")
+        for message in summarized:
+            role = ROLE_NAMES.get(message.get('role'), message.get('role'))
+            lines.append(f"{role}: {message.get('content')}")
+        return [{"role": "user", "content": '\n'.join(lines)}]
+
+    async def _compact(self, user_id: int, summarized: list):
+        previous_summary = self.user_manager.get_conversation_summary(user_id)
+        started = time.monotonic()
+        try:
+            summary, tokens_used = await self.deepseek.complete(
+                self._build_request(previous_summary, summarized),
+                SUMMARY_PROMPT,
+                max_tokens=Config.HISTORY_SUMMARY_MAX_TOKENS
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сжатия истории пользователя {user_id}: {e}")
+            tokens_used = 0
+
+        if tokens_used <= 0:
+            logger.warning(f"Не удалось сжать историю пользователя {user_id}, история остается без изменений")
+            metrics.increment('history.summary.failed')
+            return
+
+        self.user_manager.apply_history_summary(user_id, summary, summarized)
+        metrics.increment('history.summary.created')
+        metrics.increment('history.summary.tokens', tokens_used)
+        metrics.observe('history.summary.duration', time.monotonic() - started)
+        logger.info(f"🗜 История пользователя {user_id} сжата: {len(summarized)} сообщений → краткое содержание")
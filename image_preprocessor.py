@@ -0,0 +1,109 @@
+import io
+import logging
+from typing import Optional, Tuple
+from config import Config
+from metrics import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Без Pillow фото уходит в OCR как есть (см. warn_if_unavailable)
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Типы размеров фото VK от меньшего к большему (у старых фото нет width/height)
+VK_SIZE_ORDER = 'smopqrxyzw'
+# Шаг уменьшения стороны и качества JPEG при подгонке под OCR_MAX_IMAGE_BYTES
+DOWNSCALE_STEP = 0.8
+QUALITY_STEP = 10
+MIN_JPEG_QUALITY = 60
+
+
+def _size_rank(size: dict) -> Tuple[int, int]:
+    width, height = size.get('width') or 0, size.get('height') or 0
+    type_rank = VK_SIZE_ORDER.find(size.get('type', ''))
+    return width * height, type_rank
+
+
+def select_photo_size(photo_data: dict, target_min_side: int = None) -> Optional[dict]:
+    """
+    Выбирает из вложения VK самый маленький размер, у которого короткая сторона
+    не меньше target_min_side — этого достаточно для распознавания текста.
+    Если такого нет, возвращает самый большой размер
+    """
+    if target_min_side is None:
+        target_min_side = Config.OCR_TARGET_MIN_SIDE
+    sizes = sorted((size for size in (photo_data or {}).get('sizes', []) if size.get('url')), key=_size_rank)
+    if not sizes:
+        return None
+
+    for size in sizes:
+        if min(size.get('width') or 0, size.get('height') or 0) >= target_min_side:
+            chosen = size
+            break
+    else:
+        chosen = sizes[-1]
+
+    if chosen is not sizes[-1]:
+        metrics.increment('ocr.preprocess.smaller_size')
+    logger.info(f"📸 Выбрано изображение: {chosen.get('width', 0)}x{chosen.get('height', 0)}px "
+                f"(тип {chosen.get('type', '?')}, самый большой — {sizes[-1].get('width', 0)}x{sizes[-1].get('height', 0)}px)")
+    return chosen
+
+
+def warn_if_unavailable():
+    """Предупреждает при запуске, что пережатие включено, но Pillow не установлен"""
+    if Config.OCR_RECOMPRESS and Image is None:
+        logger.warning("⚠️ OCR_RECOMPRESS включен, но Pillow не установлен (pip install -r requirements.txt): "
+                       "фото уходят в OCR без пережатия")
+
+
+def prepare_for_ocr(content: bytes, mime_type: str,
+                    max_bytes: int = None, target_min_side: int = None) -> Tuple[bytes, str]:
+    """
+    Уменьшает и пережимает в JPEG изображение больше max_bytes, не опуская
+    короткую сторону ниже target_min_side. Сначала уменьшает размер, потом качество.
+    Без Pillow, при OCR_RECOMPRESS=false или если пережать не вышло, возвращает
+    исходные байты. Работает синхронно — вызывать через asyncio.to_thread
+    """
+    if max_bytes is None:
+        max_bytes = Config.OCR_MAX_IMAGE_BYTES
+    if target_min_side is None:
+        target_min_side = Config.OCR_TARGET_MIN_SIDE
+    if Image is None or not Config.OCR_RECOMPRESS or len(content) <= max_bytes:
+        return content, mime_type
+
+    try:
+        image = Image.open(io.BytesIO(content))
+        # EXIF при пережатии теряется, поэтому поворот применяем к пикселям
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        quality = Config.OCR_JPEG_QUALITY
+        while True:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            result = buffer.getvalue()
+            if len(result) <= max_bytes:
+                break
+            width, height = image.size
+            if min(width, height) * DOWNSCALE_STEP >= target_min_side:
+                image = image.resize((int(width * DOWNSCALE_STEP), int(height * DOWNSCALE_STEP)), Image.LANCZOS)
+            elif quality - QUALITY_STEP >= MIN_JPEG_QUALITY:
+                quality -= QUALITY_STEP
+            else:
+                break
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось пережать изображение для OCR: {e}")
+        return content, mime_type
+
+    if len(result) >= len(content):
+        return content, mime_type
+
+    metrics.increment('ocr.preprocess.recompressed')
+    metrics.increment('ocr.preprocess.bytes_saved', len(content) - len(result))
+    logger.info(f"🗜️ Изображение пережато для OCR: {len(content)} → {len(result)} байт "
+                f"({image.size[0]}x{image.size[1]}px, качество {quality})")
+    return result, 'JPEG'
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест бота без реальных VK, DeepSeek, Yandex и ЮКассы.
+
+Поднимает заглушки (mock_upstreams.py), направляет на них бота через
+переменные окружения и подает VKBot.dispatch_message сообщения от
+синтетических пользователей — так же, как это делают long poll и Callback API.
+В конце печатает пропускную способность, перцентили задержек по этапам
+(из metrics) и долю ответов с ошибкой.
+
+Без --use-db пользователи хранятся во временном users.json, настоящая база не трогается.
+
+Примеры:
+    python load_test.py --users 200 --messages 5 --rate 50
+    python load_test.py --users 500 --deepseek-latency 3 --deepseek-error-rate 0.05 --keys 3
+    python load_test.py --users 100 --max-p95 20 --min-throughput 10 --json result.json
+    python load_test.py --users 20 --messages 12 --completion-tokens 400 --prefix-cache
+
+С --max-p95 / --min-throughput / --max-error-rate скрипт завершается с кодом 1,
+если результат хуже порога, поэтому его можно использовать как проверку в CI.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from mock_upstreams import Latency, MockUpstreams
+
+FIRST_USER_ID = 1000000
+
+QUESTIONS = (
+    "Привет! Что ты умеешь?",
+    "Объясни теорему Пифагора простыми словами",
+    "Как решить квадратное уравнение?",
+    "Напиши короткое стихотворение про осень",
+    "Чем отличается список от кортежа в Python?",
+    "Переведи на английский: доброе утро",
+)
+
+# Префиксы ответов бота, которые считаются ошибкой или отказом из-за нагрузки
+ERROR_PREFIXES = ("❌",)
+OVERLOAD_PREFIXES = ("⏳",)
+
+
+def parse_plans(value: str) -> list:
+    """'free:0.7,premium:0.3' -> [('free', 0.7), ('premium', 0.3)]"""
+    plans = []
+    for item in value.split(','):
+        name, _, weight = item.partition(':')
+        plans.append((name.strip(), float(weight or 1)))
+    return plans
+
+
+def generate_private_key() -> str:
+    """RSA-ключ для подписи JWT сервисного аккаунта Yandex (заглушка подпись не проверяет)"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode('utf-8')
+
+
+def configure_environment(args, mocks: MockUpstreams):
+    """Переменные окружения для бота; задаются до импорта config, поэтому config.env их не перекрывает"""
+    env = {
+        'VK_TOKEN': 'mock-vk-token',
+        'VK_GROUP_ID': '1',
+        'VK_RATE_LIMIT': str(args.vk_rate_limit),
+        'DEEPSEEK_API_KEYS': ','.join(f"mock-key-{i + 1}" for i in range(args.keys)),
+        'DEEPSEEK_STREAMING': 'true' if args.streaming else 'false',
+        'YANDEX_FOLDER_ID': 'mock-folder',
+        'YANDEX_SERVICE_ACCOUNT_ID': 'mock-service-account',
+        'YANDEX_API_KEY_ID': 'mock-key-id',
+        'YANDEX_API_SECRET_KEY': generate_private_key(),
+        'YOOKASSA_SHOP_ID': '123456',
+        'YOOKASSA_API_KEY': 'test_mock_key',
+        'RESPONSE_CACHE_POSTGRES': 'false',
+        'METRICS_LOG_INTERVAL': '0',
+        'MAX_CONCURRENT_MESSAGES': str(args.concurrency),
+        **mocks.env()
+    }
+    if not args.use_db:
+        # Заведомо недоступная база: db_manager переключится на users.json во временной папке
+        env.update({'DB_HOST': '127.0.0.1', 'DB_PORT': '1'})
+    os.environ.update(env)
+
+
+def build_messages(args, mocks: MockUpstreams) -> list:
+    """Сообщения в порядке отправки: по args.messages от каждого пользователя, вперемешку"""
+    messages = []
+    message_id = 1
+    # Общие фото заданий, которые присылают разные пользователи
+    worksheets = [mocks.photo_attachment() for _ in range(5)]
+    for round_number in range(args.messages):
+        user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+        random.shuffle(user_ids)
+        for user_id in user_ids:
+            attachments = []
+            if random.random() < args.photo_ratio:
+                for _ in range(args.photos_per_message):
+                    shared = random.random() < args.duplicate_ratio
+                    attachments.append(random.choice(worksheets) if shared else mocks.photo_attachment())
+                text = "Реши задачу с фото"
+            elif random.random() < args.duplicate_ratio:
+                # Одинаковые вопросы без истории: проверяют кеш ответов и объединение запросов
+                text = random.choice(QUESTIONS)
+            else:
+                text = f"{random.choice(QUESTIONS)} (вопрос {round_number + 1} от {user_id})"
+            messages.append({
+                'id': message_id,
+                'date': int(time.time()),
+                'from_id': user_id,
+                'peer_id': user_id,
+                'text': text,
+                'attachments': attachments
+            })
+            message_id += 1
+    return messages
+
+
+def assign_plans(bot, args) -> dict:
+    plans = parse_plans(args.plans)
+    names = [name for name, _ in plans]
+    weights = [weight for _, weight in plans]
+    assigned = {}
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users):
+        plan = random.choices(names, weights)[0]
+        bot.user_manager.get_user(user_id)
+        if plan in ('admin', 'admin_unlimited'):
+            bot.user_manager.grant_admin_unlimited(user_id)
+        elif plan != 'free':
+            bot.user_manager.activate_subscription(user_id, plan)
+        assigned[user_id] = plan
+    return assigned
+
+
+def classify_replies(mocks: MockUpstreams) -> dict:
+    replies = [text for texts in mocks.sent.values() for text in texts]
+    errors = sum(1 for text in replies if text.startswith(ERROR_PREFIXES))
+    overloaded = sum(1 for text in replies if text.startswith(OVERLOAD_PREFIXES))
+    streamed = mocks.streamed_replies()
+    # Потоковый ответ, как и обычный, должен прийти с главной клавиатурой
+    without_keyboard = sum(1 for message in streamed if not message['keyboard'])
+    return {'replies': len(replies), 'errors': errors, 'overloaded': overloaded,
+            'streamed': len(streamed), 'streamed_without_keyboard': without_keyboard}
+
+
+def print_report(result: dict):
+    print()
+    print("=" * 72)
+    print(f"Сообщений отправлено: {result['sent']}, обработано: {result['processed']}, "
+          f"за {result['elapsed']:.2f} с → {result['throughput']:.1f} сообщ./с")
+    replies = result['replies']
+    print(f"Ответов бота: {replies['replies']}, с ошибкой: {replies['errors']} "
+          f"({result['error_rate']:.1%}), отказов из-за нагрузки: {replies['overloaded']}")
+    print(f"Потоковых ответов: {replies['streamed']}, из них без клавиатуры: {replies['streamed_without_keyboard']}")
+    print()
+    print(f"{'метрика':<36}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in sorted(result['timings'].items()):
+        print(f"{name:<36}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+    counters = result['counters']
+    prompt_tokens = counters.get('deepseek.prompt_cache.hit_tokens', 0) + counters.get('deepseek.prompt_cache.miss_tokens', 0)
+    if prompt_tokens:
+        print(f"\nКеш контекста DeepSeek: {counters.get('deepseek.prompt_cache.hit_tokens', 0) / prompt_tokens:.1%} "
+              f"токенов промпта из кеша")
+    print()
+    print("Счетчики бота:")
+    for name, value in sorted(result['counters'].items()):
+        print(f"  {name} = {value}")
+    print("Запросы к заглушкам:")
+    for name, value in sorted(result['upstream'].items()):
+        print(f"  {name} = {value}")
+    print("=" * 72)
+
+
+def check_thresholds(result: dict, args) -> list:
+    """Нарушенные пороги (для использования скрипта как проверки регрессий)"""
+    failures = []
+    total = result['timings'].get('message.total')
+    if args.max_p95 is not None and (not total or total['p95'] > args.max_p95):
+        failures.append(f"p95 message.total = {total['p95'] if total else None} > {args.max_p95}")
+    if args.min_throughput is not None and result['throughput'] < args.min_throughput:
+        failures.append(f"пропускная способность {result['throughput']:.1f} < {args.min_throughput}")
+    if args.max_error_rate is not None and result['error_rate'] > args.max_error_rate:
+        failures.append(f"доля ошибок {result['error_rate']:.1%} > {args.max_error_rate:.1%}")
+    if result['replies']['streamed_without_keyboard']:
+        failures.append(f"потоковых ответов без клавиатуры: {result['replies']['streamed_without_keyboard']}")
+    return failures
+
+
+async def run(args) -> dict:
+    mocks = MockUpstreams(
+        deepseek=Latency(args.deepseek_latency, args.deepseek_sigma, args.deepseek_error_rate),
+        ocr=Latency(args.ocr_latency, args.ocr_sigma, args.ocr_error_rate),
+        vk=Latency(args.vk_latency),
+        completion_tokens=args.completion_tokens,
+        cache_hit_ratio=args.prompt_cache_hit_ratio,
+        prefix_cache=args.prefix_cache
+    )
+    await mocks.start()
+    configure_environment(args, mocks)
+
+    # Импорт после настройки окружения: Config читает переменные при импорте
+    from vk_bot import VKBot
+    from metrics import metrics
+    if not args.verbose:
+        # vk_bot настраивает логирование при импорте и пишет по несколько строк на сообщение
+        logging.getLogger().setLevel(logging.WARNING)
+
+    bot = VKBot(start_longpoll=False)
+    bot.vision_client.start_token_refresher()
+    assigned = assign_plans(bot, args)
+    messages = build_messages(args, mocks)
+    plans = ', '.join(f"{plan}={list(assigned.values()).count(plan)}" for plan in sorted(set(assigned.values())))
+    print(f"Пользователей: {args.users} ({plans}), сообщений: {len(messages)}")
+    metrics.reset()
+
+    started = time.monotonic()
+    try:
+        interval = 1 / args.rate if args.rate > 0 else 0
+        for number, message in enumerate(messages):
+            if interval:
+                # Отправляем по расписанию, а не "после паузы", чтобы темп не плыл
+                delay = started + number * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            bot.dispatch_message(message)
+        await bot.dispatcher.drain(args.timeout)
+        elapsed = time.monotonic() - started
+    finally:
+        await bot.dispatcher.close()
+        await bot.vk_outbound.close()
+        await bot.vk_async.close()
+        await bot.deepseek.close()
+        await bot.vision_client.close()
+        await mocks.stop()
+
+    snapshot = metrics.snapshot()
+    processed = snapshot['timings'].get('message.total', {}).get('count', 0)
+    replies = classify_replies(mocks)
+    return {
+        'sent': len(messages),
+        'processed': processed,
+        'elapsed': elapsed,
+        'throughput': processed / elapsed if elapsed else 0.0,
+        'replies': replies,
+        'error_rate': replies['errors'] / replies['replies'] if replies['replies'] else 0.0,
+        'timings': snapshot['timings'],
+        'counters': snapshot['counters'],
+        'upstream': dict(mocks.counters)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заглушках внешних API")
+    parser.add_argument('--users', type=int, default=50, help="сколько синтетических пользователей")
+    parser.add_argument('--messages', type=int, default=3, help="сколько сообщений от каждого пользователя")
+    parser.add_argument('--rate', type=float, default=0, help="темп подачи, сообщ./с (0 — все сразу)")
+    parser.add_argument('--plans', default='free:0.7,lite:0.15,premium:0.1,admin:0.05', help="доли тарифов")
+    parser.add_argument('--photo-ratio', type=float, default=0.1, help="доля сообщений с фото")
+    parser.add_argument('--photos-per-message', type=int, default=1, help="сколько фото в сообщении с фото")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help="доля одинаковых вопросов и фото из общего набора")
+    parser.add_argument('--concurrency', type=int, default=50, help="MAX_CONCURRENT_MESSAGES бота")
+    parser.add_argument('--keys', type=int, default=3, help="сколько ключей DeepSeek")
+    parser.add_argument('--streaming', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--deepseek-latency', type=float, default=1.0, help="медиана задержки DeepSeek, с")
+    parser.add_argument('--deepseek-sigma', type=float, default=0.5)
+    parser.add_argument('--deepseek-error-rate', type=float, default=0.0)
+    parser.add_argument('--completion-tokens', type=int, default=120)
+    parser.add_argument('--prompt-cache-hit-ratio', type=float, default=0.0)
+    parser.add_argument('--prefix-cache', action='store_true',
+                        help="считать кеш контекста DeepSeek по общему префиксу сообщений (вместо --prompt-cache-hit-ratio)")
+    parser.add_argument('--ocr-latency', type=float, default=0.5)
+    parser.add_argument('--ocr-sigma', type=float, default=0.3)
+    parser.add_argument('--ocr-error-rate', type=float, default=0.0)
+    parser.add_argument('--vk-latency', type=float, default=0.02)
+    parser.add_argument('--vk-rate-limit', type=float, default=1000, help="VK_RATE_LIMIT (у заглушки нет лимита)")
+    parser.add_argument('--timeout', type=float, default=600, help="сколько ждать обработки всех сообщений, с")
+    parser.add_argument('--use-db', action='store_true', help="использовать базу из config.env (создаст пользователей в ней)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', help="сохранить результат в файл")
+    parser.add_argument('--max-p95', type=float, help="порог p95 полного времени обработки, с")
+    parser.add_argument('--min-throughput', type=float, help="минимальная пропускная способность, сообщ./с")
+    parser.add_argument('--max-error-rate', type=float, help="максимальная доля ответов с ошибкой")
+    parser.add_argument('--verbose', action='store_true', help="не приглушать логи бота")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if not args.use_db:
+        # users.json создается в текущей папке — работаем во временной
+        os.chdir(tempfile.mkdtemp(prefix='smartbot-load-'))
+
+    result = asyncio.run(run(args))
+    print_report(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+
+    failures = check_thresholds(result, args)
+    for failure in failures:
+        print(f"❌ {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
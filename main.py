@@ -8,7 +8,7 @@ VK Bot с DeepSeek AI
 import sys
 import os
 import asyncio
-from vk_bot import VKBot
+from config import Config
 
 def main():
     """
@@ -24,8 +24,15 @@ def main():
             return
         
         # Создаем и запускаем бота
-        bot = VKBot()
-        bot.run()
+        if Config.BOT_WORKERS > 1:
+            # Один процесс читает long poll, сообщения обрабатывают BOT_WORKERS процессов
+            from worker_pool import ShardedBotRunner
+            Config.validate()
+            ShardedBotRunner(Config.BOT_WORKERS).run()
+        else:
+            from vk_bot import VKBot
+            bot = VKBot()
+            bot.run()
         
     except KeyboardInterrupt:
         print("\nБот остановлен пользователем")
@@ -0,0 +1,72 @@
+import logging
+from collections import defaultdict, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    Простые счетчики и распределения времени в памяти процесса.
+    Используются для периодической сводки в логах и в нагрузочных тестах.
+    Имена метрик — строки вида 'inbound.shed.free'.
+    """
+
+    def __init__(self, window: int = 2000):
+        self.window = window
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(lambda: deque(maxlen=self.window))
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        """Записывает значение (обычно длительность в секундах) в скользящее окно"""
+        self.timings[name].append(value)
+
+    def percentile(self, name: str, p: float) -> Optional[float]:
+        """p-й перцентиль (0..100) последних значений или None, если данных нет"""
+        values = self.timings.get(name)
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def ratio(self, hits: str, misses: str) -> Optional[float]:
+        """Доля hits среди hits + misses (например, попадания в кеш)"""
+        total = self.counters.get(hits, 0) + self.counters.get(misses, 0)
+        if not total:
+            return None
+        return self.counters.get(hits, 0) / total
+
+    def snapshot(self) -> dict:
+        timings = {}
+        for name, values in self.timings.items():
+            if values:
+                timings[name] = {
+                    'count': len(values),
+                    'p50': self.percentile(name, 50),
+                    'p95': self.percentile(name, 95),
+                    'p99': self.percentile(name, 99)
+                }
+        return {'counters': dict(self.counters), 'timings': timings}
+
+    def log_summary(self):
+        snapshot = self.snapshot()
+        if snapshot['counters']:
+            counters = ', '.join(f"{name}={value}" for name, value in sorted(snapshot['counters'].items()))
+            logger.info(f"📊 Счетчики: {counters}")
+        for name, stats in sorted(snapshot['timings'].items()):
+            logger.info(
+                f"📊 {name}: n={stats['count']}, p50={stats['p50']:.3f}, "
+                f"p95={stats['p95']:.3f}, p99={stats['p99']:.3f}"
+            )
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+
+# Один экземпляр на процесс
+metrics = Metrics()
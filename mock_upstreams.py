@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальные заглушки внешних API для нагрузочных тестов без реальных сервисов.
+
+Один aiohttp-сервер отвечает за все:
+    /vk/method/...            VK API (messages.*, users.get, execute, groups.getLongPollServer)
+    /vk/longpoll              сервер long poll (события, добавленные через push_message)
+    /deepseek/chat/completions DeepSeek, в том числе потоковый режим (SSE)
+    /yandex/iam/v1/tokens     Yandex IAM
+    /yandex/ocr/v1/recognizeText Yandex OCR
+    /yookassa/v3/payments     ЮКасса
+    /images/<name>.jpg        картинки для вложений-фото
+
+Задержка DeepSeek и OCR — логнормальное распределение с заданной медианой
+и разбросом sigma, плюс доля ответов с ошибкой. Переменные окружения,
+которые направляют бота на заглушки, возвращает MockUpstreams.env().
+
+Пример (отдельный процесс):
+    python mock_upstreams.py --port 8900 --deepseek-latency 2 --deepseek-error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import random
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from aiohttp import web
+
+# Заглушка вместо картинки: OCR-заглушка содержимое не разбирает
+FAKE_JPEG = b'\xff\xd8\xff\xe0' + b'\x00' * 4096 + b'\xff\xd9'
+
+
+def fake_image(name: str) -> bytes:
+    """Картинка с содержимым, зависящим от имени: разные фото не совпадают по хешу"""
+    return FAKE_JPEG[:-2] + name.encode('utf-8') + FAKE_JPEG[-2:]
+
+ANSWER_WORDS = (
+    "это", "тестовый", "ответ", "заглушки", "DeepSeek", "для", "нагрузочного", "теста",
+    "бота", "текст", "генерируется", "по", "частям", "как", "в", "настоящем", "API"
+)
+
+
+class Latency:
+    """Логнормальная задержка: median — медиана в секундах, sigma — разброс (0 — всегда median)"""
+
+    def __init__(self, median: float, sigma: float = 0.0, error_rate: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+class MockUpstreams:
+    """Все заглушки в одном веб-приложении; счетчики запросов — в self.counters"""
+
+    def __init__(self, deepseek: Latency = None, ocr: Latency = None, vk: Latency = None,
+                 completion_tokens: int = 120, stream_chunks: int = 20, cache_hit_ratio: float = 0.0,
+                 prefix_cache: bool = False):
+        self.deepseek = deepseek or Latency(1.0, 0.5)
+        self.ocr = ocr or Latency(0.5, 0.3)
+        self.vk = vk or Latency(0.02)
+        self.completion_tokens = completion_tokens
+        self.stream_chunks = max(1, stream_chunks)
+        self.cache_hit_ratio = cache_hit_ratio
+        # prefix_cache: попадания считаются по уже виденному началу списка сообщений, как у DeepSeek
+        self.prefix_cache = prefix_cache
+        self._seen_prefixes = set()
+        self.counters = defaultdict(int)
+        # Ответы бота пользователям: user_id -> [текст, ...]
+        self.sent = defaultdict(list)
+        # Сообщения бота, которые не удалены: id -> {'text', 'keyboard', 'edited'}
+        self.messages = {}
+        self.base_url = None
+        self._message_ids = itertools.count(1)
+        self._longpoll_events: List[dict] = []
+        self._longpoll_new = asyncio.Event()
+        self._payments = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    # --- Запуск ---
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post('/vk/method/{method}', self.vk_method)
+        app.router.add_route('*', '/vk/longpoll', self.vk_longpoll)
+        app.router.add_post('/deepseek/chat/completions', self.deepseek_completions)
+        app.router.add_post('/yandex/iam/v1/tokens', self.yandex_iam)
+        app.router.add_post('/yandex/ocr/v1/recognizeText', self.yandex_ocr)
+        app.router.add_post('/yookassa/v3/payments', self.yookassa_create)
+        app.router.add_get('/yookassa/v3/payments/{payment_id}', self.yookassa_get)
+        app.router.add_get('/images/{name}', self.image)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запускает сервер (port=0 — любой свободный) и возвращает его базовый адрес"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def env(self) -> dict:
+        """Переменные окружения, направляющие бота на заглушки (задавать до импорта config)"""
+        return {
+            'VK_API_URL': f"{self.base_url}/vk/method",
+            'DEEPSEEK_BASE_URL': f"{self.base_url}/deepseek",
+            'YANDEX_IAM_URL': f"{self.base_url}/yandex/iam/v1/tokens",
+            'YANDEX_OCR_URL': f"{self.base_url}/yandex/ocr/v1/recognizeText",
+            'YOOKASSA_BASE_URL': f"{self.base_url}/yookassa/v3",
+        }
+
+    def photo_attachment(self, width: int = 1280, height: int = 960) -> dict:
+        """Вложение-фото в формате VK со ссылками на картинки заглушки"""
+        name = uuid.uuid4().hex
+        sizes = []
+        for size_type, scale in (('s', 0.1), ('m', 0.25), ('x', 0.5), ('y', 0.8), ('z', 1.0)):
+            sizes.append({
+                'type': size_type,
+                'width': int(width * scale),
+                'height': int(height * scale),
+                'url': f"{self.base_url}/images/{name}_{size_type}.jpg"
+            })
+        return {'type': 'photo', 'photo': {'id': random.randint(1, 10 ** 9), 'owner_id': 1, 'sizes': sizes}}
+
+    def streamed_replies(self) -> List[dict]:
+        """Ответы, дописанные во временное сообщение (потоковый режим) и оставшиеся у пользователя"""
+        return [message for message in self.messages.values() if message['edited']]
+
+    def push_message(self, message: dict, group_id: int = 0):
+        """Добавляет событие message_new для сервера long poll"""
+        self._longpoll_events.append({
+            'type': 'message_new',
+            'event_id': uuid.uuid4().hex,
+            'group_id': group_id,
+            'object': {'message': message, 'client_info': {'keyboard': True, 'inline_keyboard': True}}
+        })
+        self._longpoll_new.set()
+
+    # --- VK ---
+
+    def _vk_call(self, method: str, params: dict):
+        self.counters[f'vk.{method}'] += 1
+        if method == 'messages.send':
+            message_id = next(self._message_ids)
+            self.sent[int(params.get('user_id') or params.get('peer_id') or 0)].append(params.get('message', ''))
+            self.messages[message_id] = {'text': params.get('message', ''), 'keyboard': bool(params.get('keyboard')),
+                                         'edited': False}
+            return message_id
+        if method == 'messages.edit':
+            message = self.messages.get(int(params.get('message_id') or 0))
+            if message is not None:
+                message.update(text=params.get('message', ''), keyboard=bool(params.get('keyboard')), edited=True)
+            return 1
+        if method == 'messages.delete':
+            for message_id in str(params.get('message_ids')).split(','):
+                self.messages.pop(int(message_id), None)
+            return {str(params.get('message_ids')): 1}
+        if method == 'messages.getById':
+            return {'count': 0, 'items': []}
+        if method == 'users.get':
+            return [{'id': int(user_id), 'first_name': 'Тест', 'last_name': f'Пользователь{user_id}'}
+                    for user_id in str(params.get('user_ids', '0')).split(',')]
+        if method == 'groups.getLongPollServer':
+            return {'key': 'mock', 'server': f"{self.base_url}/vk/longpoll", 'ts': str(len(self._longpoll_events))}
+        return 1
+
+    def _vk_execute(self, code: str) -> list:
+        """Разбирает код вида return [API.a({...}),API.b({...})]; который собирает VkOutboundQueue"""
+        decoder = json.JSONDecoder()
+        responses = []
+        position = 0
+        while True:
+            start = code.find('API.', position)
+            if start < 0:
+                return responses
+            bracket = code.index('(', start)
+            method = code[start + len('API.'):bracket]
+            params, end = decoder.raw_decode(code, bracket + 1)
+            responses.append(self._vk_call(method, params))
+            position = end
+
+    async def vk_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        await asyncio.sleep(self.vk.sample())
+        if method == 'execute':
+            self.counters['vk.execute'] += 1
+            return web.json_response({'response': self._vk_execute(params.get('code', ''))})
+        return web.json_response({'response': self._vk_call(method, params)})
+
+    async def vk_longpoll(self, request: web.Request) -> web.Response:
+        ts = int(request.query.get('ts') or 0)
+        wait = float(request.query.get('wait') or 25)
+        if ts >= len(self._longpoll_events):
+            self._longpoll_new.clear()
+            try:
+                await asyncio.wait_for(self._longpoll_new.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        events = self._longpoll_events[ts:]
+        return web.json_response({'ts': str(ts + len(events)), 'updates': events})
+
+    # --- DeepSeek ---
+
+    def _prefix_hit_chars(self, messages: list) -> int:
+        """Длина самого длинного уже встречавшегося префикса (с точностью до сообщения)"""
+        prefix = hashlib.sha256()
+        chars = hit_chars = 0
+        for message in messages:
+            content = message.get('content') or ''
+            prefix.update(json.dumps([message.get('role'), content], ensure_ascii=False).encode('utf-8'))
+            chars += len(content)
+            digest = prefix.hexdigest()
+            if digest in self._seen_prefixes:
+                hit_chars = chars
+            self._seen_prefixes.add(digest)
+        return hit_chars
+
+    def _usage(self, payload: dict, completion_tokens: int) -> dict:
+        messages = payload.get('messages', [])
+        prompt_chars = sum(len(message.get('content') or '') for message in messages)
+        prompt_tokens = max(1, prompt_chars // 3)
+        if self.prefix_cache:
+            hit = min(prompt_tokens, self._prefix_hit_chars(messages) // 3)
+        else:
+            hit = int(prompt_tokens * self.cache_hit_ratio)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_cache_hit_tokens': hit,
+            'prompt_cache_miss_tokens': prompt_tokens - hit
+        }
+
+    def _answer(self, max_tokens: Optional[int]) -> List[str]:
+        tokens = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        return [random.choice(ANSWER_WORDS) + ' ' for _ in range(max(1, tokens))]
+
+    async def deepseek_completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.counters['deepseek.requests'] += 1
+        latency = self.deepseek.sample()
+        if self.deepseek.fails():
+            self.counters['deepseek.errors'] += 1
+            await asyncio.sleep(latency / 2)
+            return web.json_response({'error': {'message': 'Service Unavailable (mock)'}}, status=503)
+
+        words = self._answer(payload.get('max_tokens'))
+        usage = self._usage(payload, len(words))
+        if not payload.get('stream'):
+            await asyncio.sleep(latency)
+            return web.json_response({
+                'id': uuid.uuid4().hex,
+                'object': 'chat.completion',
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words).strip()},
+                             'finish_reason': 'stop'}],
+                'usage': usage
+            })
+
+        # Потоковый режим: первый фрагмент через треть задержки, остальное равномерно
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await asyncio.sleep(latency / 3)
+        chunk_size = math.ceil(len(words) / self.stream_chunks)
+        pause = (latency * 2 / 3) / self.stream_chunks
+        for start in range(0, len(words), chunk_size):
+            chunk = {'choices': [{'index': 0, 'delta': {'content': ''.join(words[start:start + chunk_size])}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            await asyncio.sleep(pause)
+        final = {'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+        await response.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    # --- Yandex ---
+
+    async def yandex_iam(self, request: web.Request) -> web.Response:
+        self.counters['yandex.iam'] += 1
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=12)
+        return web.json_response({
+            'iamToken': f"mock-iam-{uuid.uuid4().hex}",
+            'expiresAt': expires_at.isoformat().replace('+00:00', 'Z')
+        })
+
+    async def yandex_ocr(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.counters['yandex.ocr'] += 1
+        self.counters['yandex.ocr.bytes'] += len(body.get('content') or '') * 3 // 4
+        await asyncio.sleep(self.ocr.sample())
+        if self.ocr.fails():
+            self.counters['yandex.ocr.errors'] += 1
+            return web.json_response({'code': 14, 'message': 'Unavailable (mock)'}, status=503)
+        return web.json_response({'result': {'textAnnotation': {
+            'fullText': "Решите уравнение: 2x + 3 = 11. Найдите x."
+        }}})
+
+    async def image(self, request: web.Request) -> web.Response:
+        self.counters['images'] += 1
+        name = request.match_info['name'].rsplit('_', 1)[0]
+        return web.Response(body=fake_image(name), content_type='image/jpeg')
+
+    # --- ЮКасса ---
+
+    async def yookassa_create(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.counters['yookassa.create'] += 1
+        key = request.headers.get('Idempotence-Key')
+        # Повтор с тем же ключом возвращает тот же платеж, как настоящая ЮКасса
+        payment = self._payments.get(key)
+        if payment is None:
+            payment_id = uuid.uuid4().hex
+            payment = {
+                'id': payment_id,
+                'status': 'pending',
+                'amount': body.get('amount'),
+                'description': body.get('description'),
+                'metadata': body.get('metadata'),
+                'confirmation': {'type': 'redirect', 'confirmation_url': f"{self.base_url}/yookassa/pay/{payment_id}"},
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }
+            self._payments[key] = payment
+            self._payments[payment_id] = payment
+        return web.json_response(payment)
+
+    async def yookassa_get(self, request: web.Request) -> web.Response:
+        self.counters['yookassa.get'] += 1
+        payment = self._payments.get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response({'type': 'error', 'code': 'not_found'}, status=404)
+        # Считаем, что пользователь оплатил сразу после создания
+        return web.json_response({**payment, 'status': 'succeeded'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушки VK, DeepSeek, Yandex Vision и ЮКассы")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--deepseek-latency', type=float, default=1.0, help="медиана задержки DeepSeek, с")
+    parser.add_argument('--deepseek-sigma', type=float, default=0.5, help="разброс задержки (sigma логнормального)")
+    parser.add_argument('--deepseek-error-rate', type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument('--ocr-latency', type=float, default=0.5)
+    parser.add_argument('--ocr-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(
+        deepseek=Latency(args.deepseek_latency, args.deepseek_sigma, args.deepseek_error_rate),
+        ocr=Latency(args.ocr_latency, 0.3, args.ocr_error_rate)
+    )
+
+    async def serve():
+        await mocks.start(args.host, args.port)
+        print("Заглушки запущены. Переменные окружения для бота:")
+        for name, value in mocks.env().items():
+            print(f"{name}={value}")
+        while True:
+            await asyncio.sleep(3600)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
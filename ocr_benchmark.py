@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение распознавания исходных фото и фото после подготовки к OCR.
+
+Берет сохраненные фото (jpg/png) из папки и для каждого готовит вариант так же,
+как бот: уменьшает до короткой стороны OCR_TARGET_MIN_SIDE (как при выборе
+меньшего размера VK) и пережимает до OCR_MAX_IMAGE_BYTES (image_preprocessor.py).
+Печатает размеры до и после, а с --ocr распознает оба варианта через
+Yandex Vision из config.env и сравнивает тексты (доля совпадения 0..1).
+
+Примеры:
+    python ocr_benchmark.py photos/
+    python ocr_benchmark.py photos/ --ocr --min-similarity 0.95 --json result.json
+    python ocr_benchmark.py photos/ --target-min-side 600 --max-bytes 300000 --ocr
+
+С --min-similarity скрипт завершается с кодом 1, если хотя бы одно фото
+распознано хуже порога, поэтому настройки можно проверять перед выкладкой.
+Для подготовки нужен Pillow.
+"""
+
+import argparse
+import asyncio
+import difflib
+import io
+import json
+import os
+import sys
+import time
+from config import Config
+from image_preprocessor import Image, prepare_for_ocr
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Качество JPEG, с которым VK хранит уменьшенные копии фото (примерно)
+VK_JPEG_QUALITY = 87
+
+
+def mime_type_of(path: str) -> str:
+    return 'PNG' if path.lower().endswith('.png') else 'JPEG'
+
+
+def simulate_vk_size(content: bytes, target_min_side: int) -> bytes:
+    """Уменьшает фото до короткой стороны target_min_side, как если бы бот выбрал меньший размер VK"""
+    image = Image.open(io.BytesIO(content))
+    width, height = image.size
+    scale = target_min_side / min(width, height)
+    if scale >= 1:
+        return content
+    image = image.convert('RGB').resize((round(width * scale), round(height * scale)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=VK_JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def similarity(original: str, prepared: str) -> float:
+    return difflib.SequenceMatcher(None, original, prepared).ratio()
+
+
+async def run(args) -> list:
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    client = None
+    if args.ocr:
+        from yandex_vision_client import YandexVisionClient
+        client = YandexVisionClient()
+
+    results = []
+    try:
+        for path in paths:
+            with open(path, 'rb') as file:
+                original = file.read()
+            mime_type = mime_type_of(path)
+
+            started = time.monotonic()
+            prepared = simulate_vk_size(original, args.target_min_side)
+            prepared, prepared_mime = prepare_for_ocr(prepared, mime_type, args.max_bytes, args.target_min_side)
+            result = {
+                'image': os.path.basename(path),
+                'original_bytes': len(original),
+                'prepared_bytes': len(prepared),
+                'prepare_time': time.monotonic() - started,
+            }
+
+            if client:
+                # Оба варианта уже подготовлены — повторно внутри клиента не пережимаем
+                Config.OCR_RECOMPRESS = False
+                try:
+                    original_text, original_ok = await client._recognize_content(path, original, mime_type, None)
+                    prepared_text, prepared_ok = await client._recognize_content(path, prepared, prepared_mime, None)
+                finally:
+                    Config.OCR_RECOMPRESS = True
+                result.update({
+                    'ok': original_ok and prepared_ok,
+                    'original_chars': len(original_text),
+                    'prepared_chars': len(prepared_text),
+                    'similarity': similarity(original_text, prepared_text),
+                })
+            results.append(result)
+    finally:
+        if client:
+            await client.close()
+    return results
+
+
+def print_report(results: list):
+    if not results:
+        print("Фото не найдены")
+        return
+    for result in results:
+        line = (f"{result['image']}: {result['original_bytes'] // 1024} КБ → {result['prepared_bytes'] // 1024} КБ "
+                f"за {result['prepare_time']:.2f} с")
+        if 'similarity' in result:
+            line += (f", текст {result['original_chars']} → {result['prepared_chars']} символов, "
+                     f"совпадение {result['similarity']:.3f}")
+            if not result['ok']:
+                line += " (ошибка распознавания)"
+        print(line)
+
+    original_total = sum(result['original_bytes'] for result in results)
+    prepared_total = sum(result['prepared_bytes'] for result in results)
+    print(f"\nИтого: {original_total // 1024} КБ → {prepared_total // 1024} КБ "
+          f"(экономия {1 - prepared_total / original_total:.0%})")
+    similarities = [result['similarity'] for result in results if 'similarity' in result]
+    if similarities:
+        print(f"Совпадение текста: среднее {sum(similarities) / len(similarities):.3f}, "
+              f"минимальное {min(similarities):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение OCR исходных и подготовленных фото")
+    parser.add_argument('images', help="папка с сохраненными фото (jpg/png)")
+    parser.add_argument('--target-min-side', type=int, default=Config.OCR_TARGET_MIN_SIDE,
+                        help="короткая сторона после уменьшения, px")
+    parser.add_argument('--max-bytes', type=int, default=Config.OCR_MAX_IMAGE_BYTES, help="предел размера файла, байт")
+    parser.add_argument('--ocr', action='store_true', help="распознать оба варианта через Yandex Vision")
+    parser.add_argument('--min-similarity', type=float, help="минимально допустимое совпадение текста")
+    parser.add_argument('--json', help="сохранить результат в файл")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("❌ Для подготовки фото нужен Pillow: pip install Pillow")
+        sys.exit(2)
+
+    # Подготовка сравнивается с текущими настройками, даже если в config.env пережатие выключено
+    Config.OCR_RECOMPRESS = True
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.min_similarity is not None:
+        worse = [result['image'] for result in results
+                 if 'similarity' in result and (not result['ok'] or result['similarity'] < args.min_similarity)]
+        for image in worse:
+            print(f"❌ {image}: совпадение текста ниже {args.min_similarity}")
+        sys.exit(1 if worse else 0)
+
+
+if __name__ == "__main__":
+    main()
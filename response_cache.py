@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from config import Config
+from db_manager import db_manager
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Кеш готовых ответов: LRU в памяти с TTL и ограничением по размеру в байтах,
+    плюс (если доступен PostgreSQL) общая таблица response_cache, которая
+    переживает перезапуск и видна всем процессам.
+
+    Значения — любые JSON-сериализуемые объекты. Попадания и промахи
+    считаются в метриках cache.<namespace>.hit / cache.<namespace>.miss.
+    """
+
+    # Как часто (в записях) чистить устаревшие строки в PostgreSQL
+    PURGE_EVERY = 1000
+
+    def __init__(self, namespace: str, ttl: float = None, max_bytes: int = None, use_postgres: bool = None):
+        self.namespace = namespace
+        self.ttl = ttl or Config.RESPONSE_CACHE_TTL
+        self.max_bytes = max_bytes or Config.RESPONSE_CACHE_MAX_BYTES
+        if use_postgres is None:
+            use_postgres = Config.RESPONSE_CACHE_POSTGRES
+        self.use_postgres = use_postgres and db_manager.use_postgres
+        # key -> (value, expires_at по time.monotonic, размер в байтах)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._writes = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """sha256 от канонического JSON всех частей ключа"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_local(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at, size = entry
+        if expires_at <= time.monotonic():
+            self._remove_local(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_local(self, key: str, value: Any, size: int, ttl: float):
+        if size > self.max_bytes:
+            return
+        self._remove_local(key)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+        # Вытесняем давно не использованные записи, пока не влезем в лимит
+        while self._bytes > self.max_bytes and self._entries:
+            old_key = next(iter(self._entries))
+            self._remove_local(old_key)
+
+    def _remove_local(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self._get_local(key)
+        if value is None and self.use_postgres:
+            row = await asyncio.to_thread(db_manager.get_cache_entry, self.namespace, key)
+            if row:
+                raw, ttl = row
+                try:
+                    value = json.loads(raw)
+                except ValueError:
+                    value = None
+                if value is not None and ttl > 0:
+                    self._put_local(key, value, len(raw.encode('utf-8')), ttl)
+
+        metrics.increment(f'cache.{self.namespace}.{"hit" if value is not None else "miss"}')
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float = None):
+        ttl = ttl or self.ttl
+        raw = json.dumps(value, ensure_ascii=False)
+        self._put_local(key, value, len(raw.encode('utf-8')), ttl)
+        if not self.use_postgres:
+            return
+
+        # Срок жизни считается по часам PostgreSQL: у процессов могут быть разные часы и часовые пояса
+        await asyncio.to_thread(db_manager.set_cache_entry, self.namespace, key, raw, ttl)
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            deleted = await asyncio.to_thread(db_manager.delete_expired_cache_entries)
+            if deleted:
+                logger.info(f"🧹 Кеш {self.namespace}: удалено устаревших записей: {deleted}")
+
+    def hit_ratio(self) -> Optional[float]:
+        return metrics.ratio(f'cache.{self.namespace}.hit', f'cache.{self.namespace}.miss')
@@ -0,0 +1,138 @@
+"""
+Общая политика повторов для внешних API и дедлайн обработки сообщения.
+
+Дедлайн создается при получении сообщения и передается по цепочке вызовов
+(deadline=...). Каждая попытка получает тайм-аут не больше остатка дедлайна,
+а повтор делается, только если после паузы на него еще остается время.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# HTTP-статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Меньше этого времени на попытку нет смысла ее начинать, с
+MIN_ATTEMPT_TIME = 1.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """До дедлайна не осталось времени даже на одну попытку"""
+
+
+def is_retryable_status(status: int) -> bool:
+    return status in RETRYABLE_STATUSES
+
+
+class Deadline:
+    """Момент, к которому обработка сообщения должна закончиться"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Тайм-аут очередной попытки: не больше cap и не больше остатка дедлайна"""
+        return min(cap, self.remaining())
+
+
+class RetryPolicy:
+    """Экспоненциальная пауза между попытками со случайным разбросом (full jitter)"""
+
+    def __init__(self, max_attempts: int = None, base_delay: float = None, max_delay: float = None):
+        self.max_attempts = max_attempts or Config.RETRY_MAX_ATTEMPTS
+        self.base_delay = base_delay if base_delay is not None else Config.RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else Config.RETRY_MAX_DELAY
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед попыткой attempt + 1 (attempt считается с нуля)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def can_retry(self, attempt: int, delay: float, deadline: Optional[Deadline] = None) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        return deadline is None or deadline.remaining() > delay + MIN_ATTEMPT_TIME
+
+
+def _check_deadline(name: str, deadline: Optional[Deadline]):
+    if deadline is not None and deadline.remaining() < MIN_ATTEMPT_TIME:
+        metrics.increment(f'deadline.exceeded.{name}')
+        raise DeadlineExceeded(f"{name}: дедлайн сообщения истек")
+
+
+def _attempt_timeout(cap: float, deadline: Optional[Deadline]) -> float:
+    return deadline.timeout(cap) if deadline else cap
+
+
+async def retry_async(attempt: Callable[[float], Awaitable[Any]], name: str, timeout: float,
+                      deadline: Optional[Deadline] = None, policy: RetryPolicy = None,
+                      should_retry: Callable[[Any], bool] = lambda result: False,
+                      retry_exceptions: Tuple[Type[BaseException], ...] = ()) -> Any:
+    """
+    Вызывает attempt(timeout) с повторами. Повтор — если результат
+    should_retry(result) или попытка выбросила одно из retry_exceptions.
+    Возвращает последний результат или выбрасывает последнее исключение;
+    DeadlineExceeded — если времени не осталось уже до первой попытки.
+    """
+    policy = policy or RetryPolicy()
+    _check_deadline(name, deadline)
+    number = 0
+    while True:
+        error = None
+        result = None
+        try:
+            result = await attempt(_attempt_timeout(timeout, deadline))
+            if not should_retry(result):
+                return result
+        except retry_exceptions as e:
+            error = e
+
+        delay = policy.backoff(number)
+        if not policy.can_retry(number, delay, deadline):
+            if error is not None:
+                raise error
+            return result
+        metrics.increment(f'retry.{name}')
+        logger.warning(f"🔁 {name}: повтор через {delay:.1f} с (попытка {number + 2} из {policy.max_attempts})")
+        await asyncio.sleep(delay)
+        number += 1
+
+
+def retry_sync(attempt: Callable[[float], Any], name: str, timeout: float,
+               deadline: Optional[Deadline] = None, policy: RetryPolicy = None,
+               should_retry: Callable[[Any], bool] = lambda result: False,
+               retry_exceptions: Tuple[Type[BaseException], ...] = ()) -> Any:
+    """То же, что retry_async, для синхронных клиентов (выполняются в пуле потоков)"""
+    policy = policy or RetryPolicy()
+    _check_deadline(name, deadline)
+    number = 0
+    while True:
+        error = None
+        result = None
+        try:
+            result = attempt(_attempt_timeout(timeout, deadline))
+            if not should_retry(result):
+                return result
+        except retry_exceptions as e:
+            error = e
+
+        delay = policy.backoff(number)
+        if not policy.can_retry(number, delay, deadline):
+            if error is not None:
+                raise error
+            return result
+        metrics.increment(f'retry.{name}')
+        logger.warning(f"🔁 {name}: повтор через {delay:.1f} с (попытка {number + 2} из {policy.max_attempts})")
+        time.sleep(delay)
+        number += 1
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов (singleflight).
+
+    Пока запрос с ключом key выполняется, повторные вызовы с тем же ключом
+    не идут во внешний API, а ждут результат первого. Вызов выполняется
+    отдельной задачей: если ожидающий обработчик отменен, остальные
+    все равно получат результат. Работает в пределах одного процесса.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]],
+                 on_shared: Optional[Callable[[], None]] = None) -> Tuple[Any, bool]:
+        """
+        Возвращает (результат, shared). shared=True — результат получен
+        от чужого запроса, сами во внешний API не ходили.
+        on_shared вызывается при присоединении к чужому запросу (например,
+        чтобы поднять его приоритет до тарифа присоединившегося).
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            metrics.increment(f'singleflight.{self.name}.shared')
+            logger.info(f"Запрос {self.name} уже выполняется, ждем его результат")
+            if on_shared:
+                on_shared()
+        else:
+            metrics.increment(f'singleflight.{self.name}.leader')
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Помечаем исключение полученным, даже если все ожидающие уже отменены
+        if not task.cancelled():
+            task.exception()
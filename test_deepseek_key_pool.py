@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+from deepseek_key_pool import (
+    DeepSeekKeyPool, CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, OUTCOME_FAILURE, OUTCOME_NEUTRAL, OUTCOME_OK
+)
+
+
+class HalfOpenProbeTest(unittest.TestCase):
+    """Пробный запрос на выведенный из ротации ключ, который ничего не показал"""
+
+    def setUp(self):
+        self.pool = DeepSeekKeyPool(['key-1', 'key-2'])
+        self.broken, self.healthy = self.pool.keys
+        self.pool._open(self.broken, 60)
+        self.cooldown = self.broken.cooldown
+        # Пауза истекла — следующий запрос пойдет на ключ пробным
+        self.broken.open_until = 0.0
+        self.probe = self.pool.acquire()
+        self.assertIs(self.probe, self.broken)
+        self.assertEqual(self.broken.circuit, CIRCUIT_HALF_OPEN)
+
+    def assert_waits_for_probe(self):
+        self.assertEqual(self.broken.circuit, CIRCUIT_OPEN)
+        self.assertEqual(self.broken.cooldown, self.cooldown)
+        self.assertEqual(self.broken.in_flight, 0)
+        # Обычные запросы на ключ не идут: только одна новая проба, пока она в работе
+        self.assertIs(self.pool.acquire(), self.broken)
+        for _ in range(5):
+            self.assertIs(self.pool.acquire(), self.healthy)
+
+    def test_cancelled_probe_request_keeps_key_out_of_rotation(self):
+        async def probe_request():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # Так отмененный запрос возвращает ключ в DeepSeekClient
+                self.pool.release(self.probe, OUTCOME_NEUTRAL, 0.0)
+                raise
+
+        async def run():
+            task = asyncio.create_task(probe_request())
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        self.assert_waits_for_probe()
+
+    def test_probe_cancelled_before_start_keeps_key_out_of_rotation(self):
+        self.pool.cancel(self.probe)
+        self.assert_waits_for_probe()
+
+    def test_successful_probe_returns_key(self):
+        self.pool.release(self.probe, OUTCOME_OK, 1.0)
+        self.assertEqual(self.broken.circuit, CIRCUIT_CLOSED)
+
+    def test_failed_probe_doubles_cooldown(self):
+        self.pool.release(self.probe, OUTCOME_FAILURE, 1.0)
+        self.assertEqual(self.broken.circuit, CIRCUIT_OPEN)
+        self.assertEqual(self.broken.cooldown, self.cooldown * 2)
+        self.assertIs(self.pool.acquire(), self.healthy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Приблизительный подсчет токенов без токенизатора модели.
+
+Для латиницы и цифр в среднем ~4 символа на токен, для кириллицы
+и прочих не-ASCII символов ~2.5. На каждое сообщение чата добавляется
+служебная надбавка (роль, разделители). Оценка нужна для ограничения
+истории по бюджету, точность в пределах 10-20% здесь достаточна.
+"""
+import math
+from typing import List
+
+ASCII_CHARS_PER_TOKEN = 4.0
+NON_ASCII_CHARS_PER_TOKEN = 2.5
+MESSAGE_OVERHEAD_TOKENS = 4
+# Меньше этого обрезанное сообщение уже бесполезно — такое не оставляем
+MIN_TRUNCATED_TOKENS = 32
+TRUNCATION_MARK = " …"
+# Если история не влезает в бюджет, она сокращается до этой доли бюджета (или числа сообщений):
+# следующие несколько реплик только дописываются в конец, и начало истории остается в кеше DeepSeek
+TRIM_TARGET_RATIO = 0.6
+
+
+def _char_cost(char: str) -> float:
+    return 1 / ASCII_CHARS_PER_TOKEN if ord(char) < 128 else 1 / NON_ASCII_CHARS_PER_TOKEN
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    non_ascii = sum(1 for char in text if ord(char) >= 128)
+    ascii_count = len(text) - non_ascii
+    return math.ceil(ascii_count / ASCII_CHARS_PER_TOKEN + non_ascii / NON_ASCII_CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get('content') or '')
+
+
+def estimate_messages_tokens(messages: List[dict]) -> int:
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Оставляет начало текста, укладывающееся в max_tokens, и помечает обрезку"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARK)
+    cost = 0.0
+    end = 0
+    for end, char in enumerate(text):
+        cost += _char_cost(char)
+        if cost > budget:
+            break
+    return text[:end].rstrip() + TRUNCATION_MARK
+
+
+def trim_history(history: List[dict], budget: int, max_message_tokens: int) -> List[dict]:
+    """
+    Укладывает историю в budget токенов.
+    Последняя пара (вопрос и ответ) сохраняется целиком, если влезает в бюджет;
+    более старые длинные сообщения обрезаются до max_message_tokens. Обрезка
+    всегда до одной длины, поэтому происходит один раз и текст старых сообщений
+    от реплики к реплике не меняется.
+    Пока история влезает в бюджет, она не сокращается. Когда перестает —
+    самые старые сообщения отбрасываются целиком, пока история не займет
+    TRIM_TARGET_RATIO бюджета. Так начало истории меняется редко и DeepSeek
+    берет его из кеша префикса.
+    Обрезанные сообщения меняются на месте, новые словари не создаются.
+    """
+    for index, message in enumerate(reversed(history)):
+        content = message.get('content') or ''
+        if index >= 2 and estimate_tokens(content) > max_message_tokens:
+            # Обрезаем на месте: сжатие истории находит свои сообщения по id() словаря
+            message['content'] = truncate_to_tokens(content, max_message_tokens)
+    if estimate_messages_tokens(history) <= budget:
+        return history
+
+    target = int(budget * TRIM_TARGET_RATIO)
+    kept = []
+    used = 0
+    for index, message in enumerate(reversed(history)):
+        content = message.get('content') or ''
+        # Последняя пара сохраняется в пределах полного бюджета, более старые сообщения — в пределах target
+        remaining = (budget if index < 2 else target) - used - MESSAGE_OVERHEAD_TOKENS
+        if estimate_tokens(content) > remaining:
+            # Обрезка по остатку бюджета — только для последней пары, которая сама в него не влезает
+            if index >= 2 or remaining < MIN_TRUNCATED_TOKENS:
+                break
+            message['content'] = truncate_to_tokens(content, remaining)
+        kept.append(message)
+        used += estimate_message_tokens(message)
+
+    kept.reverse()
+    # История должна начинаться с реплики пользователя
+    while kept and kept[0].get('role') == 'assistant':
+        kept.pop(0)
+    return kept
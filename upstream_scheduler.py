@@ -0,0 +1,172 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Тариф для неизвестных значений
+DEFAULT_PLAN = 'free'
+# Очередь фоновой работы (сжатие истории) — с наименьшим весом
+BACKGROUND_PLAN = 'background'
+
+# Тариф, в слоте которого выполняется текущая задача (см. UpstreamScheduler.run)
+_current_plan = contextvars.ContextVar('upstream_plan', default=DEFAULT_PLAN)
+
+
+def current_plan() -> str:
+    return _current_plan.get()
+
+
+def plan_weights() -> Dict[str, float]:
+    """Веса тарифов из конфига: при очереди тариф получает долю слотов пропорционально весу"""
+    return {
+        'free': Config.SCHEDULER_WEIGHT_FREE,
+        'lite': Config.SCHEDULER_WEIGHT_LITE,
+        'premium': Config.SCHEDULER_WEIGHT_PREMIUM,
+        'admin_unlimited': Config.SCHEDULER_WEIGHT_ADMIN,
+        BACKGROUND_PLAN: Config.SCHEDULER_WEIGHT_BACKGROUND,
+    }
+
+
+class UpstreamScheduler:
+    """
+    Ограничение числа одновременных запросов к внешнему API с очередями по тарифам.
+
+    Пока свободные слоты есть, запрос выполняется сразу. Когда все capacity слотов
+    заняты, запросы ждут в очереди своего тарифа, а освободившийся слот получает
+    очередь с наименьшим "проходом" (stride scheduling): каждый запуск сдвигает
+    проход тарифа на 1/вес. Поэтому при постоянной очереди premium (вес 4)
+    получает вчетверо больше слотов, чем free (вес 1), но free не голодает.
+    Тариф, который простаивал, не копит преимущество: его проход
+    подтягивается к текущему виртуальному времени.
+
+    Запрос с ключом key (общий запрос нескольких пользователей, см. SingleFlight)
+    можно перевести в очередь более весомого тарифа через promote(), пока он ждет.
+    """
+
+    def __init__(self, name: str, capacity: int, weights: Dict[str, float] = None):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.weights = weights or plan_weights()
+        self.active = 0
+        self._queues: Dict[str, deque] = {plan: deque() for plan in self.weights}
+        self._pass: Dict[str, float] = {plan: 0.0 for plan in self.weights}
+        self._virtual_time = 0.0
+        # Ожидающие запросы с ключом: key -> (тариф очереди, future)
+        self._waiting: Dict[Hashable, Tuple[str, asyncio.Future]] = {}
+
+    def _plan(self, plan: str) -> str:
+        return plan if plan in self._queues else DEFAULT_PLAN
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _start(self, plan: str):
+        """Занимает слот за тарифом plan и сдвигает его проход"""
+        self._virtual_time = max(self._virtual_time, self._pass[plan])
+        self._pass[plan] = max(self._pass[plan], self._virtual_time) + 1 / self.weights[plan]
+        self.active += 1
+
+    async def acquire(self, plan: str, key: Optional[Hashable] = None) -> str:
+        """Ждет свободный слот. Возвращает тариф, за которым слот занят (мог повыситься через promote)"""
+        plan = self._plan(plan)
+        started = time.monotonic()
+        if self.active < self.capacity and not self.queued:
+            self._start(plan)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._queues[plan].append(future)
+            if key is not None:
+                self._waiting[key] = (plan, future)
+            metrics.increment(f'scheduler.{self.name}.queued.{plan}')
+            try:
+                await future
+            except asyncio.CancelledError:
+                if key is not None:
+                    plan = self._waiting.get(key, (plan, None))[0]
+                if future.done() and not future.cancelled():
+                    # Слот уже выдан, но ожидающий отменен — возвращаем слот
+                    self.release()
+                elif future in self._queues[plan]:
+                    self._queues[plan].remove(future)
+                raise
+            finally:
+                if key is not None and self._waiting.get(key, (None, None))[1] is future:
+                    plan = self._waiting.pop(key)[0]
+        metrics.observe(f'scheduler.{self.name}.wait.{plan}', time.monotonic() - started)
+        return plan
+
+    def try_acquire(self, plan: str) -> bool:
+        """Занимает слот, только если он свободен прямо сейчас и очереди нет"""
+        if self.active >= self.capacity or self.queued:
+            return False
+        self._start(self._plan(plan))
+        return True
+
+    def promote(self, key: Hashable, plan: str):
+        """
+        Переводит ожидающий запрос key в очередь тарифа plan, если тот весомее.
+        Так общий запрос нескольких пользователей ждет по лучшему из их тарифов
+        """
+        entry = self._waiting.get(key)
+        plan = self._plan(plan)
+        if entry is None:
+            return
+        queued_plan, future = entry
+        if self.weights[plan] <= self.weights[queued_plan] or future not in self._queues[queued_plan]:
+            return
+        self._queues[queued_plan].remove(future)
+        self._queues[plan].append(future)
+        self._waiting[key] = (plan, future)
+        metrics.increment(f'scheduler.{self.name}.promoted.{plan}')
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Раздает свободные слоты очередям с наименьшим проходом"""
+        while self.active < self.capacity:
+            waiting = [plan for plan, queue in self._queues.items() if queue]
+            if not waiting:
+                return
+            plan = min(waiting, key=lambda name: max(self._pass[name], self._virtual_time))
+            future = self._queues[plan].popleft()
+            if future.done():
+                continue
+            self._start(plan)
+            future.set_result(None)
+
+    async def run(self, plan: str, func: Callable[[], Awaitable[T]], key: Optional[Hashable] = None) -> T:
+        """
+        Выполняет func() в слоте тарифа plan. Внутри func тариф слота доступен
+        через current_plan() (например, чтобы занять слот под дублирующий запрос).
+        key — ключ для promote()
+        """
+        plan = await self.acquire(plan, key)
+        token = _current_plan.set(plan)
+        try:
+            return await func()
+        finally:
+            _current_plan.reset(token)
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'capacity': self.capacity,
+            'queued': {plan: len(queue) for plan, queue in self._queues.items() if queue}
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        queued = ', '.join(f"{plan}={count}" for plan, count in stats['queued'].items()) or 'пусто'
+        logger.info(f"📊 Планировщик {self.name}: занято {stats['active']} из {stats['capacity']}, очередь: {queued}")
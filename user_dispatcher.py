@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class UserDispatcher:
+    """
+    Диспетчер обработки сообщений по пользователям.
+
+    У каждого пользователя своя очередь: его сообщения выполняются строго
+    по порядку (как в старом последовательном цикле), а разные пользователи
+    обрабатываются параллельно, но не более max_concurrency одновременно.
+    Очереди, простаивающие дольше idle_timeout секунд, удаляются.
+    """
+
+    def __init__(self, max_concurrency: int, idle_timeout: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.idle_timeout = idle_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # Сколько задач поставлено в очереди и еще не завершено
+        self.pending = 0
+
+    @property
+    def active_users(self) -> int:
+        """Количество пользователей с живой очередью"""
+        return len(self._queues)
+
+    def submit(self, user_id: int, job: Callable[[], Awaitable]):
+        """
+        Ставит задачу в очередь пользователя.
+        job — функция без аргументов, возвращающая корутину.
+        """
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[user_id] = queue
+            self._workers[user_id] = asyncio.create_task(self._worker(user_id, queue))
+        queue.put_nowait(job)
+        self.pending += 1
+
+    async def _worker(self, user_id: int, queue: asyncio.Queue):
+        """Последовательно выполняет задачи одного пользователя"""
+        while True:
+            try:
+                job = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                # Между таймаутом и этой проверкой нет await, поэтому submit
+                # не может успеть положить задачу в удаляемую очередь
+                if queue.empty():
+                    del self._queues[user_id]
+                    del self._workers[user_id]
+                    return
+                continue
+
+            try:
+                async with self._semaphore:
+                    await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Необработанная ошибка в очереди пользователя {user_id}: {e}")
+            finally:
+                self.pending -= 1
+
+    async def drain(self, timeout: float):
+        """Ждет, пока выполнятся уже принятые задачи (не дольше timeout секунд)"""
+        deadline = time.monotonic() + timeout
+        while self.pending > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending > 0:
+            logger.warning(f"Не дождались завершения {self.pending} задач")
+
+    async def close(self):
+        """Отменяет все очереди (при остановке бота)"""
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queues.clear()
+        self._workers.clear()
+        self.pending = 0
@@ -4,6 +4,7 @@ from typing import Dict, Optional, List, Tuple
 from datetime import datetime, timedelta
 from config import Config
 from db_manager import db_manager # Импортируем наш новый менеджер БД
+from token_counter import TRIM_TARGET_RATIO, trim_history, estimate_messages_tokens
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,6 +13,8 @@ class UserManager:
     def __init__(self):
         # Теперь self.users - это кеш, а не основное хранилище
         self.users_cache = {}
+        # Пользователи, для которых сейчас строится краткое содержание истории
+        self._compacting = set()
         self.subscription_plans = self._load_subscription_plans()
 
     def _load_subscription_plans(self):
@@ -55,14 +58,33 @@ class UserManager:
         self.users_cache[user_id_str] = user_data
         return user_data
 
-    def update_user_profile_from_vk(self, user_id: int, vk_api):
+    def get_plan(self, user_id: int) -> str:
+        """
+        Действующий тариф пользователя: admin_unlimited, premium, lite или free
+        (истекшая подписка считается free). Используется для приоритизации.
+        """
+        user = self.get_user(user_id)
+        if user.get('admin_unlimited'):
+            return 'admin_unlimited'
+
+        plan_type = user.get('subscription_type') or 'free'
+        expires_str = user.get('subscription_end')
+        if plan_type != 'free' and expires_str:
+            try:
+                if datetime.fromisoformat(expires_str) < datetime.now():
+                    return 'free'
+            except (ValueError, TypeError):
+                pass
+        return plan_type
+
+    async def update_user_profile_from_vk(self, user_id: int, vk_api):
         """
         Получает информацию о пользователе из VK API и сохраняет в БД.
         Вызывается при первом контакте с ботом.
         """
         try:
             # Получаем информацию о пользователе из VK
-            user_info = vk_api.users.get(user_ids=user_id, fields='first_name,last_name,phone')[0]
+            user_info = (await vk_api.users.get(user_ids=user_id, fields='first_name,last_name,phone'))[0]
             
             first_name = user_info.get('first_name', '')
             last_name = user_info.get('last_name', '')
@@ -101,14 +123,84 @@ class UserManager:
         history.append({"role": role, "content": content})
         
         if len(history) > Config.MAX_HISTORY_MESSAGES:
-            history = history[-Config.MAX_HISTORY_MESSAGES:]
+            # Сокращаем с запасом, целыми парами: иначе начало истории сдвигалось бы на каждой реплике
+            keep = max(2, int(Config.MAX_HISTORY_MESSAGES * TRIM_TARGET_RATIO) // 2 * 2)
+            history = history[-keep:]
+            while history and history[0].get('role') == 'assistant':
+                history.pop(0)
+        # Укладываем историю в бюджет токенов тарифа
+        history = trim_history(history, self.get_history_token_budget(user_id), Config.HISTORY_MESSAGE_MAX_TOKENS)
             
         user['conversation_history'] = history
         # Нет необходимости сохранять в БД каждое сообщение
 
+    def get_history_token_budget(self, user_id: int) -> int:
+        """Сколько токенов истории отправлять в DeepSeek для тарифа пользователя"""
+        budgets = {
+            'free': Config.HISTORY_TOKEN_BUDGET_FREE,
+            'lite': Config.HISTORY_TOKEN_BUDGET_LITE,
+            'premium': Config.HISTORY_TOKEN_BUDGET_PREMIUM,
+            'admin_unlimited': Config.HISTORY_TOKEN_BUDGET_PREMIUM,
+        }
+        return budgets.get(self.get_plan(user_id), Config.HISTORY_TOKEN_BUDGET_FREE)
+
+    def get_conversation_summary(self, user_id: int) -> Optional[str]:
+        """Краткое содержание ранней части диалога (если история уже сжималась)"""
+        return self.get_user(user_id).get('conversation_summary')
+
+    def _history_for_compaction(self, user_id: int) -> Optional[list]:
+        """
+        Если история приближается к бюджету токенов или к пределу по числу сообщений,
+        возвращает старые сообщения для сжатия в краткое содержание (последние
+        HISTORY_SUMMARY_KEEP_MESSAGES остаются как есть). Иначе None.
+        """
+        if not Config.HISTORY_SUMMARY_ENABLED or user_id in self._compacting:
+            return None
+        history = self.get_history(user_id)
+        keep = Config.HISTORY_SUMMARY_KEEP_MESSAGES
+        if len(history) <= keep:
+            return None
+
+        budget = self.get_history_token_budget(user_id)
+        over_tokens = estimate_messages_tokens(history) > budget * Config.HISTORY_SUMMARY_TRIGGER_RATIO
+        over_count = len(history) >= Config.MAX_HISTORY_MESSAGES
+        if not over_tokens and not over_count:
+            return None
+        return history[:-keep]
+
+    def needs_history_compaction(self, user_id: int) -> bool:
+        """Нужно ли сжатие истории (без захвата, см. take_history_for_compaction)"""
+        return self._history_for_compaction(user_id) is not None
+
+    def take_history_for_compaction(self, user_id: int) -> Optional[list]:
+        """
+        Сообщения для сжатия (см. _history_for_compaction) или None. Пока сжатие
+        не завершено через apply_history_summary / release_history_compaction,
+        повторно история пользователя не выдается
+        """
+        summarized = self._history_for_compaction(user_id)
+        if summarized:
+            self._compacting.add(user_id)
+        return summarized
+
+    def apply_history_summary(self, user_id: int, summary: str, summarized: list):
+        """Заменяет сжатые сообщения кратким содержанием; новые сообщения, пришедшие за это время, сохраняются"""
+        self._compacting.discard(user_id)
+        user = self.get_user(user_id)
+        summarized_ids = {id(message) for message in summarized}
+        user['conversation_history'] = [
+            message for message in self.get_history(user_id) if id(message) not in summarized_ids
+        ]
+        user['conversation_summary'] = summary
+
+    def release_history_compaction(self, user_id: int):
+        """Сжатие не удалось — история остается как есть"""
+        self._compacting.discard(user_id)
+
     def clear_history(self, user_id: int):
         user = self.get_user(user_id)
         user['conversation_history'] = []
+        user['conversation_summary'] = None
 
     def can_make_deepseek_request(self, user_id: int) -> Tuple[bool, str]:
         """Проверяет, может ли пользователь сделать запрос к DeepSeek API"""
@@ -255,6 +347,15 @@ class UserManager:
         if db_manager.update_user(user_id, yandex_requests_count=new_count):
             user['yandex_requests_count'] = new_count
 
+    def refund_yandex_request(self, user_id: int):
+        """Возвращает запрос к Yandex Vision, списанный заранее, если он не понадобился"""
+        user = self.get_user(user_id)
+        if user.get('admin_unlimited'):
+            return
+        new_count = max(0, (user.get('yandex_requests_count', 0) or 0) - 1)
+        if db_manager.update_user(user_id, yandex_requests_count=new_count):
+            user['yandex_requests_count'] = new_count
+
     def increment_token_usage(self, user_id: int, amount: int):
         """Увеличивает количество использованных токенов и уменьшает остаток"""
         user = self.get_user(user_id)
@@ -0,0 +1,115 @@
+import aiohttp
+import logging
+from typing import Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class VkApiError(Exception):
+    """Ошибка, которую вернул VK API"""
+
+    def __init__(self, method: str, error: dict):
+        self.method = method
+        self.error = error
+        self.code = error.get('error_code')
+        self.message = error.get('error_msg', '')
+        super().__init__(f"[{self.code}] {self.message} ({method})")
+
+
+class AsyncVkApiMethod:
+    """
+    Асинхронный аналог vk_api.VkApiMethod:
+    >>> await vk.messages.send(user_id=1, message='...', random_id=0)
+    """
+
+    __slots__ = ('_vk', '_method')
+
+    def __init__(self, vk, method: str = None):
+        self._vk = vk
+        self._method = method
+
+    def __getattr__(self, method):
+        if '_' in method:
+            m = method.split('_')
+            method = m[0] + ''.join(i.title() for i in m[1:])
+
+        return AsyncVkApiMethod(
+            self._vk, (f'{self._method}.' if self._method else '') + method
+        )
+
+    async def __call__(self, **kwargs):
+        return await self._vk.call(self._method, kwargs)
+
+
+class AsyncVkApi:
+    """
+    Асинхронный клиент VK API поверх aiohttp.
+    Одна сессия с пулом keep-alive соединений на всё время работы бота.
+    """
+
+    def __init__(self, token: str, api_version: str = None, api_url: str = None):
+        self.token = token
+        self.api_version = api_version or Config.VK_API_VERSION
+        self.api_url = (api_url or Config.VK_API_URL).rstrip('/')
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Лениво создает общую сессию (внутри работающего event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=Config.VK_MAX_CONNECTIONS,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=Config.VK_REQUEST_TIMEOUT)
+            )
+        return self._session
+
+    @staticmethod
+    def _prepare_params(params: dict) -> dict:
+        """Приводит параметры к виду, который принимает VK API (как это делает vk_api)"""
+        prepared = {}
+        for key, value in params.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ','.join(str(x) for x in value)
+            elif isinstance(value, bool):
+                value = int(value)
+            prepared[key] = str(value)
+        return prepared
+
+    async def call_raw(self, method: str, params: dict = None) -> dict:
+        """
+        Вызывает метод VK API и возвращает ответ целиком
+        (нужно для execute, где рядом с response приходит execute_errors)
+        """
+        data = self._prepare_params(params or {})
+        data['access_token'] = self.token
+        data['v'] = self.api_version
+
+        session = self._get_session()
+        async with session.post(f"{self.api_url}/{method}", data=data) as response:
+            return await response.json(content_type=None)
+
+    async def call(self, method: str, params: dict = None):
+        """
+        Вызывает метод VK API и возвращает поле response.
+        При ошибке VK выбрасывает VkApiError.
+        """
+        result = await self.call_raw(method, params)
+        if 'error' in result:
+            raise VkApiError(method, result['error'])
+        return result.get('response')
+
+    def get_api(self) -> AsyncVkApiMethod:
+        return AsyncVkApiMethod(self)
+
+    async def close(self):
+        """Закрывает сессию (при остановке бота)"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("🔒 Сессия VK API закрыта")
@@ -4,12 +4,24 @@ from vk_api.keyboard import VkKeyboard, VkKeyboardColor
 from vk_api.utils import get_random_id
 import asyncio
 import logging
-from typing import Optional
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
 from config import Config
 from user_manager import UserManager
 from deepseek_client import DeepSeekClient
 from yandex_vision_client import YandexVisionClient
+from image_preprocessor import select_photo_size
 from yookassa_client import YooKassaClient
+from user_dispatcher import UserDispatcher
+from vk_async_client import AsyncVkApi
+from vk_outbound import VkOutboundQueue
+from vk_callback_server import VkCallbackServer
+from admission import AdmissionController
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+from history_compactor import HistoryCompactor
+from retry_policy import Deadline
+from upstream_scheduler import BACKGROUND_PLAN, UpstreamScheduler
+from metrics import metrics
 import time
 
 # Настройка логирования
@@ -19,8 +31,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 class VKBot:
-    def __init__(self):
+    def __init__(self, start_longpoll: bool = True, vk_rate_limit: float = None):
+        """
+        start_longpoll=False — режим воркера: события приходят извне, а не из long poll
+        (в режиме Callback API long poll не используется в любом случае).
+        vk_rate_limit — доля общего лимита VK API, если процессов несколько.
+        """
         try:
             # Инициализация конфига
             self.config = Config
@@ -28,12 +47,32 @@ class VKBot:
 
             # Инициализация компонентов
             self.vk_session = vk_api.VkApi(token=self.config.VK_TOKEN)
-            self.longpoll = VkBotLongPoll(self.vk_session, self.config.VK_GROUP_ID)
-            self.vk = self.vk_session.get_api()
+            use_longpoll = start_longpoll and self.config.VK_INGRESS == 'longpoll'
+            self.longpoll = VkBotLongPoll(self.vk_session, self.config.VK_GROUP_ID) if use_longpoll else None
+            # Асинхронный клиент VK API для всех вызовов из обработчиков.
+            # Вызовы идут через очередь с ограничением частоты и пакетированием в execute
+            self.vk_async = AsyncVkApi(self.config.VK_TOKEN)
+            self.vk_outbound = VkOutboundQueue(self.vk_async, rate=vk_rate_limit)
+            self.vk = self.vk_outbound.get_api()
             self.user_manager = UserManager()
             self.deepseek = DeepSeekClient()
+            # Сжатие длинной истории в краткое содержание (в фоне)
+            self.history_compactor = HistoryCompactor(self.user_manager, self.deepseek)
+            # Готовые ответы на одинаковые запросы (часто — первое сообщение без истории)
+            self.response_cache = ResponseCache('deepseek')
+            # Объединение одинаковых одновременных запросов к DeepSeek и распознаванию фото
+            self.deepseek_flight = SingleFlight('deepseek')
+            self.ocr_flight = SingleFlight('ocr')
             self.vision_client = YandexVisionClient()
             self.yookassa = YooKassaClient()
+            # Ограничение одновременных запросов к API с очередями по тарифам (платные вперед)
+            self.deepseek_scheduler = UpstreamScheduler(
+                'deepseek', self.config.DEEPSEEK_MAX_CONCURRENT_PER_KEY * len(self.deepseek.key_pool)
+            )
+            self.deepseek.scheduler = self.deepseek_scheduler
+            self.ocr_scheduler = UpstreamScheduler(
+                'ocr', self.config.YANDEX_MAX_CONCURRENT_PER_ACCOUNT * max(1, len(self.vision_client.accounts))
+            )
 
             # Анти-дублирование исходящих сообщений: user_id -> (last_text, ts)
             self._last_sent = {}
@@ -41,12 +80,20 @@ class VKBot:
             # Хранилище ожидающих платежей: user_id -> {'payment_id': str, 'type': str, 'amount': float}
             self.pending_payments = {}
 
+            # Очереди сообщений по пользователям: порядок внутри пользователя, параллельность между пользователями
+            self.dispatcher = UserDispatcher(self.config.MAX_CONCURRENT_MESSAGES, self.config.USER_QUEUE_IDLE_TIMEOUT)
+            # Отбрасывание сообщений при перегрузке (сначала бесплатный тариф)
+            self.admission = AdmissionController()
+            self._overload_notified = {}  # user_id -> время последнего ответа о высокой нагрузке
+            self._background_tasks = set()
+            self._compaction_tasks = {}  # user_id -> задача сжатия истории (ждет слот или выполняется)
+
             logger.info("Бот инициализирован успешно")
         except ValueError as e:
             logger.error(f"Ошибка инициализации бота: {e}")
             raise
 
-    def send_message(self, user_id: int, message: str, keyboard=None):
+    async def send_message(self, user_id: int, message: str, keyboard=None):
         """
         Отправляет сообщение пользователю с клавиатурой
         """
@@ -77,7 +124,7 @@ class VKBot:
                 except Exception as e:
                     logger.error(f"Ошибка создания клавиатуры: {e}")
             
-            self.vk.messages.send(**params)
+            await self.vk.messages.send(**params)
             self._last_sent[user_id] = (dedup_key[1], now_ts)
             logger.info(f"Сообщение отправлено пользователю {user_id}")
         except Exception as e:
@@ -95,15 +142,15 @@ class VKBot:
         if main_command == admin_command:
             user = self.user_manager.get_user(user_id)
             if user.get('admin_unlimited'):
-                self.send_message(user_id, "✅ У вас уже есть безлимитный доступ.", self.get_main_keyboard())
+                await self.send_message(user_id, "✅ У вас уже есть безлимитный доступ.", self.get_main_keyboard())
                 return
             
             if self.user_manager.grant_admin_unlimited(user_id):
-                self.send_message(user_id, "✅ Безлимитный доступ активирован.", self.get_main_keyboard())
+                await self.send_message(user_id, "✅ Безлимитный доступ активирован.", self.get_main_keyboard())
             else:
-                self.send_message(user_id, "❌ Не удалось активировать безлимитный доступ.", self.get_main_keyboard())
+                await self.send_message(user_id, "❌ Не удалось активировать безлимитный доступ.", self.get_main_keyboard())
         else:
-            self.send_message(user_id, "❌ Эта команда недоступна.", self.get_main_keyboard())
+            await self.send_message(user_id, "❌ Эта команда недоступна.", self.get_main_keyboard())
 
     def get_main_keyboard(self):
         """
@@ -188,13 +235,13 @@ class VKBot:
         """
         return text.startswith(self.config.BOT_PREFIX)
     
-    def handle_button_press(self, user_id: int, text: str):
+    async def handle_button_press(self, user_id: int, text: str, deadline: Optional[Deadline] = None):
         """
         Обрабатывает нажатия кнопок
         """
         if text == "🔥 Подписка":
             # Отправляем нужный текст и показываем меню подписок
-            self.send_message(user_id, "👉Просто отправь свой вопрос и я отвечу на него!", self.get_subscription_keyboard())
+            await self.send_message(user_id, "👉Просто отправь свой вопрос и я отвечу на него!", self.get_subscription_keyboard())
             
             
         elif text == "🎓 Lite - 149₽/мес":
@@ -205,7 +252,7 @@ class VKBot:
 - 10 запросов на обработку фото
 
 💳 Нажмите кнопку "Оплатить Lite" для оплаты."""
-            self.send_message(user_id, message, self.get_payment_keyboard('lite'))
+            await self.send_message(user_id, message, self.get_payment_keyboard('lite'))
             
         elif text == "⭐ Premium - 299₽/мес":
             message = """⭐ Подписка Premium - 299₽/мес
@@ -217,7 +264,7 @@ class VKBot:
 - Расширенные возможности AI
 
 💳 Нажмите кнопку "Оплатить Premium" для оплаты."""
-            self.send_message(user_id, message, self.get_payment_keyboard('premium'))
+            await self.send_message(user_id, message, self.get_payment_keyboard('premium'))
             
         elif text == "🪙 Купить 150.000 токенов":
             message = """🪙 Покупка токенов
@@ -226,7 +273,7 @@ class VKBot:
 📦 Количество: 150.000 токенов
 
 💳 Нажмите кнопку "Оплатить токены" для оплаты."""
-            self.send_message(user_id, message, self.get_payment_keyboard('tokens'))
+            await self.send_message(user_id, message, self.get_payment_keyboard('tokens'))
             
         elif text == "🪙 Купить 15 запросов на обработку фото":
             message = """📸 Покупка запросов на обработку фото
@@ -235,11 +282,11 @@ class VKBot:
 📦 Количество: 15 запросов
 
 💳 Нажмите кнопку "Оплатить фото" для оплаты."""
-            self.send_message(user_id, message, self.get_payment_keyboard('photo'))
+            await self.send_message(user_id, message, self.get_payment_keyboard('photo'))
         
         elif text == "💳 Оплатить Lite" or text == "Оплатить Lite":
             # Создаем платеж для Lite подписки
-            payment, error_type = self.yookassa.create_payment(149.0, "Подписка Lite на 1 месяц", user_id, "lite")
+            payment, error_type = await asyncio.to_thread(self.yookassa.create_payment, 149.0, "Подписка Lite на 1 месяц", user_id, "lite", deadline=deadline)
             if payment:
                 payment_url = payment['confirmation']['confirmation_url']
                 self.pending_payments[user_id] = {
@@ -248,17 +295,17 @@ class VKBot:
                     'amount': 0
                 }
                 message = "💳 Оплата подписки Lite - 149₽\n\nНажмите кнопку ниже для перехода к оплате.\n\nПосле оплаты подписка будет автоматически активирована.\n\n💡 После оплаты напишите 'проверить оплату' для подтверждения."
-                self.send_message(user_id, message, self.get_payment_keyboard('lite', payment_url))
+                await self.send_message(user_id, message, self.get_payment_keyboard('lite', payment_url))
             else:
                 if error_type == 'network':
                     message = "⚠️ Не удалось подключиться к платёжной системе.\n💡 Попробуйте позже при стабильном подключении к интернету."
                 else:
                     message = "❌ Ошибка создания платежа. Проверьте настройки ЮКассы в config.env\n\nУбедитесь, что:\n- YOOKASSA_SHOP_ID указан правильно\n- YOOKASSA_API_KEY указан правильно"
-                self.send_message(user_id, message, self.get_payment_keyboard('lite'))
+                await self.send_message(user_id, message, self.get_payment_keyboard('lite'))
         
         elif text == "💳 Оплатить Premium" or text == "Оплатить Premium":
             # Создаем платеж для Premium подписки
-            payment, error_type = self.yookassa.create_payment(299.0, "Подписка Premium на 1 месяц", user_id, "premium")
+            payment, error_type = await asyncio.to_thread(self.yookassa.create_payment, 299.0, "Подписка Premium на 1 месяц", user_id, "premium", deadline=deadline)
             if payment:
                 payment_url = payment['confirmation']['confirmation_url']
                 self.pending_payments[user_id] = {
@@ -267,17 +314,17 @@ class VKBot:
                     'amount': 0
                 }
                 message = "💳 Оплата подписки Premium - 299₽\n\nНажмите кнопку ниже для перехода к оплате.\n\nПосле оплаты подписка будет автоматически активирована.\n\n💡 После оплаты напишите 'проверить оплату' для подтверждения."
-                self.send_message(user_id, message, self.get_payment_keyboard('premium', payment_url))
+                await self.send_message(user_id, message, self.get_payment_keyboard('premium', payment_url))
             else:
                 if error_type == 'network':
                     message = "⚠️ Не удалось подключиться к платёжной системе.\n💡 Попробуйте позже при стабильном подключении к интернету."
                 else:
                     message = "❌ Ошибка создания платежа. Проверьте настройки ЮКассы в config.env\n\nУбедитесь, что:\n- YOOKASSA_SHOP_ID указан правильно\n- YOOKASSA_API_KEY указан правильно"
-                self.send_message(user_id, message, self.get_payment_keyboard('premium'))
+                await self.send_message(user_id, message, self.get_payment_keyboard('premium'))
         
         elif text == "💳 Оплатить токены" or text == "Оплатить токены":
             # Создаем платеж для токенов
-            payment, error_type = self.yookassa.create_payment(50.0, "Покупка 150.000 токенов", user_id, "tokens")
+            payment, error_type = await asyncio.to_thread(self.yookassa.create_payment, 50.0, "Покупка 150.000 токенов", user_id, "tokens", deadline=deadline)
             if payment:
                 payment_url = payment['confirmation']['confirmation_url']
                 self.pending_payments[user_id] = {
@@ -286,17 +333,17 @@ class VKBot:
                     'amount': 150000
                 }
                 message = "💳 Оплата токенов - 50₽\n\nНажмите кнопку ниже для перехода к оплате.\n\nПосле оплаты вам будет начислено 150.000 токенов.\n\n💡 После оплаты напишите 'проверить оплату' для подтверждения."
-                self.send_message(user_id, message, self.get_payment_keyboard('tokens', payment_url))
+                await self.send_message(user_id, message, self.get_payment_keyboard('tokens', payment_url))
             else:
                 if error_type == 'network':
                     message = "⚠️ Не удалось подключиться к платёжной системе.\n💡 Попробуйте позже при стабильном подключении к интернету."
                 else:
                     message = "❌ Ошибка создания платежа. Проверьте настройки ЮКассы в config.env\n\nУбедитесь, что:\n- YOOKASSA_SHOP_ID указан правильно\n- YOOKASSA_API_KEY указан правильно"
-                self.send_message(user_id, message, self.get_payment_keyboard('tokens'))
+                await self.send_message(user_id, message, self.get_payment_keyboard('tokens'))
         
         elif text == "💳 Оплатить фото" or text == "Оплатить фото":
             # Создаем платеж для фото-запросов
-            payment, error_type = self.yookassa.create_payment(50.0, "Покупка 15 запросов на обработку фото", user_id, "photo")
+            payment, error_type = await asyncio.to_thread(self.yookassa.create_payment, 50.0, "Покупка 15 запросов на обработку фото", user_id, "photo", deadline=deadline)
             if payment:
                 payment_url = payment['confirmation']['confirmation_url']
                 self.pending_payments[user_id] = {
@@ -305,13 +352,13 @@ class VKBot:
                     'amount': 15
                 }
                 message = "💳 Оплата фото-запросов - 50₽\n\nНажмите кнопку ниже для перехода к оплате.\n\nПосле оплаты вам будет начислено 15 запросов на обработку фото.\n\n💡 После оплаты напишите 'проверить оплату' для подтверждения."
-                self.send_message(user_id, message, self.get_payment_keyboard('photo', payment_url))
+                await self.send_message(user_id, message, self.get_payment_keyboard('photo', payment_url))
             else:
                 if error_type == 'network':
                     message = "⚠️ Не удалось подключиться к платёжной системе.\n💡 Попробуйте позже при стабильном подключении к интернету."
                 else:
                     message = "❌ Ошибка создания платежа. Проверьте настройки ЮКассы в config.env\n\nУбедитесь, что:\n- YOOKASSA_SHOP_ID указан правильно\n- YOOKASSA_API_KEY указан правильно"
-                self.send_message(user_id, message, self.get_payment_keyboard('photo'))
+                await self.send_message(user_id, message, self.get_payment_keyboard('photo'))
         
         elif text.lower() == "проверить оплату":
             # Проверяем статус платежа
@@ -319,7 +366,7 @@ class VKBot:
                 payment_info = self.pending_payments[user_id]
                 payment_id = payment_info['payment_id']
                 
-                if self.yookassa.is_payment_succeeded(payment_id):
+                if await asyncio.to_thread(self.yookassa.is_payment_succeeded, payment_id, deadline):
                     payment_type = payment_info['type']
                     amount = payment_info['amount']
                     
@@ -340,24 +387,24 @@ class VKBot:
                     message = "⏳ Платеж еще не завершен. Попробуйте позже."
             else:
                 message = "❌ У вас нет ожидающих платежей."
-            self.send_message(user_id, message, self.get_main_keyboard())
+            await self.send_message(user_id, message, self.get_main_keyboard())
             
         elif text == "⚡ Больше токенов" or text == "🪙 Докупить токены" or text == "📸 Докупить фото": # "Докупить токены" для обратной совместимости
             # Открываем магазин токенов
-            self.send_message(user_id, "🪙 Выберите нужный пакет", self.get_tokens_shop_keyboard())
+            await self.send_message(user_id, "🪙 Выберите нужный пакет", self.get_tokens_shop_keyboard())
             
         elif text == "🪙 Токены" or text == "📸 Фото и токены":
             # Открываем магазин токенов
-            self.send_message(user_id, "🪙 Выберите нужный пакет", self.get_tokens_shop_keyboard())
+            await self.send_message(user_id, "🪙 Выберите нужный пакет", self.get_tokens_shop_keyboard())
             
         elif text == "👤 Профиль":
             # Показываем статус подписки и лимиты из БД
             user_info = self.user_manager.get_user_info(user_id)
-            self.send_message(user_id, user_info, self.get_main_keyboard())
+            await self.send_message(user_id, user_info, self.get_main_keyboard())
             
         elif text == "↩️ Назад":
             message = "🏠 Главное меню"
-            self.send_message(user_id, message, self.get_main_keyboard())
+            await self.send_message(user_id, message, self.get_main_keyboard())
             
         else:
             # Обработка текстовых команд для навигации
@@ -377,7 +424,7 @@ class VKBot:
 
 💳 **Для оплаты:** напишите "оплатить подписку"
 📞 **Свяжитесь с нами:** https://vk.com/creativedgecpp"""
-                self.send_message(user_id, message)
+                await self.send_message(user_id, message)
                 
             elif "поддержка" in text.lower() or "техподдержка" in text.lower():
                 message = """🛠 **Техподдержка**
@@ -386,12 +433,12 @@ class VKBot:
 🔗 https://vk.com/creativedgecpp
 
 Мы поможем решить любые проблемы!"""
-                self.send_message(user_id, message)
+                await self.send_message(user_id, message)
                 
             elif "токены" in text.lower():
                 # Показываем информацию о токенах
                 user_info = self.user_manager.get_user_info(user_id)
-                self.send_message(user_id, user_info)
+                await self.send_message(user_id, user_info)
                 
             elif "оплатить подписку" in text.lower() or "купить подписку" in text.lower():
                 message = """💳 **Оплата подписки**
@@ -402,7 +449,7 @@ class VKBot:
 🔗 https://vk.com/creativedgecpp
 
 Мы поможем оформить подписку и настроить оплату."""
-                self.send_message(user_id, message)
+                await self.send_message(user_id, message)
                 
             elif "купить токены" in text.lower() or "докупить токены" in text.lower():
                 message = """🪙 **Покупка токенов**
@@ -415,12 +462,13 @@ class VKBot:
 🔗 https://vk.com/creativedgecpp
 
 Укажите желаемый пакет: 200,000 или 500,000 токенов."""
-                self.send_message(user_id, message)
+                await self.send_message(user_id, message)
             else:
                 return False  # Не обработано
         return True  # Обработано
     
-    async def handle_message(self, user_id: int, text: str, is_photo_recognition: bool = False):
+    async def handle_message(self, user_id: int, text: str, is_photo_recognition: bool = False,
+                             deadline: Optional[Deadline] = None):
         """
         Обрабатывает входящее текстовое сообщение
         """
@@ -428,7 +476,7 @@ class VKBot:
         user_data = self.user_manager.get_user(user_id)
         is_new_user = False
         if not user_data.get('full_name') or not user_data.get('profile_link'):
-            self.user_manager.update_user_profile_from_vk(user_id, self.vk)
+            await self.user_manager.update_user_profile_from_vk(user_id, self.vk)
             is_new_user = True
 
         # Проверяем, новый ли это пользователь (не делал запросов)
@@ -451,7 +499,7 @@ class VKBot:
 ⚠️ Важно! Оплачивайте при стабильном подключении к интернету
 
 🎯 Выбери действие в меню ниже или просто напиши вопрос!"""
-            self.send_message(user_id, welcome_message, self.get_main_keyboard())
+            await self.send_message(user_id, welcome_message, self.get_main_keyboard())
             # Не обрабатываем первое сообщение как запрос к AI, только приветствие
             return
 
@@ -465,19 +513,30 @@ class VKBot:
         # Для FREE проверяем количество запросов, для LITE/PREMIUM - токены
         can_request, message = self.user_manager.can_make_deepseek_request(user_id)
         if not can_request:
-            self.send_message(user_id, message, self.get_main_keyboard())
+            await self.send_message(user_id, message, self.get_main_keyboard())
             return
 
-        # Получаем историю диалога
+        # Получаем историю диалога и краткое содержание ее ранней части
         history = self.user_manager.get_history(user_id)
+        summary = self.user_manager.get_conversation_summary(user_id)
         # Добавляем текущее сообщение для отправки в API
         api_call_history = history + [{"role": "user", "content": text}]
 
         try:
+            # Такой же запрос уже отвечали — отдаем ответ из кеша без обращения к DeepSeek
+            request_key = self.deepseek.cache_key(api_call_history, summary)
+            plan = self.user_manager.get_plan(user_id)
+            use_cache = self.config.RESPONSE_CACHE_ENABLED and plan in self.config.RESPONSE_CACHE_PLANS
+            if use_cache:
+                cached = await self.response_cache.get(request_key)
+                if cached:
+                    await self._reply_from_cache(user_id, text, plan, cached)
+                    return
+
             # Отправляем "Думаю..."
             thinking_id = None
             try:
-                thinking_message = self.vk.messages.send(
+                thinking_message = await self.vk.messages.send(
                     user_id=user_id,
                     message="🤔 Думаю...",
                     random_id=get_random_id()
@@ -497,38 +556,347 @@ class VKBot:
                 thinking_id = None
             
             # Получаем ответ от DeepSeek
-            response, tokens_used = await self.deepseek.generate_response(api_call_history)
-            
-            # Удаляем сообщение "Думаю..." если оно было отправлено
-            if thinking_id:
-                try:
-                    self.vk.messages.delete(
-                        message_ids=[thinking_id],
-                        delete_for_all=1
-                    )
-                    logger.info(f"Удалено сообщение 'Думаю...' (id: {thinking_id}) для пользователя {user_id}")
-                except Exception as e:
-                    logger.error(f"Ошибка удаления сообщения (id: {thinking_id}): {e}")
+            delivered = False
+            streaming = thinking_id and self.config.DEEPSEEK_STREAMING
+            if streaming:
+                # Потоковый режим: показываем ответ по мере генерации в сообщении "Думаю..."
+                updater = self._make_placeholder_updater(user_id, thinking_id)
+                call = lambda: self.deepseek.generate_response_stream(api_call_history, updater, summary=summary, deadline=deadline)
+            else:
+                call = lambda: self.deepseek.generate_response(api_call_history, summary=summary, deadline=deadline)
+            # Одинаковые одновременные запросы (например, одно задание от всего класса)
+            # идут в DeepSeek один раз, остальные получают тот же ответ
+            (response, tokens_used), shared = await self._run_shared(
+                self.deepseek_flight, self.deepseek_scheduler, request_key, plan, call
+            )
+
+            if streaming:
+                delivered = await self._finish_placeholder(user_id, thinking_id, response)
+            elif thinking_id:
+                # Удаляем сообщение "Думаю..." если оно было отправлено
+                await self._delete_placeholder(user_id, thinking_id)
             
             # Проверяем, был ли ответ успешным
             if tokens_used > 0:
-                # Успех: сохраняем диалог в историю и тратим лимиты
-                # Для всех тарифов тратим токены
-                self.user_manager.increment_token_usage(user_id, tokens_used)
-                # Для FREE увеличиваем счетчик запросов к DeepSeek
-                self.user_manager.increment_deepseek_request_count(user_id)
+                # Успех: сохраняем диалог в историю и тратим лимиты.
+                # Общий ответ списывается так же, как ответ из кеша
+                if not shared or plan in self.config.RESPONSE_CACHE_CHARGE_PLANS:
+                    # Для всех тарифов тратим токены
+                    self.user_manager.increment_token_usage(user_id, tokens_used)
+                    # Для FREE увеличиваем счетчик запросов к DeepSeek
+                    self.user_manager.increment_deepseek_request_count(user_id)
                 self.user_manager.add_to_history(user_id, "user", text)
                 self.user_manager.add_to_history(user_id, "assistant", response)
+                self._schedule_history_compaction(user_id)
+                if use_cache and not shared:
+                    await self.response_cache.set(request_key, {'response': response, 'tokens': tokens_used})
 
-                self.send_message(user_id, response, self.get_main_keyboard())
-            else:
-                # Ошибка: показываем сообщение об ошибке, не сохраняем в историю
-                self.send_message(user_id, response, self.get_main_keyboard())
+            # При ошибке показываем сообщение об ошибке, в историю не сохраняем
+            if not delivered:
+                await self.send_message(user_id, response, self.get_main_keyboard())
                 
         except Exception as e:
             logger.error(f"Ошибка обработки сообщения: {e}")
-            self.send_message(user_id, "❌ Произошла ошибка при обработке вашего сообщения.", self.get_main_keyboard())
+            await self.send_message(user_id, "❌ Произошла ошибка при обработке вашего сообщения.", self.get_main_keyboard())
     
+    @staticmethod
+    async def _run_shared(flight: SingleFlight, scheduler: UpstreamScheduler, key: str, plan: str,
+                          func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Выполняет func() в слоте scheduler, объединяя одинаковые одновременные запросы через flight.
+        Общий запрос ждет в очереди по лучшему тарифу среди присоединившихся пользователей:
+        premium, приславший то же задание, что и free, не ждет в очереди free
+        """
+        return await flight.do(
+            key, lambda: scheduler.run(plan, func, key=key),
+            on_shared=lambda: scheduler.promote(key, plan)
+        )
+
+    async def _reply_from_cache(self, user_id: int, text: str, plan: str, cached: dict):
+        """
+        Отвечает сохраненным ответом. Для тарифов из RESPONSE_CACHE_CHARGE_PLANS
+        запрос списывается так же, как обычный (по токенам исходного ответа)
+        """
+        response = cached['response']
+        logger.info(f"Ответ пользователю {user_id} из кеша (тариф {plan})")
+        if plan in self.config.RESPONSE_CACHE_CHARGE_PLANS:
+            self.user_manager.increment_token_usage(user_id, cached.get('tokens', 0))
+            self.user_manager.increment_deepseek_request_count(user_id)
+        self.user_manager.add_to_history(user_id, "user", text)
+        self.user_manager.add_to_history(user_id, "assistant", response)
+        self._schedule_history_compaction(user_id)
+        await self.send_message(user_id, response, self.get_main_keyboard())
+
+    def _schedule_history_compaction(self, user_id: int):
+        """Запускает в фоне сжатие истории, если она приблизилась к бюджету"""
+        if user_id in self._compaction_tasks or not self.history_compactor.needs_compaction(user_id):
+            return
+        # Сжатие ждет слот в очереди background с наименьшим весом, чтобы не обгонять ответы пользователям.
+        # История захватывается только в слоте: отмененная в очереди задача ничего не держит
+        task = self._spawn(self.deepseek_scheduler.run(
+            BACKGROUND_PLAN, lambda: self.history_compactor.compact(user_id)
+        ))
+        self._compaction_tasks[user_id] = task
+        task.add_done_callback(lambda _: self._compaction_tasks.pop(user_id, None))
+
+    async def _delete_placeholder(self, user_id: int, message_id: int):
+        """
+        Удаляет временное сообщение ("Думаю..." и т.п.)
+        """
+        try:
+            await self.vk.messages.delete(
+                message_ids=[message_id],
+                delete_for_all=1
+            )
+            logger.info(f"Удалено временное сообщение (id: {message_id}) для пользователя {user_id}")
+        except Exception as e:
+            logger.error(f"Ошибка удаления сообщения (id: {message_id}): {e}")
+
+    def _make_placeholder_updater(self, user_id: int, message_id: int):
+        """
+        Возвращает колбэк для потоковой генерации: редактирует временное сообщение
+        накопленным текстом, но не чаще раза в STREAM_EDIT_INTERVAL секунд (лимиты VK)
+        """
+        state = {'last_edit': 0.0, 'last_text': ''}
+
+        async def update(text: str):
+            now = time.monotonic()
+            if now - state['last_edit'] < self.config.STREAM_EDIT_INTERVAL:
+                return
+            partial = text.strip()
+            # Длинный ответ целиком в одно сообщение не влезет — дальше не редактируем
+            if not partial or partial == state['last_text'] or len(partial) + 2 > self.config.MAX_MESSAGE_LENGTH:
+                return
+            state['last_edit'] = now
+            try:
+                await self.vk.messages.edit(peer_id=user_id, message_id=message_id, message=partial + " ▌")
+                state['last_text'] = partial
+            except Exception as e:
+                logger.warning(f"Ошибка обновления сообщения (id: {message_id}): {e}")
+
+        return update
+
+    async def _finish_placeholder(self, user_id: int, message_id: int, text: str) -> bool:
+        """
+        Записывает финальный текст во временное сообщение вместе с главной клавиатурой.
+        Возвращает False, если текст нужно отправить обычным сообщением
+        (слишком длинный или редактирование не удалось) — тогда заглушка удаляется.
+        """
+        if text and len(text) <= self.config.MAX_MESSAGE_LENGTH:
+            try:
+                # Клавиатура — как у ответа обычным сообщением
+                await self.vk.messages.edit(peer_id=user_id, message_id=message_id, message=text,
+                                            keyboard=self.get_main_keyboard().get_keyboard())
+                logger.info(f"Ответ записан в сообщение (id: {message_id}) для пользователя {user_id}")
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка финального редактирования сообщения (id: {message_id}): {e}")
+        await self._delete_placeholder(user_id, message_id)
+        return False
+
+    async def get_message_attachments(self, message) -> list:
+        """
+        Возвращает вложения сообщения.
+        Вложения берутся прямо из события long poll, messages.getById
+        вызывается только если VK прислал сообщение не полностью.
+        """
+        attachments = message.get('attachments')
+        is_truncated = (
+            attachments is None
+            or message.get('is_cropped')
+            or any(a.get('type') == 'photo' and not a.get('photo', {}).get('sizes') for a in attachments)
+        )
+        if not is_truncated:
+            return attachments
+
+        logger.info(f"Сообщение {message.get('id')} пришло без полных вложений, запрашиваем messages.getById")
+        message_info = await self.vk.messages.getById(message_ids=message.get('id'))
+        if message_info and 'items' in message_info and len(message_info['items']) > 0:
+            return message_info['items'][0].get('attachments', [])
+        return attachments or []
+
+    async def process_message(self, message: dict, deadline: Optional[Deadline] = None):
+        """
+        Обрабатывает одно входящее сообщение (объект message из события message_new).
+        deadline — общий срок обработки, передается во все запросы к внешним API
+        """
+        user_id = message['from_id']
+        text = message.get('text') or ""
+
+        has_images = False
+        try:
+            attachments = await self.get_message_attachments(message)
+            images = []
+            for attachment in attachments:
+                if attachment.get('type') == 'photo':
+                    photo_data = attachment.get('photo', {})
+                    best_url = self.get_photo_url_for_ocr(photo_data)
+                    logger.info(f"Получено изображение от {user_id}. URL: {best_url}")
+                    images.append((best_url, self.get_photo_id(photo_data)))
+            if images:
+                has_images = True
+                await self.handle_image_message(user_id, images, text, deadline)
+        except Exception as e:
+            logger.error(f"Ошибка получения вложений: {e}")
+
+        if not has_images and text:
+            logger.info(f"Обрабатываем сообщение: {text}")
+
+            # Сначала проверяем, не является ли это нажатием кнопки или навигационной командой
+            if await self.handle_button_press(user_id, text, deadline):
+                return  # Команда обработана
+
+            # Если нет, то обрабатываем как сообщение для AI
+            try:
+                await self.handle_message(user_id, text, deadline=deadline)
+            except Exception as e:
+                logger.error(f"Ошибка обработки сообщения: {e}")
+                await self.send_message(user_id, "❌ Произошла ошибка при обработке сообщения.")
+
+    def dispatch_message(self, message: dict):
+        """
+        Принимает новое сообщение из любого источника (long poll, Callback API, процесс-читатель)
+        и ставит его обработку в очередь пользователя
+        """
+        from_id = message.get('from_id', 0)
+        logger.info(f"Новое сообщение от {from_id}: {message.get('text')}")
+
+        if from_id < 0 or from_id == -self.config.VK_GROUP_ID:
+            return
+
+        metrics.increment('inbound.received')
+        pending = self.dispatcher.pending
+        # Тариф смотрим только под нагрузкой, в обычном режиме принимаем всё
+        if pending >= self.admission.lowest_limit:
+            plan = self.user_manager.get_plan(from_id)
+            if not self.admission.admit(plan, pending):
+                self._reply_overloaded(from_id)
+                return
+
+        received_at = time.monotonic()
+        # Дедлайн отсчитывается с момента получения: время в очереди тоже входит в него
+        deadline = Deadline(self.config.MESSAGE_DEADLINE)
+
+        async def job():
+            metrics.observe('stage.queue_wait', time.monotonic() - received_at)
+            await self.process_message(message, deadline)
+            metrics.observe('message.total', time.monotonic() - received_at)
+
+        self.dispatcher.submit(from_id, job)
+
+    def _reply_overloaded(self, user_id: int):
+        """
+        Быстрый ответ на отброшенное сообщение (не чаще раза в OVERLOAD_NOTICE_INTERVAL секунд)
+        """
+        now = time.monotonic()
+        last = self._overload_notified.get(user_id)
+        if last and now - last < self.config.OVERLOAD_NOTICE_INTERVAL:
+            return
+        self._overload_notified[user_id] = now
+        self._spawn(self.send_message(
+            user_id,
+            "⏳ Сейчас высокая нагрузка, я не успеваю обработать ваше сообщение.\n\nПожалуйста, повторите запрос через минуту."
+        ))
+
+    def _spawn(self, coro):
+        """Запускает фоновую задачу и держит ссылку на нее до завершения"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _log_metrics_periodically(self):
+        while True:
+            await asyncio.sleep(self.config.METRICS_LOG_INTERVAL)
+            logger.info(f"📊 Очередь: {self.dispatcher.pending} сообщений, {self.dispatcher.active_users} пользователей")
+            metrics.log_summary()
+            self.deepseek.key_pool.log_stats()
+            self.deepseek_scheduler.log_stats()
+            self.ocr_scheduler.log_stats()
+            prompt_cache_ratio = metrics.ratio('deepseek.prompt_cache.hit_tokens', 'deepseek.prompt_cache.miss_tokens')
+            if prompt_cache_ratio is not None:
+                logger.info(f"📊 Кеш контекста DeepSeek: {prompt_cache_ratio:.0%} токенов промпта из кеша")
+            ocr_hit_ratio = metrics.ratio('ocr.cache.hit', 'ocr.cache.miss')
+            if ocr_hit_ratio is not None:
+                logger.info(f"📊 Кеш распознавания фото: попаданий {ocr_hit_ratio:.0%}")
+            bytes_saved = metrics.counters.get('ocr.preprocess.bytes_saved', 0)
+            if bytes_saved:
+                logger.info(f"📊 Пережатие фото для OCR: сэкономлено {bytes_saved // 1024} КБ")
+            hit_ratio = self.response_cache.hit_ratio()
+            if hit_ratio is not None:
+                logger.info(
+                    f"📊 Кеш ответов: попаданий {hit_ratio:.0%}, "
+                    f"{len(self.response_cache)} записей, {self.response_cache.size_bytes // 1024} КБ"
+                )
+            # Чистим старые отметки об ответах "высокая нагрузка"
+            now = time.monotonic()
+            self._overload_notified = {
+                user_id: ts for user_id, ts in self._overload_notified.items()
+                if now - ts < self.config.OVERLOAD_NOTICE_INTERVAL
+            }
+
+    async def _poll_longpoll(self):
+        """
+        Читает события long poll (синхронный запрос vk_api) в пуле потоков
+        """
+        while True:
+            try:
+                events = await asyncio.to_thread(self.longpoll.check)
+            except Exception as e:
+                logger.error(f"Ошибка long poll: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for event in events:
+                if event.type == VkBotEventType.MESSAGE_NEW:
+                    self.dispatch_message(dict(event.message))
+                else:
+                    logger.info(f"Игнорируем событие типа: {event.type}")
+
+    async def _serve_callback(self):
+        """
+        Принимает события через Callback API (см. vk_callback_server.py)
+        """
+        await VkCallbackServer(self.dispatch_message).serve_forever()
+
+    async def _consume_queue(self, queue):
+        """
+        Режим воркера: сообщения приходят от процесса-читателя через multiprocessing.Queue.
+        None в очереди — сигнал завершения: дорабатываем принятые сообщения и выходим.
+        """
+        while True:
+            message = await asyncio.to_thread(queue.get)
+            if message is None:
+                logger.info("Получен сигнал остановки, завершаем обработку сообщений...")
+                await self.dispatcher.drain(self.config.WORKER_SHUTDOWN_TIMEOUT)
+                return
+            self.dispatch_message(message)
+
+    async def _run_async(self, ingress):
+        """
+        Основной цикл бота: один event loop на всё время работы.
+        ingress — корутина, которая получает события и передает их в dispatch_message.
+        """
+        logger.info(f"Максимум параллельно обрабатываемых сообщений: {self.config.MAX_CONCURRENT_MESSAGES}")
+
+        if self.config.METRICS_LOG_INTERVAL > 0:
+            self._spawn(self._log_metrics_periodically())
+        # IAM-токены Yandex обновляются заранее, чтобы запросы фото не ждали их выпуска
+        self.vision_client.start_token_refresher()
+
+        try:
+            await ingress
+        finally:
+            # Отменяем незавершенные обработки и фоновые задачи, закрываем соединения
+            await self.dispatcher.close()
+            for task in list(self._background_tasks):
+                task.cancel()
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+            await self.vk_outbound.close()
+            await self.vk_async.close()
+            await self.deepseek.close()
+            await self.vision_client.close()
+
     def run(self):
         """
         Запускает бота
@@ -537,51 +905,21 @@ class VKBot:
         logger.info(f"ID группы: {self.config.VK_GROUP_ID}")
         logger.info("Ожидание сообщений...")
         
+        if self.config.VK_INGRESS == 'callback':
+            self._run_forever(self._serve_callback())
+        else:
+            self._run_forever(self._poll_longpoll())
+
+    def run_worker(self, queue):
+        """
+        Запускает бота в режиме воркера (см. worker_pool.py)
+        """
+        logger.info("Запуск воркера, ожидание сообщений от процесса-читателя...")
+        self._run_forever(self._consume_queue(queue))
+
+    def _run_forever(self, ingress):
         try:
-            for event in self.longpoll.listen():
-                if event.type == VkBotEventType.MESSAGE_NEW:
-                    message = event.message
-                    logger.info(f"Новое сообщение от {message.from_id}: {message.text}")
-                    
-                    if message.from_id < 0 or message.from_id == -self.config.VK_GROUP_ID:
-                        continue
-                    
-                    user_id = message.from_id
-                    text = message.text or ""
-                    
-                    has_images = False
-                    try:
-                        message_info = self.vk.messages.getById(message_ids=message.id)
-                        if message_info and 'items' in message_info and len(message_info['items']) > 0:
-                            message_data = message_info['items'][0]
-                            attachments = message_data.get('attachments', [])
-                            for attachment in attachments:
-                                if attachment.get('type') == 'photo':
-                                    has_images = True
-                                    photo_data = attachment.get('photo', {})
-                                    best_url = self.get_largest_photo_url(photo_data)
-                                    logger.info(f"Получено изображение от {user_id}. URL: {best_url}")
-                                    asyncio.run(self.handle_image_message(user_id, best_url, text))
-                                    break
-                    except Exception as e:
-                        logger.error(f"Ошибка получения вложений: {e}")
-                    
-                    if not has_images and text:
-                        logger.info(f"Обрабатываем сообщение: {text}")
-
-                        # Сначала проверяем, не является ли это нажатием кнопки или навигационной командой
-                        if self.handle_button_press(user_id, text):
-                            continue  # Если да, то команда обработана, переходим к следующему событию
-
-                        # Если нет, то обрабатываем как сообщение для AI
-                        try:
-                            asyncio.run(self.handle_message(user_id, text))
-                        except Exception as e:
-                            logger.error(f"Ошибка обработки сообщения: {e}")
-                            self.send_message(user_id, "❌ Произошла ошибка при обработке сообщения.")
-                else:
-                    logger.info(f"Игнорируем событие типа: {event.type}")
-                        
+            asyncio.run(self._run_async(ingress))
         except KeyboardInterrupt:
             logger.info("Остановка бота...")
         except Exception as e:
@@ -590,47 +928,89 @@ class VKBot:
             import traceback
             logger.error(f"Трассировка: {traceback.format_exc()}")
                 
-    def get_largest_photo_url(self, photo_data: dict) -> str:
+    @staticmethod
+    def get_photo_id(photo_data: dict) -> Optional[str]:
+        """Идентификатор фото в VK ("owner_id_id") — ключ кеша распознанного текста без скачивания"""
+        if photo_data and photo_data.get('owner_id') is not None and photo_data.get('id') is not None:
+            return f"{photo_data['owner_id']}_{photo_data['id']}"
+        return None
+
+    def get_photo_url_for_ocr(self, photo_data: dict) -> Optional[str]:
         """
-        Находит URL самого большого изображения из данных вложения.
+        Находит URL самого маленького размера фото, на котором текст еще читается
+        (см. OCR_TARGET_MIN_SIDE), или самого большого, если все размеры меньше.
         """
-        if not photo_data or 'sizes' not in photo_data:
-            return None
-        
-        sizes = photo_data['sizes']
-        # Сортируем по ширине, чтобы найти самую большую
-        sizes.sort(key=lambda x: x.get('width', 0), reverse=True)
-        
-        if sizes:
-            largest = sizes[0]
-            width = largest.get('width', 0)
-            height = largest.get('height', 0)
-            url = largest.get('url')
-            logger.info(f"📸 Выбрано изображение: {width}x{height}px, URL: {url[:50]}...")
-            return url
-        
-        return None
+        size = select_photo_size(photo_data)
+        return size.get('url') if size else None
 
-    async def handle_image_message(self, user_id: int, image_url: str, user_text: str):
+    async def _recognize_image(self, user_id: int, plan: str, image_url: Optional[str], photo_id: Optional[str],
+                               deadline: Optional[Deadline], semaphore: asyncio.Semaphore) -> Tuple[str, bool]:
         """
-        Обрабатывает сообщение с изображением.
+        Распознает одно фото из сообщения. Запрос к Yandex уже списан с квоты и
+        возвращается, если не понадобился (нет ссылки, текст из кеша OCR, исключение).
+        Возвращает (текст или сообщение об ошибке, распознан ли текст)
         """
         if not image_url:
-            self.send_message(user_id, "❌ Не удалось получить ссылку на изображение.")
+            self.user_manager.refund_yandex_request(user_id)
+            return "", False
+        try:
+            async with semaphore:
+                # Одно и то же фото, присланное одновременно несколькими пользователями, распознаем один раз
+                (recognized_text, from_cache), _ = await self._run_shared(
+                    self.ocr_flight, self.ocr_scheduler, photo_id or image_url, plan,
+                    lambda: self.vision_client.recognize_text_ex(image_url, deadline, photo_id)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка распознавания фото {photo_id or image_url}: {e}")
+            self.user_manager.refund_yandex_request(user_id)
+            return "", False
+
+        # Текст из кеша OCR не запрашивал — квоту не тратим
+        if from_cache:
+            self.user_manager.refund_yandex_request(user_id)
+        if not recognized_text or "Ошибка" in recognized_text or "ошибка" in recognized_text.lower():
+            logger.warning(f"Текст на изображении не распознан или произошла ошибка: {recognized_text}")
+            return recognized_text or "", False
+        return recognized_text, True
+
+    async def handle_image_message(self, user_id: int, images: List[Tuple[Optional[str], Optional[str]]],
+                                   user_text: str, deadline: Optional[Deadline] = None):
+        """
+        Обрабатывает сообщение с одним или несколькими изображениями.
+        images — пары (URL, photo_id) в порядке вложений; photo_id — "owner_id_id" фото в VK
+        для поиска в кеше распознанного текста. Фото распознаются параллельно
+        (не больше OCR_MAX_PARALLEL_PER_MESSAGE), а тексты уходят в DeepSeek одним запросом
+        """
+        if not any(image_url for image_url, _ in images):
+            await self.send_message(user_id, "❌ Не удалось получить ссылку на изображение.")
             return
 
-        # Проверяем лимит запросов к Yandex Vision
-        can_request, message = self.user_manager.can_make_yandex_request(user_id)
-        if not can_request:
-            self.send_message(user_id, message, self.get_main_keyboard())
+        # Проверяем лимит запросов к Yandex Vision для каждого фото и сразу списываем его,
+        # чтобы параллельные распознавания не превысили квоту
+        allowed = []
+        limit_message = None
+        for image in images:
+            can_request, message = self.user_manager.can_make_yandex_request(user_id)
+            if not can_request:
+                limit_message = message
+                break
+            self.user_manager.increment_yandex_request_count(user_id)
+            allowed.append(image)
+        if not allowed:
+            await self.send_message(user_id, limit_message, self.get_main_keyboard())
             return
+        if limit_message:
+            await self.send_message(
+                user_id, f"⚠️ Лимит распознавания: обработаю {len(allowed)} из {len(images)} фото.\n\n{limit_message}"
+            )
 
         # Отправляем временное сообщение
         thinking_id = None
         try:
-            thinking_message = self.vk.messages.send(
+            thinking_message = await self.vk.messages.send(
                 user_id=user_id,
-                message="🔍 Распознаю текст на изображении...",
+                message="🔍 Распознаю текст на изображении..." if len(allowed) == 1
+                else f"🔍 Распознаю текст на изображениях ({len(allowed)} фото)...",
                 random_id=get_random_id()
             )
             if isinstance(thinking_message, int):
@@ -640,37 +1020,46 @@ class VKBot:
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения 'Распознаю...': {e}")
 
-        # Распознаем текст
-        recognized_text = self.vision_client.recognize_text(image_url)
-        
-        # Увеличиваем счетчик запросов к Yandex (для всех тарифов)
-        self.user_manager.increment_yandex_request_count(user_id)
+        # Распознаем все фото параллельно, результаты — в порядке вложений
+        plan = self.user_manager.get_plan(user_id)
+        semaphore = asyncio.Semaphore(self.config.OCR_MAX_PARALLEL_PER_MESSAGE)
+        results = await asyncio.gather(*(
+            self._recognize_image(user_id, plan, image_url, photo_id, deadline, semaphore)
+            for image_url, photo_id in allowed
+        ))
         
         # Удаляем временное сообщение
         if thinking_id:
-            try:
-                self.vk.messages.delete(message_ids=[thinking_id], delete_for_all=1)
-            except Exception as e:
-                logger.error(f"Ошибка удаления сообщения 'Распознаю...': {e}")
+            await self._delete_placeholder(user_id, thinking_id)
 
-        if not recognized_text or "Ошибка" in recognized_text or "ошибка" in recognized_text.lower():
-            logger.warning(f"Текст на изображении не распознан или произошла ошибка: {recognized_text}")
+        if not any(ok for _, ok in results):
+            recognized_text = results[0][0]
             # Убираем дублирование "Ошибка" в сообщении
             if recognized_text.startswith("Ошибка") or recognized_text.startswith("ошибка"):
                 error_msg = recognized_text
             else:
-                error_msg = f"❌ Не удалось распознать текст на изображении.\n\n{recognized_text}"
-            self.send_message(user_id, error_msg)
+                error_msg = f"❌ Не удалось распознать текст на изображении.\n\n{recognized_text}".strip()
+            await self.send_message(user_id, error_msg)
             return
+
+        if len(results) == 1:
+            recognized_text = results[0][0]
+            photos_word, source_word = "изображение", "изображения"
+        else:
+            recognized_text = "\n\n".join(
+                f"Фото {number}:\n{text if ok else '(текст не распознан)'}"
+                for number, (text, ok) in enumerate(results, 1)
+            )
+            photos_word, source_word = f"{len(results)} фото", "изображений"
         
         # Логируем распознанный текст для отладки
         logger.info(f"📝 Распознанный текст (первые 500 символов): {recognized_text[:500]}")
         
         # Формируем новый промпт для DeepSeek
         if user_text and user_text.strip().lower() in ['решай', 'решить', 'реши', 'solve']:
-            new_prompt = f"""Пользователь прислал изображение с математической задачей и просит решить её.
+            new_prompt = f"""Пользователь прислал {photos_word} с математической задачей и просит решить её.
 
-Распознанный текст с изображения:
+Распознанный текст с {source_word}:
 "{recognized_text}"
 
 КРИТИЧЕСКИ ВАЖНО:
@@ -686,9 +1075,9 @@ class VKBot:
 
 Реши все задачи и примеры из распознанного текста."""
         elif user_text:
-            new_prompt = f"""Пользователь прислал изображение и написал: "{user_text}".
+            new_prompt = f"""Пользователь прислал {photos_word} и написал: "{user_text}".
 
-Распознанный текст с изображения:
+Распознанный текст с {source_word}:
 "{recognized_text}"
 
 ВАЖНО: 
@@ -696,9 +1085,9 @@ class VKBot:
 - Маленькие цифры/символы над или перед большими - это обычно артефакты OCR, игнорируй их
 - Выполни инструкцию пользователя."""
         else:
-            new_prompt = f"""Пользователь прислал изображение.
+            new_prompt = f"""Пользователь прислал {photos_word}.
 
-Распознанный текст с изображения:
+Распознанный текст с {source_word}:
 "{recognized_text}"
 
 ВАЖНО: 
@@ -707,7 +1096,7 @@ class VKBot:
 - Проанализируй содержимое и ответь."""
 
         # Передаем на обработку как обычное сообщение
-        await self.handle_message(user_id, new_prompt, is_photo_recognition=True)
+        await self.handle_message(user_id, new_prompt, is_photo_recognition=True, deadline=deadline)
 
 if __name__ == "__main__":
     bot = VKBot()
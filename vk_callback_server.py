@@ -0,0 +1,94 @@
+"""
+Прием событий VK через Callback API (альтернатива long poll).
+
+VK сам присылает события POST-запросами, поэтому несколько экземпляров
+бота можно поставить за балансировщик нагрузки. Сервер только проверяет
+запрос, отдает событие в обработчик и сразу отвечает "ok" — сама
+обработка сообщения идет в фоне.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable
+from aiohttp import web
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class VkCallbackServer:
+    # Сколько последних event_id помнить для защиты от повторной доставки
+    SEEN_EVENTS_LIMIT = 10000
+
+    def __init__(self, on_message: Callable[[dict], None], confirmation_code: str = None,
+                 secret: str = None, group_id: int = None):
+        self.on_message = on_message
+        self.confirmation_code = confirmation_code or Config.VK_CONFIRMATION_CODE
+        self.secret = secret if secret is not None else Config.VK_CALLBACK_SECRET
+        self.group_id = group_id if group_id is not None else Config.VK_GROUP_ID
+        self._seen_events = OrderedDict()
+
+    def _is_duplicate(self, event_id: str) -> bool:
+        """VK повторяет событие, если не получил "ok" вовремя — второй раз его не обрабатываем"""
+        if not event_id:
+            return False
+        if event_id in self._seen_events:
+            return True
+        self._seen_events[event_id] = True
+        if len(self._seen_events) > self.SEEN_EVENTS_LIMIT:
+            self._seen_events.popitem(last=False)
+        return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+        except Exception:
+            logger.warning("Callback API: получен некорректный JSON")
+            return web.Response(status=400, text='bad request')
+
+        if self.secret and data.get('secret') != self.secret:
+            logger.warning("Callback API: неверный секретный ключ")
+            return web.Response(status=403, text='forbidden')
+        if self.group_id and data.get('group_id') != self.group_id:
+            logger.warning(f"Callback API: событие для чужой группы {data.get('group_id')}")
+            return web.Response(status=403, text='forbidden')
+
+        event_type = data.get('type')
+        if event_type == 'confirmation':
+            logger.info("Callback API: запрос подтверждения адреса сервера")
+            return web.Response(text=self.confirmation_code or '')
+
+        if self._is_duplicate(data.get('event_id')):
+            logger.info(f"Callback API: повторная доставка события {data.get('event_id')}, пропускаем")
+            return web.Response(text='ok')
+
+        if event_type == 'message_new':
+            message = (data.get('object') or {}).get('message')
+            if message:
+                try:
+                    self.on_message(message)
+                except Exception as e:
+                    logger.error(f"Callback API: ошибка постановки события в очередь: {e}")
+        else:
+            logger.info(f"Игнорируем событие типа: {event_type}")
+
+        return web.Response(text='ok')
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(Config.VK_CALLBACK_PATH, self.handle)
+        return app
+
+    async def serve_forever(self, host: str = None, port: int = None):
+        """Запускает HTTP-сервер и работает до отмены"""
+        host = host or Config.VK_CALLBACK_HOST
+        port = port or Config.VK_CALLBACK_PORT
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        logger.info(f"Callback API: ожидание событий на http://{host}:{port}{Config.VK_CALLBACK_PATH}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
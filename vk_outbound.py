@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import time
+from typing import List, Optional
+from config import Config
+from vk_async_client import AsyncVkApi, AsyncVkApiMethod, VkApiError
+
+logger = logging.getLogger(__name__)
+
+# Коды ошибок VK, при которых вызов можно повторить
+VK_TOO_MANY_REQUESTS = 6
+VK_INTERNAL_ERROR = 10
+RETRYABLE_ERROR_CODES = {VK_TOO_MANY_REQUESTS, VK_INTERNAL_ERROR}
+
+
+class TokenBucket:
+    """Ограничитель частоты: не более rate запросов в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _OutboundCall:
+    __slots__ = ('method', 'params', 'future', 'attempts')
+
+    def __init__(self, method: str, params: dict, future: asyncio.Future):
+        self.method = method
+        self.params = params
+        self.future = future
+        self.attempts = 0
+
+
+class VkOutboundQueue:
+    """
+    Очередь исходящих вызовов VK API.
+
+    Все вызовы проходят через token bucket (лимит VK ~20 запросов/сек на сообщество).
+    Если к моменту отправки накопилось несколько вызовов, они упаковываются
+    в один execute (до 25 методов), а результат каждого возвращается своему вызывающему.
+    Ошибки "слишком много запросов" повторяются, а не теряются.
+    """
+
+    def __init__(self, vk: AsyncVkApi, rate: float = None, batch_size: int = None, max_attempts: int = 3):
+        self.vk = vk
+        self.batch_size = min(batch_size or Config.VK_EXECUTE_BATCH_SIZE, 25)
+        self.max_attempts = max_attempts
+        self._bucket = TokenBucket(rate or Config.VK_RATE_LIMIT)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._batches = set()
+
+    def _ensure_worker(self):
+        """Запускает фоновую отправку при первом вызове (нужен работающий event loop)"""
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def call(self, method: str, params: dict = None):
+        """Ставит вызов в очередь и ждет его результата"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_OutboundCall(method, params or {}, future))
+        return await future
+
+    def get_api(self) -> AsyncVkApiMethod:
+        return AsyncVkApiMethod(self)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            await self._bucket.acquire()
+            # Пока ждали разрешения на запрос, могли накопиться другие вызовы — забираем их в тот же execute
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            batch = [item for item in batch if not item.future.done()]
+            if not batch:
+                continue
+
+            task = asyncio.create_task(self._send_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _send_batch(self, batch: List[_OutboundCall]):
+        try:
+            if len(batch) == 1:
+                await self._send_single(batch[0])
+            else:
+                await self._send_execute(batch)
+        except Exception as e:
+            # Ошибка всего запроса (сеть, execute целиком) — повторяем или отдаем ошибку каждому
+            for item in batch:
+                self._fail_or_retry(item, e)
+
+    async def _send_single(self, item: _OutboundCall):
+        try:
+            result = await self.vk.call(item.method, item.params)
+        except VkApiError as e:
+            self._fail_or_retry(item, e)
+            return
+        if not item.future.done():
+            item.future.set_result(result)
+
+    @staticmethod
+    def _build_code(batch: List[_OutboundCall]) -> str:
+        """Собирает VKScript для execute: return [API.a(...), API.b(...)];"""
+        calls = []
+        for item in batch:
+            params = AsyncVkApi._prepare_params(item.params)
+            calls.append(f"API.{item.method}({json.dumps(params, ensure_ascii=False)})")
+        return f"return [{','.join(calls)}];"
+
+    async def _send_execute(self, batch: List[_OutboundCall]):
+        result = await self.vk.call_raw('execute', {'code': self._build_code(batch)})
+        if 'error' in result:
+            raise VkApiError('execute', result['error'])
+
+        responses = result.get('response') or []
+        # Ошибки отдельных методов приходят по порядку, а на месте их результата стоит false
+        execute_errors = list(result.get('execute_errors') or [])
+        logger.debug(f"execute: {len(batch)} вызовов в одном запросе")
+
+        for index, item in enumerate(batch):
+            response = responses[index] if index < len(responses) else False
+            if response is False:
+                error = execute_errors.pop(0) if execute_errors else {'error_code': 0, 'error_msg': 'Unknown execute error'}
+                self._fail_or_retry(item, VkApiError(error.get('method', item.method), error))
+            elif not item.future.done():
+                item.future.set_result(response)
+
+    def _fail_or_retry(self, item: _OutboundCall, error: Exception):
+        if item.future.done():
+            return
+        item.attempts += 1
+        retryable = not isinstance(error, VkApiError) or error.code in RETRYABLE_ERROR_CODES
+        if retryable and item.attempts < self.max_attempts:
+            logger.warning(f"Повтор вызова {item.method} (попытка {item.attempts + 1}): {error}")
+            self._queue.put_nowait(item)
+        else:
+            item.future.set_exception(error)
+
+    async def close(self):
+        """Останавливает отправку и отменяет ожидающие вызовы"""
+        tasks = list(self._batches)
+        if self._worker:
+            tasks.append(self._worker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while self._queue and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if not item.future.done():
+                item.future.cancel()
@@ -0,0 +1,205 @@
+"""
+Многопроцессный режим бота.
+
+Один процесс-читатель получает события (long poll или Callback API) и раскладывает сообщения
+по N процессам-воркерам по user_id. Все сообщения пользователя попадают
+в один и тот же воркер, поэтому каждый воркер владеет своей частью
+UserManager.users_cache и порядок сообщений пользователя сохраняется.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import vk_api
+from vk_api.bot_longpoll import VkBotLongPoll, VkBotEventType
+from config import Config
+from metrics import metrics
+
+# Настройка логирования (как в vk_bot.py; процесс-читатель его не импортирует)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Не чаще раза в N секунд писать в лог об отклоненных сообщениях (при перегрузке их тысячи)
+SHED_LOG_INTERVAL = 10
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class _ParentWatchingQueue:
+    """
+    Обертка над очередью воркера: если процесс-читатель умер аварийно
+    и не прислал None, воркер тоже завершается, а не висит сиротой
+    """
+
+    def __init__(self, message_queue):
+        self._queue = message_queue
+        self._parent = multiprocessing.parent_process()
+
+    def get(self):
+        while True:
+            try:
+                return self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._parent is not None and not self._parent.is_alive():
+                    logger.error("Процесс-читатель завершился, останавливаем воркер")
+                    return None
+
+
+def _worker_main(index: int, message_queue, vk_rate_limit: float):
+    """
+    Точка входа процесса-воркера.
+    Бот импортируется здесь, чтобы соединения с БД создавались уже в дочернем процессе.
+    """
+    # Остановкой воркеров управляет процесс-читатель (через None в очереди)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from vk_bot import VKBot
+    logger.info(f"Воркер #{index} запущен")
+    bot = VKBot(start_longpoll=False, vk_rate_limit=vk_rate_limit)
+    bot.run_worker(_ParentWatchingQueue(message_queue))
+    logger.info(f"Воркер #{index} остановлен")
+
+
+class ShardedBotRunner:
+    def __init__(self, workers_count: int):
+        self.workers_count = workers_count
+        # spawn вместо fork: дочерние процессы не должны наследовать соединения родителя
+        self.ctx = multiprocessing.get_context('spawn')
+        self.queues = [self.ctx.Queue(maxsize=Config.WORKER_QUEUE_SIZE) for _ in range(workers_count)]
+        self.processes = [None] * workers_count
+        # Общий лимит VK API делится между воркерами
+        self.vk_rate_limit = Config.VK_RATE_LIMIT / workers_count
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        # Отклоненные из-за полной очереди сообщения, еще не попавшие в лог
+        self._shed_lock = threading.Lock()
+        self._shed_pending = [0] * workers_count
+        self._shed_logged_at = 0.0
+
+    def _start_worker(self, index: int):
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(index, self.queues[index], self.vk_rate_limit),
+            name=f"smartbot-worker-{index}",
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+
+    def _supervise(self):
+        """Перезапускает упавшие воркеры"""
+        while not self._stopping.wait(Config.WORKER_HEALTHCHECK_INTERVAL):
+            self._log_shed()
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                for index, process in enumerate(self.processes):
+                    if process is not None and not process.is_alive():
+                        logger.error(f"Воркер #{index} завершился с кодом {process.exitcode}, перезапускаем...")
+                        # Упавший процесс мог умереть, удерживая блокировку очереди,
+                        # поэтому новый воркер получает новую очередь. Сообщения,
+                        # не забранные из старой очереди, теряются.
+                        self.queues[index] = self.ctx.Queue(maxsize=Config.WORKER_QUEUE_SIZE)
+                        self._start_worker(index)
+
+    def shard_for(self, user_id: int) -> int:
+        """Номер воркера, который обслуживает пользователя"""
+        return user_id % self.workers_count
+
+    def route_message(self, message: dict):
+        """Передает сообщение воркеру, который владеет этим пользователем"""
+        from_id = message.get('from_id', 0)
+        if from_id < 0 or from_id == -Config.VK_GROUP_ID:
+            return
+        index = self.shard_for(from_id)
+        try:
+            # Без ожидания: зависший воркер не должен останавливать чтение событий
+            # (и цикл событий Callback-сервера) для всех остальных воркеров
+            self.queues[index].put_nowait(message)
+        except queue.Full:
+            metrics.increment(f'inbound.shed.worker_{index}')
+            with self._shed_lock:
+                self._shed_pending[index] += 1
+            self._log_shed()
+
+    def _log_shed(self):
+        """Пишет в лог сводку отклоненных сообщений, не чаще раза в SHED_LOG_INTERVAL секунд"""
+        now = time.monotonic()
+        with self._shed_lock:
+            if not any(self._shed_pending) or now - self._shed_logged_at < SHED_LOG_INTERVAL:
+                return
+            pending, self._shed_pending = self._shed_pending, [0] * self.workers_count
+            self._shed_logged_at = now
+        details = ", ".join(f"#{index} — {count}" for index, count in enumerate(pending) if count)
+        logger.warning(f"⚠️ Очереди воркеров заполнены, отклонено сообщений: {sum(pending)} ({details})")
+
+    def _read_longpoll(self):
+        vk_session = vk_api.VkApi(token=Config.VK_TOKEN)
+        longpoll = VkBotLongPoll(vk_session, Config.VK_GROUP_ID)
+        logger.info("Ожидание сообщений...")
+
+        while True:
+            try:
+                events = longpoll.check()
+            except Exception as e:
+                logger.error(f"Ошибка long poll: {e}")
+                time.sleep(1)
+                continue
+
+            for event in events:
+                if event.type == VkBotEventType.MESSAGE_NEW:
+                    self.route_message(dict(event.message))
+                else:
+                    logger.info(f"Игнорируем событие типа: {event.type}")
+
+    def _serve_callback(self):
+        from vk_callback_server import VkCallbackServer
+        asyncio.run(VkCallbackServer(self.route_message).serve_forever())
+
+    def _shutdown(self):
+        logger.info("Остановка воркеров...")
+        with self._lock:
+            self._stopping.set()
+        for index, message_queue in enumerate(self.queues):
+            try:
+                message_queue.put(None, timeout=1)
+            except queue.Full:
+                # Воркер не разбирает очередь — его остановит terminate ниже
+                logger.warning(f"Очередь воркера #{index} заполнена, сигнал остановки не доставлен")
+
+        deadline = time.monotonic() + Config.WORKER_SHUTDOWN_TIMEOUT + 5
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Воркер #{index} не завершился вовремя, принудительная остановка")
+                process.terminate()
+                process.join()
+
+    def run(self):
+        logger.info(f"Запуск бота в многопроцессном режиме: {self.workers_count} воркеров")
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+        for index in range(self.workers_count):
+            self._start_worker(index)
+        threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True).start()
+
+        try:
+            if Config.VK_INGRESS == 'callback':
+                self._serve_callback()
+            else:
+                self._read_longpoll()
+        except KeyboardInterrupt:
+            logger.info("Остановка бота...")
+        finally:
+            self._shutdown()
@@ -1,13 +1,42 @@
 import jwt
 import time
-import requests
+import json
+import random
+import asyncio
+import aiohttp
 import logging
 import base64
-from datetime import datetime, timedelta
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
 from config import Config
+from metrics import metrics
+from response_cache import ResponseCache
+from image_preprocessor import prepare_for_ocr, warn_if_unavailable
+from retry_policy import RetryPolicy, is_retryable_status, retry_async
 
 logger = logging.getLogger(__name__)
 
+# Временные сетевые ошибки, после которых запрос повторяется
+RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+# Срок жизни токена, если IAM не вернул expiresAt
+DEFAULT_TOKEN_LIFETIME = timedelta(hours=1)
+# Токен перестаем использовать чуть раньше истечения
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=1)
+# Пауза перед повтором неудачного фонового обновления: от MIN до MAX, удваивается
+REFRESH_RETRY_MIN_DELAY = 5
+REFRESH_RETRY_MAX_DELAY = 300
+# Входит в ключ кеша OCR: поменять, если изменятся параметры распознавания (языки, модель)
+OCR_CACHE_VERSION = 'ocr-v1'
+
+
+def _parse_expires_at(value: str) -> Optional[datetime]:
+    """expiresAt из ответа IAM (RFC 3339, например 2024-01-01T12:00:00.123456789Z)"""
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
 class YandexVisionClient:
     def __init__(self):
         self.folder_id = Config.YANDEX_FOLDER_ID
@@ -22,7 +51,8 @@ class YandexVisionClient:
                 'key_id': Config.YANDEX_API_KEY_ID,
                 'secret_key': Config.YANDEX_API_SECRET_KEY.replace('\\n', '\n'),
                 'iam_token': None,
-                'token_expires_at': None
+                'token_expires_at': None,
+                'refresh_at': None
             })
         
         # Второй аккаунт
@@ -32,7 +62,8 @@ class YandexVisionClient:
                 'key_id': Config.YANDEX_API_KEY_ID_2,
                 'secret_key': Config.YANDEX_API_SECRET_KEY_2.replace('\\n', '\n'),
                 'iam_token': None,
-                'token_expires_at': None
+                'token_expires_at': None,
+                'refresh_at': None
             })
         
         # Третий аккаунт
@@ -42,7 +73,8 @@ class YandexVisionClient:
                 'key_id': Config.YANDEX_API_KEY_ID_3,
                 'secret_key': Config.YANDEX_API_SECRET_KEY_3.replace('\\n', '\n'),
                 'iam_token': None,
-                'token_expires_at': None
+                'token_expires_at': None,
+                'refresh_at': None
             })
         
         if not self.accounts:
@@ -51,6 +83,55 @@ class YandexVisionClient:
             logger.info(f"✅ Инициализировано {len(self.accounts)} аккаунтов Yandex Vision для распределения нагрузки")
         
         self.current_account_index = 0
+        self.retry_policy = RetryPolicy()
+        # Общая сессия с пулом keep-alive соединений, создается при первом запросе
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Фоновые задачи обновления IAM-токенов (по одной на аккаунт)
+        self._refresh_tasks = []
+        # Кеш распознанного текста: по хешу содержимого изображения и по id фото в VK
+        self.cache_enabled = Config.OCR_CACHE_ENABLED
+        self.image_cache = ResponseCache('ocr', Config.OCR_CACHE_TTL, Config.OCR_CACHE_MAX_BYTES, Config.OCR_CACHE_POSTGRES)
+        self.photo_cache = ResponseCache('ocr_photo', Config.OCR_CACHE_TTL, Config.OCR_CACHE_MAX_BYTES, Config.OCR_CACHE_POSTGRES)
+        warn_if_unavailable()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Общая HTTP-сессия с пулом keep-alive соединений для IAM, OCR и скачивания фото
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=Config.YANDEX_MAX_CONNECTIONS,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Останавливает обновление токенов и закрывает HTTP-сессию (при остановке бота)"""
+        for task in self._refresh_tasks:
+            task.cancel()
+        await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+        self._refresh_tasks = []
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("🔒 Сессия Yandex Vision закрыта")
+
+    async def _request(self, method: str, name: str, url: str, timeout: float, deadline=None, **kwargs):
+        """
+        HTTP-запрос с повторами при сетевых ошибках, 429 и 5xx.
+        Возвращает (статус, тело ответа в байтах, Content-Type)
+        """
+        async def attempt(attempt_timeout: float):
+            session = self._get_session()
+            async with session.request(method, url, timeout=aiohttp.ClientTimeout(total=attempt_timeout), **kwargs) as response:
+                return response.status, await response.read(), response.headers.get('Content-Type', '')
+
+        return await retry_async(
+            attempt, name, timeout, deadline, self.retry_policy,
+            should_retry=lambda result: is_retryable_status(result[0]),
+            retry_exceptions=RETRY_EXCEPTIONS
+        )
 
     def _get_next_account(self) -> dict:
         """Возвращает следующий аккаунт по кругу (round-robin)"""
@@ -61,183 +142,296 @@ class YandexVisionClient:
         self.current_account_index = (self.current_account_index + 1) % len(self.accounts)
         return account
 
-    def _get_iam_token(self, account: dict) -> str:
-        """
-        Получает IAM-токен для аутентификации в Yandex Cloud.
-        Токен кешируется и обновляется по истечении срока действия.
-        """
-        if account['iam_token'] and account['token_expires_at'] and account['token_expires_at'] > datetime.now():
-            return account['iam_token']
-
-        logger.info(f"IAM-токен устарел или отсутствует для аккаунта {account['service_account_id'][:10]}... Получение нового токена...")
-        
+    @staticmethod
+    def _sign_jwt(account: dict) -> str:
+        """JWT для обмена на IAM-токен (подпись PS256 — заметная работа CPU, вызывается в потоке)"""
         now = int(time.time())
         payload = {
             'aud': 'https://iam.api.cloud.yandex.net/iam/v1/tokens',
             'iss': account['service_account_id'],
             'iat': now,
-            'exp': now + 3600  # Токен живет 1 час
+            'exp': now + 3600  # JWT действует не больше часа
         }
+        return jwt.encode(
+            payload,
+            account['secret_key'],
+            algorithm='PS256',
+            headers={'kid': account['key_id']}
+        )
 
-        try:
-            # Формируем JWT
-            encoded_token = jwt.encode(
-                payload,
-                account['secret_key'],
-                algorithm='PS256',
-                headers={'kid': account['key_id']}
-            )
-            
-            response = requests.post(
-                'https://iam.api.cloud.yandex.net/iam/v1/tokens',
-                json={'jwt': encoded_token}
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            account['iam_token'] = data['iamToken']
-            # Устанавливаем время истечения с запасом в 1 минуту
-            account['token_expires_at'] = datetime.now() + timedelta(hours=1, minutes=-1)
-            logger.info(f"✅ Новый IAM-токен успешно получен для аккаунта {account['service_account_id'][:10]}...")
-            
+    @staticmethod
+    def _token_valid(account: dict) -> bool:
+        expires_at = account['token_expires_at']
+        return bool(account['iam_token'] and expires_at and expires_at - TOKEN_EXPIRY_MARGIN > datetime.now(timezone.utc))
+
+    async def _get_iam_token(self, account: dict, deadline=None) -> str:
+        """
+        IAM-токен для аутентификации в Yandex Cloud.
+        Обычно его заранее обновляет фоновая задача (start_token_refresher), и запрос
+        берет готовый токен. Выпускаем токен здесь, только если действующего нет
+        (первый запрос до запуска обновления или IAM долго недоступен).
+        """
+        if self._token_valid(account):
             return account['iam_token']
-            
-        except ValueError as e:
-            logger.error(f"Ошибка формирования JWT. Скорее всего, неверный формат приватного ключа. Ошибка: {e}")
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка получения IAM-токена: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка при получении IAM-токена: {e}")
-            return None
+        metrics.increment('yandex.iam.on_demand')
+        return await self._issue_token(account, deadline)
+
+    async def _issue_token(self, account: dict, deadline=None, force: bool = False) -> str:
+        """
+        Выпускает новый IAM-токен и запоминает его настоящий срок (expiresAt).
+        Одновременные вызовы одного аккаунта ждут один и тот же выпуск.
+        force — выпустить, даже если текущий токен еще действует (плановое обновление)
+        """
+        lock = account.setdefault('lock', asyncio.Lock())
+        async with lock:
+            # Пока ждали, токен мог получить другой запрос
+            if self._token_valid(account) and not (force and self._refresh_due(account)):
+                return account['iam_token']
+
+            logger.info(f"Получение нового IAM-токена для аккаунта {account['service_account_id'][:10]}...")
+
+            try:
+                encoded_token = await asyncio.to_thread(self._sign_jwt, account)
+            except ValueError as e:
+                logger.error(f"Ошибка формирования JWT. Скорее всего, неверный формат приватного ключа. Ошибка: {e}")
+                return None
+
+            try:
+                issued_at = datetime.now(timezone.utc)
+                status, body, _ = await self._request(
+                    'POST', 'yandex.iam', Config.YANDEX_IAM_URL, 10, deadline, json={'jwt': encoded_token}
+                )
+                if status != 200:
+                    logger.error(f"Ошибка получения IAM-токена: HTTP {status}: {body[:500].decode('utf-8', 'replace')}")
+                    return None
+                data = json.loads(body)
+
+                expires_at = _parse_expires_at(data.get('expiresAt')) or issued_at + DEFAULT_TOKEN_LIFETIME
+                account['iam_token'] = data['iamToken']
+                account['token_expires_at'] = expires_at
+                account['refresh_at'] = self._next_refresh(issued_at, expires_at)
+                logger.info(
+                    f"✅ Новый IAM-токен получен для аккаунта {account['service_account_id'][:10]}..., "
+                    f"действует до {expires_at:%Y-%m-%d %H:%M} UTC, обновление в {account['refresh_at']:%H:%M:%S} UTC"
+                )
+
+                return account['iam_token']
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ошибка получения IAM-токена: {e!r}")
+                return None
+            except Exception as e:
+                logger.error(f"Неожиданная ошибка при получении IAM-токена: {e}")
+                return None
+
+    @staticmethod
+    def _next_refresh(issued_at: datetime, expires_at: datetime) -> datetime:
+        """
+        Когда обновлять токен: через YANDEX_IAM_REFRESH_INTERVAL со случайным разбросом
+        (чтобы аккаунты не обновлялись одновременно), но не позже половины срока жизни
+        """
+        interval = Config.YANDEX_IAM_REFRESH_INTERVAL * random.uniform(1 - Config.YANDEX_IAM_REFRESH_JITTER, 1)
+        half_life = (expires_at - issued_at).total_seconds() / 2
+        return issued_at + timedelta(seconds=max(1.0, min(interval, half_life)))
+
+    @staticmethod
+    def _refresh_due(account: dict) -> bool:
+        return not account['refresh_at'] or account['refresh_at'] <= datetime.now(timezone.utc)
+
+    def start_token_refresher(self):
+        """Запускает фоновое обновление токенов всех аккаунтов (внутри работающего event loop)"""
+        if self._refresh_tasks:
+            return
+        self._refresh_tasks = [asyncio.create_task(self._refresh_loop(account)) for account in self.accounts]
+        if self._refresh_tasks:
+            logger.info(f"🔑 Запущено фоновое обновление IAM-токенов для {len(self._refresh_tasks)} аккаунтов")
+
+    async def _refresh_loop(self, account: dict):
+        retry_delay = REFRESH_RETRY_MIN_DELAY
+        while True:
+            if self._refresh_due(account):
+                if await self._issue_token(account, force=True):
+                    metrics.increment('yandex.iam.refresh')
+                    retry_delay = REFRESH_RETRY_MIN_DELAY
+                else:
+                    # Текущий токен (если есть) продолжает работать до своего expiresAt
+                    metrics.increment('yandex.iam.refresh_failed')
+                    logger.warning(f"⚠️ Не удалось обновить IAM-токен, повтор через {retry_delay} с")
+                    await asyncio.sleep(retry_delay * random.uniform(0.5, 1))
+                    retry_delay = min(REFRESH_RETRY_MAX_DELAY, retry_delay * 2)
+                    continue
+            wait = (account['refresh_at'] - datetime.now(timezone.utc)).total_seconds()
+            await asyncio.sleep(max(1.0, wait))
 
-    def recognize_text(self, image_url: str) -> str:
+    async def recognize_text(self, image_url: str, deadline=None) -> str:
         """
         Распознает текст на изображении по URL.
         Использует round-robin распределение между доступными аккаунтами.
+        deadline ограничивает тайм-ауты и повторы всех запросов.
+        """
+        text, _ = await self.recognize_text_ex(image_url, deadline)
+        return text
+
+    async def recognize_text_ex(self, image_url: str, deadline=None, photo_id: str = None) -> Tuple[str, bool]:
+        """
+        То же, что recognize_text, но возвращает (текст, from_cache).
+        from_cache=True — OCR не вызывался, и запрос не должен тратить квоту пользователя.
+        Кеш ищется сначала по photo_id из VK ("owner_id_id", без скачивания фото),
+        затем по хешу содержимого скачанного изображения.
         """
         logger.info(f"Начинаю распознавание текста для URL: {image_url}")
-        
+
+        if not self.accounts:
+            return "Ошибка: не настроены аккаунты Yandex Vision API.", False
+
+        # Версия входит в оба ключа: после ее смены старые записи (в том числе в PostgreSQL) не используются
+        photo_key = ResponseCache.make_key(OCR_CACHE_VERSION, photo_id) if photo_id else None
+        if self.cache_enabled and photo_key:
+            cached = await self.photo_cache.get(photo_key)
+            if cached is not None:
+                metrics.increment('ocr.cache.hit')
+                logger.info(f"📦 Текст фото {photo_id} взят из кеша")
+                return cached['text'], True
+
+        try:
+            # Скачиваем изображение
+            status, image_content, content_type = await self._request('GET', 'yandex.image', image_url, 20, deadline)
+            if status != 200:
+                logger.error(f"Ошибка скачивания изображения: HTTP {status}")
+                return "Ошибка: не удалось загрузить или обработать изображение.", False
+
+            image_key = None
+            if self.cache_enabled:
+                image_key = ResponseCache.make_key(OCR_CACHE_VERSION, hashlib.sha256(image_content).hexdigest())
+                cached = await self.image_cache.get(image_key)
+                if cached is not None:
+                    metrics.increment('ocr.cache.hit')
+                    logger.info("📦 Текст изображения взят из кеша (совпало содержимое)")
+                    if photo_key:
+                        await self.photo_cache.set(photo_key, cached)
+                    return cached['text'], True
+                metrics.increment('ocr.cache.miss')
+
+            text, recognized = await self._recognize_content(image_url, image_content, content_type, deadline)
+            if recognized and image_key:
+                # Кешируем только ответ OCR, ошибки — нет
+                await self.image_cache.set(image_key, {'text': text})
+                if photo_key:
+                    await self.photo_cache.set(photo_key, {'text': text})
+            return text, False
+
+        except asyncio.TimeoutError:
+            # Сюда же попадает DeadlineExceeded — дедлайн сообщения истек
+            logger.error("Тайм-аут при скачивании изображения или запросе к OCR.")
+            return "Ошибка: слишком долгое ожидание ответа при обработке изображения.", False
+        except aiohttp.ClientError as e:
+            logger.error(f"Ошибка сети при обработке изображения: {e}")
+            return "Ошибка: не удалось загрузить или обработать изображение.", False
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка в recognize_text: {e}")
+            return "Произошла непредвиденная ошибка при распознавании текста.", False
+
+    async def _recognize_content(self, image_url: str, image_content: bytes, content_type: str,
+                                 deadline=None) -> Tuple[str, bool]:
+        """Отправляет скачанное изображение в OCR. Возвращает (текст или ошибка, успешно ли)"""
         # Получаем следующий аккаунт для распределения нагрузки
         account = self._get_next_account()
-        if not account:
-            return "Ошибка: не настроены аккаунты Yandex Vision API."
-        
         account_idx = self.accounts.index(account)
         logger.info(f"🔄 Используется аккаунт #{account_idx + 1} из {len(self.accounts)} для распределения нагрузки")
-        
-        iam_token = self._get_iam_token(account)
+
+        iam_token = await self._get_iam_token(account, deadline)
         if not iam_token:
-            return "Ошибка: не удалось авторизоваться в Yandex Vision. Проверьте, что YANDEX_API_SECRET_KEY в файле config.env содержит корректный PEM-ключ."
+            return "Ошибка: не удалось авторизоваться в Yandex Vision. Проверьте, что YANDEX_API_SECRET_KEY в файле config.env содержит корректный PEM-ключ.", False
 
-        try:
-            # Скачиваем изображение
-            image_response = requests.get(image_url, timeout=20)
-            image_response.raise_for_status()
-            image_content = image_response.content
-            
-            # Определяем MIME тип по заголовкам или расширению
-            content_type = image_response.headers.get('Content-Type', '')
-            if 'png' in content_type.lower() or image_url.lower().endswith('.png'):
-                mime_type = "PNG"
-            elif 'jpeg' in content_type.lower() or 'jpg' in content_type.lower() or image_url.lower().endswith(('.jpg', '.jpeg')):
-                mime_type = "JPEG"
+        # Определяем MIME тип по заголовкам или расширению
+        if 'png' in content_type.lower() or image_url.lower().endswith('.png'):
+            mime_type = "PNG"
+        elif 'jpeg' in content_type.lower() or 'jpg' in content_type.lower() or image_url.lower().endswith(('.jpg', '.jpeg')):
+            mime_type = "JPEG"
+        else:
+            mime_type = "JPEG"  # По умолчанию
+
+        # Крупные фото уменьшаем и пережимаем: base64 раздувает тело запроса на треть
+        image_content, mime_type = await asyncio.to_thread(prepare_for_ocr, image_content, mime_type)
+        
+        # Кодируем в Base64
+        encoded_content = base64.b64encode(image_content).decode('utf-8')
+        
+        headers = {
+            'Authorization': f'Bearer {iam_token}',
+            'x-folder-id': self.folder_id,
+            'Content-Type': 'application/json'
+        }
+        
+        body = {
+            "mimeType": mime_type,
+            "languageCodes": ["*"],  # Все языки
+            # Убираем model - используем дефолтную модель для лучшего качества
+            "content": encoded_content
+        }
+        
+        # Логируем информацию об изображении
+        if len(image_content) > 2:
+            # Пытаемся определить размер изображения из заголовка
+            if image_content[:2] == b'\xff\xd8':  # JPEG
+                logger.info(f"📸 JPEG изображение, размер файла: {len(image_content)} байт")
+            elif image_content[:8] == b'\x89PNG\r\n\x1a\n':  # PNG
+                logger.info(f"📸 PNG изображение, размер файла: {len(image_content)} байт")
             else:
-                mime_type = "JPEG"  # По умолчанию
-            
-            # Кодируем в Base64
-            encoded_content = base64.b64encode(image_content).decode('utf-8')
+                logger.info(f"📸 Изображение, размер файла: {len(image_content)} байт")
+        else:
+            logger.warning(f"⚠️ Изображение слишком маленькое: {len(image_content)} байт")
+        
+        # Отправляем запрос на распознавание
+        status, ocr_body, _ = await self._request(
+            'POST', 'yandex.ocr', Config.YANDEX_OCR_URL, 30, deadline, headers=headers, json=body
+        )
+        
+        if status == 200:
+            result = json.loads(ocr_body).get('result', {})
+            text_annotation = result.get('textAnnotation', {})
+            full_text = text_annotation.get('fullText', '')
             
-            headers = {
-                'Authorization': f'Bearer {iam_token}',
-                'x-folder-id': self.folder_id,
-                'Content-Type': 'application/json'
-            }
+            # Логируем распознанный текст для отладки
+            logger.info(f"✅ Текст успешно распознан (аккаунт #{account_idx + 1}). Длина: {len(full_text)} символов.")
+            if full_text:
+                logger.debug(f"📝 Распознанный текст: {full_text[:200]}...")  # Первые 200 символов
             
-            body = {
-                "mimeType": mime_type,
-                "languageCodes": ["*"],  # Все языки
-                # Убираем model - используем дефолтную модель для лучшего качества
-                "content": encoded_content
-            }
+            # Если текст пустой, пробуем получить из blocks
+            if not full_text and 'blocks' in text_annotation:
+                blocks_text = []
+                for block in text_annotation.get('blocks', []):
+                    for line in block.get('lines', []):
+                        for word in line.get('words', []):
+                            word_text = word.get('text', '')
+                            if word_text:
+                                blocks_text.append(word_text)
+                if blocks_text:
+                    full_text = ' '.join(blocks_text)
+                    logger.info(f"📝 Текст восстановлен из blocks: {len(full_text)} символов")
             
-            # Логируем информацию об изображении
-            import struct
-            if len(image_content) > 2:
-                # Пытаемся определить размер изображения из заголовка
-                if image_content[:2] == b'\xff\xd8':  # JPEG
-                    logger.info(f"📸 JPEG изображение, размер файла: {len(image_content)} байт")
-                elif image_content[:8] == b'\x89PNG\r\n\x1a\n':  # PNG
-                    logger.info(f"📸 PNG изображение, размер файла: {len(image_content)} байт")
-                else:
-                    logger.info(f"📸 Изображение, размер файла: {len(image_content)} байт")
-            else:
-                logger.warning(f"⚠️ Изображение слишком маленькое: {len(image_content)} байт")
+            return (full_text if full_text else "Не удалось распознать текст на изображении."), True
+        else:
+            # Детальное логирование ошибки
+            error_text = ocr_body.decode('utf-8', 'replace')
+            logger.error(f"❌ Ошибка Yandex Vision API: {status}")
+            logger.error(f"📄 Ответ API: {error_text[:1000]}")  # Первые 1000 символов
             
-            # Отправляем запрос на распознавание
-            ocr_response = requests.post(
-                'https://ocr.api.cloud.yandex.net/ocr/v1/recognizeText',
-                headers=headers,
-                json=body,
-                timeout=30
-            )
+            # Пытаемся распарсить JSON ошибки
+            error_message = "Неизвестная ошибка"
+            try:
+                error_json = json.loads(ocr_body)
+                error_message = error_json.get('message', error_json.get('error', 'Неизвестная ошибка'))
+                error_code = error_json.get('code', error_json.get('error_code', ''))
+                logger.error(f"🔍 Код ошибки: {error_code}, Сообщение: {error_message}")
+            except Exception as parse_error:
+                # Если не JSON, пытаемся извлечь информацию из текста
+                logger.error(f"⚠️ Не удалось распарсить JSON ошибки: {parse_error}")
+                if error_text:
+                    # Пытаемся найти сообщение об ошибке в тексте
+                    if 'message' in error_text.lower() or 'error' in error_text.lower():
+                        error_message = error_text[:200]  # Первые 200 символов
+                    else:
+                        error_message = f"HTTP {status}: {error_text[:200]}"
             
-            if ocr_response.status_code == 200:
-                result = ocr_response.json().get('result', {})
-                text_annotation = result.get('textAnnotation', {})
-                full_text = text_annotation.get('fullText', '')
-                
-                # Логируем распознанный текст для отладки
-                logger.info(f"✅ Текст успешно распознан (аккаунт #{account_idx + 1}). Длина: {len(full_text)} символов.")
-                if full_text:
-                    logger.debug(f"📝 Распознанный текст: {full_text[:200]}...")  # Первые 200 символов
-                
-                # Если текст пустой, пробуем получить из blocks
-                if not full_text and 'blocks' in text_annotation:
-                    blocks_text = []
-                    for block in text_annotation.get('blocks', []):
-                        for line in block.get('lines', []):
-                            for word in line.get('words', []):
-                                word_text = word.get('text', '')
-                                if word_text:
-                                    blocks_text.append(word_text)
-                    if blocks_text:
-                        full_text = ' '.join(blocks_text)
-                        logger.info(f"📝 Текст восстановлен из blocks: {len(full_text)} символов")
-                
-                return full_text if full_text else "Не удалось распознать текст на изображении."
-            else:
-                # Детальное логирование ошибки
-                error_text = ocr_response.text
-                logger.error(f"❌ Ошибка Yandex Vision API: {ocr_response.status_code}")
-                logger.error(f"📄 Ответ API: {error_text[:1000]}")  # Первые 1000 символов
-                
-                # Пытаемся распарсить JSON ошибки
-                error_message = "Неизвестная ошибка"
-                try:
-                    error_json = ocr_response.json()
-                    error_message = error_json.get('message', error_json.get('error', 'Неизвестная ошибка'))
-                    error_code = error_json.get('code', error_json.get('error_code', ''))
-                    logger.error(f"🔍 Код ошибки: {error_code}, Сообщение: {error_message}")
-                except Exception as parse_error:
-                    # Если не JSON, пытаемся извлечь информацию из текста
-                    logger.error(f"⚠️ Не удалось распарсить JSON ошибки: {parse_error}")
-                    if error_text:
-                        # Пытаемся найти сообщение об ошибке в тексте
-                        if 'message' in error_text.lower() or 'error' in error_text.lower():
-                            error_message = error_text[:200]  # Первые 200 символов
-                        else:
-                            error_message = f"HTTP {ocr_response.status_code}: {error_text[:200]}"
-                
-                return f"Ошибка распознавания: {error_message}"
-
-        except requests.exceptions.Timeout:
-            logger.error("Тайм-аут при скачивании изображения или запросе к OCR.")
-            return "Ошибка: слишком долгое ожидание ответа при обработке изображения."
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка сети при обработке изображения: {e}")
-            return "Ошибка: не удалось загрузить или обработать изображение."
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка в recognize_text: {e}")
-            return "Произошла непредвиденная ошибка при распознавании текста."
+            return f"Ошибка распознавания: {error_message}", False
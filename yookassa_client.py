@@ -3,6 +3,7 @@ import uuid
 import logging
 from typing import Optional, Dict, Any, Tuple
 from config import Config
+from retry_policy import Deadline, DeadlineExceeded, RetryPolicy, is_retryable_status, retry_sync
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +13,8 @@ class YooKassaClient:
     def __init__(self):
         self.shop_id = str(Config.YOOKASSA_SHOP_ID).strip() if Config.YOOKASSA_SHOP_ID else None
         self.api_key = str(Config.YOOKASSA_API_KEY).strip() if Config.YOOKASSA_API_KEY else None
-        self.base_url = "https://api.yookassa.ru/v3"
+        self.base_url = Config.YOOKASSA_BASE_URL.rstrip('/')
+        self.retry_policy = RetryPolicy()
         
         # Детальное логирование для диагностики
         logger.info(f"Инициализация YooKassaClient:")
@@ -27,7 +29,20 @@ class YooKassaClient:
             logger.error("❌ YOOKASSA_API_KEY не настроен!")
             logger.error("   Проверьте config.env - должен быть указан полный ключ")
         
-    def create_payment(self, amount: float, description: str, user_id: int, payment_type: str) -> Tuple[Optional[Dict], Optional[str]]:
+    def _request(self, method: str, url: str, deadline: Optional[Deadline] = None, **kwargs) -> requests.Response:
+        """
+        HTTP-запрос с повторами при сетевых ошибках, 429 и 5xx.
+        Для POST повтор безопасен только с тем же Idempotence-Key в заголовках
+        """
+        return retry_sync(
+            lambda timeout: requests.request(method, url, auth=(self.shop_id, self.api_key), timeout=timeout, **kwargs),
+            'yookassa', 10, deadline, self.retry_policy,
+            should_retry=lambda response: is_retryable_status(response.status_code),
+            retry_exceptions=(requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        )
+
+    def create_payment(self, amount: float, description: str, user_id: int, payment_type: str,
+                       deadline: Optional[Deadline] = None) -> Tuple[Optional[Dict], Optional[str]]:
         """
         Создает платеж в ЮКассе
         
@@ -36,6 +51,7 @@ class YooKassaClient:
             description: Описание платежа
             user_id: ID пользователя VK
             payment_type: Тип платежа (lite/premium/tokens/photo)
+            deadline: Дедлайн обработки сообщения (ограничивает повторы)
             
         Returns:
             Кортеж (payment_data, error_type):
@@ -51,6 +67,7 @@ class YooKassaClient:
                 logger.error("❌ API Key не настроен! Невозможно создать платеж.")
                 return None, 'config'
             
+            # Один ключ на все повторы: ЮКасса не создаст второй платеж, если первый запрос дошел
             idempotence_key = str(uuid.uuid4())
             
             payload = {
@@ -95,12 +112,12 @@ class YooKassaClient:
             logger.info(f"Создание платежа: сумма={amount}₽, тип={payment_type}, user_id={user_id}")
             logger.debug(f"Shop ID: {self.shop_id}, API Key: {self.api_key[:15]}...")
             
-            response = requests.post(
+            response = self._request(
+                'POST',
                 f"{self.base_url}/payments",
+                deadline,
                 json=payload,
-                headers=headers,
-                auth=(self.shop_id, self.api_key),
-                timeout=10
+                headers=headers
             )
             
             if response.status_code in [200, 201]:
@@ -152,29 +169,26 @@ class YooKassaClient:
                 
                 return None, 'config'
                 
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.RequestException) as e:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.RequestException, DeadlineExceeded) as e:
             logger.error(f"Сетевая ошибка при создании платежа: {e}")
             return None, 'network'
         except Exception as e:
             logger.error(f"Исключение при создании платежа: {e}")
             return None, 'config'
     
-    def check_payment_status(self, payment_id: str) -> Optional[Dict]:
+    def check_payment_status(self, payment_id: str, deadline: Optional[Deadline] = None) -> Optional[Dict]:
         """
         Проверяет статус платежа
         
         Args:
             payment_id: ID платежа в ЮКассе
+            deadline: Дедлайн обработки сообщения (ограничивает повторы)
             
         Returns:
             Словарь с данными платежа или None при ошибке
         """
         try:
-            response = requests.get(
-                f"{self.base_url}/payments/{payment_id}",
-                auth=(self.shop_id, self.api_key),
-                timeout=10
-            )
+            response = self._request('GET', f"{self.base_url}/payments/{payment_id}", deadline)
             
             if response.status_code == 200:
                 return response.json()
@@ -186,17 +200,18 @@ class YooKassaClient:
             logger.error(f"Исключение при проверке статуса платежа: {e}")
             return None
     
-    def is_payment_succeeded(self, payment_id: str) -> bool:
+    def is_payment_succeeded(self, payment_id: str, deadline: Optional[Deadline] = None) -> bool:
         """
         Проверяет, успешно ли завершен платеж
         
         Args:
             payment_id: ID платежа в ЮКассе
+            deadline: Дедлайн обработки сообщения (ограничивает повторы)
             
         Returns:
             True если платеж успешен, False иначе
         """
-        payment_data = self.check_payment_status(payment_id)
+        payment_data = self.check_payment_status(payment_id, deadline)
         if payment_data:
             return payment_data.get('status') == 'succeeded'
         return False